@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""Compact structured traces of browser agent runs, and their evaluator summaries.
+
+str(AgentHistoryList) repeats every DOM element's coordinates, CSS selector and
+class list, so a dozen clicks make a 15 KB log entry and a prompt to match.
+compact_trace keeps only what a reader or the evaluator needs: one record per
+action with its name, arguments, target element, outcome, error and timing.
+The run log stores it gzip-compressed (encode_trace), and summarize_trace
+renders it deterministically within a token budget for the evaluator. The
+budget always keeps errors and the final result, then as many leading and
+trailing actions as fit.
+
+    EVAL_TRACE_TOKENS    evaluator trace budget (default 1500)
+
+    python agent_trace.py measure                       # sizes and tokens on browser_agent_logs.json
+    python agent_trace.py measure --evaluate --runs 3   # plus evaluator latency, needs TOGETHER_API_KEY
+"""
+import argparse
+import ast
+import gzip
+import json
+import os
+import re
+import statistics
+import time
+
+TRACE_VERSION = 1
+CHARS_PER_TOKEN = 4
+MAX_FIELD_CHARS = 300
+# Element attributes that identify a target to a human; the rest (classes, styles, coordinates) are dropped
+TARGET_ATTRIBUTES = ("id", "name", "aria-label", "placeholder", "title", "type", "href", "role")
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _clip(value, limit=MAX_FIELD_CHARS):
+    if value is None:
+        return None
+    value = str(value)
+    return value if len(value) <= limit else value[:limit - 3] + "..."
+
+
+def _target(tag_name, attributes):
+    if not tag_name:
+        return None
+    selectors = "".join(f"[{key}={_clip(attributes[key], 80)}]" for key in TARGET_ATTRIBUTES
+                        if attributes and attributes.get(key))
+    return f"{tag_name}{selectors}"
+
+
+def _action(name, args, target, result, seconds=None, url=None):
+    action = {"action": name, "args": {key: _clip(value, 120) for key, value in (args or {}).items()}}
+    if target:
+        action["target"] = target
+    if result is not None:
+        if getattr(result, "extracted_content", None):
+            action["result"] = _clip(result.extracted_content)
+        if getattr(result, "error", None):
+            action["error"] = _clip(result.error)
+        if getattr(result, "is_done", False):
+            action["done"] = True
+    if url:
+        action["url"] = url
+    if seconds is not None:
+        action["seconds"] = round(seconds, 2)
+    return action
+
+
+def compact_trace(history):
+    """Structured trace of a browser-use AgentHistoryList (or a list of them, from a streamed run)"""
+    if isinstance(history, list):
+        traces = [compact_trace(item) for item in history]
+        return {"version": TRACE_VERSION, "actions": [a for t in traces for a in t["actions"]],
+                "final_result": traces[-1]["final_result"] if traces else None,
+                "errors": sum(t["errors"] for t in traces),
+                "duration_seconds": round(sum(t["duration_seconds"] or 0 for t in traces), 2)}
+    if isinstance(history, str):
+        return parse_trace(history)
+    actions, last_url = [], None
+    for item in getattr(history, "history", None) or []:
+        metadata = getattr(item, "metadata", None)
+        seconds = None
+        if metadata is not None and getattr(metadata, "step_end_time", None):
+            seconds = metadata.step_end_time - metadata.step_start_time
+        state = getattr(item, "state", None)
+        url = getattr(state, "url", None)
+        elements = getattr(state, "interacted_element", None) or []
+        model_actions = getattr(getattr(item, "model_output", None), "action", None) or []
+        results = getattr(item, "result", None) or []
+        for i in range(max(len(model_actions), len(results))):
+            name, args = "unknown", {}
+            if i < len(model_actions):
+                dumped = model_actions[i].model_dump(exclude_unset=True)
+                if dumped:
+                    name, args = next(iter(dumped.items()))
+            element = elements[i] if i < len(elements) else None
+            target = _target(getattr(element, "tag_name", None), getattr(element, "attributes", None))
+            actions.append(_action(name, args if isinstance(args, dict) else {"value": args}, target,
+                                   results[i] if i < len(results) else None,
+                                   seconds if i == 0 else None, url if url != last_url else None))
+            last_url = url
+    final_result = history.final_result() if callable(getattr(history, "final_result", None)) else None
+    duration = getattr(history, "total_duration_seconds", None)
+    return {"version": TRACE_VERSION, "actions": actions, "final_result": _clip(final_result, 1000),
+            "errors": sum(1 for action in actions if "error" in action),
+            "duration_seconds": round(duration(), 2) if callable(duration) else None}
+
+
+_RESULT = re.compile(r"ActionResult\(is_done=(True|False), extracted_content=(None|'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"), "
+                     r"error=(None|'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+_OUTPUT = re.compile(r"\{'(\w+)': (\{.*?\}|None), 'interacted_element': (None|DOMHistoryElement\(tag_name='(\w+)'.*?"
+                     r"attributes=(\{.*?\}), shadow_root=)")
+
+
+def _literal(text, default=None):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return default
+
+
+def parse_trace(text):
+    """Structured trace from the str() of an AgentHistoryList, as older log entries store it"""
+    if not text.startswith("AgentHistoryList("):
+        return {"version": TRACE_VERSION, "actions": [], "final_result": _clip(text, 1000), "errors": 0,
+                "duration_seconds": None}
+    split = text.find("all_model_outputs=")
+    results = [type("ActionResult", (), {"is_done": done == "True", "extracted_content": _literal(content),
+                                         "error": _literal(error)})
+               for done, content, error in _RESULT.findall(text[:split])]
+    outputs = _OUTPUT.findall(text[split:]) if split >= 0 else []
+    actions = []
+    for i in range(max(len(results), len(outputs))):
+        name, args, target = "unknown", {}, None
+        if i < len(outputs):
+            name, args_text, _, tag_name, attributes_text = outputs[i]
+            args = _literal(args_text, {"raw": args_text}) or {}
+            target = _target(tag_name, _literal(attributes_text, {}))
+        actions.append(_action(name, args, target, results[i] if i < len(results) else None))
+    done = [action.get("result") for action in actions if action.get("done")]
+    return {"version": TRACE_VERSION, "actions": actions, "final_result": done[-1] if done else None,
+            "errors": sum(1 for action in actions if "error" in action), "duration_seconds": None}
+
+
+def encode_trace(trace):
+    """gzip-compressed JSON for the run log"""
+    return gzip.compress(json.dumps(trace, separators=(",", ":")).encode(), mtime=0)
+
+
+def decode_trace(data):
+    return json.loads(gzip.decompress(data))
+
+
+def _render(index, action):
+    line = f"{index}. {action['action']}"
+    args = {key: value for key, value in action.get("args", {}).items() if key != "index"}
+    if args:
+        line += " " + json.dumps(args, ensure_ascii=False)
+    if action.get("target"):
+        line += f" on {action['target']}"
+    if action.get("result"):
+        line += f" -> {action['result']}"
+    if action.get("error"):
+        line += f" !! ERROR: {action['error']}"
+    if action.get("seconds") is not None:
+        line += f" ({action['seconds']}s)"
+    return line
+
+
+def summarize_trace(trace, max_tokens=None):
+    """Deterministic text rendering of a trace within max_tokens (estimated).
+
+    Errors, the final result and the header are always kept; the remaining budget goes to
+    actions from both ends of the run, and skipped runs of actions are replaced by a count.
+    """
+    max_tokens = max_tokens or int(os.getenv("EVAL_TRACE_TOKENS", "1500"))
+    actions = trace.get("actions", [])
+    header = f"{len(actions)} actions, {trace.get('errors', 0)} errors"
+    if trace.get("duration_seconds"):
+        header += f", {trace['duration_seconds']}s"
+    footer = f"Final result: {trace.get('final_result')}"
+    lines = [_render(i, action) for i, action in enumerate(actions, 1)]
+    if estimate_tokens("\n".join([header, *lines, footer])) <= max_tokens:
+        return "\n".join([header, *lines, footer])
+
+    budget = max_tokens - estimate_tokens(header) - estimate_tokens(footer)
+    keep = set()
+    # Errors first, then alternate between the start and the end of the run
+    order = [i for i, action in enumerate(actions) if "error" in action]
+    for offset in range(len(actions)):
+        order += [offset, len(actions) - 1 - offset]
+    for i in order:
+        if i in keep:
+            continue
+        # Reserve room for an omission marker
+        cost = estimate_tokens(lines[i]) + 10
+        if cost > budget:
+            continue
+        keep.add(i)
+        budget -= cost
+    output, skipped = [header], []
+    for i, action in enumerate(actions):
+        if i in keep:
+            if skipped:
+                output.append(_omitted(skipped))
+                skipped = []
+            output.append(lines[i])
+        else:
+            skipped.append(action)
+    if skipped:
+        output.append(_omitted(skipped))
+    output.append(footer)
+    return "\n".join(output)
+
+
+def _omitted(actions):
+    counts = {}
+    for action in actions:
+        counts[action["action"]] = counts.get(action["action"], 0) + 1
+    return f"... {len(actions)} actions omitted ({', '.join(f'{name} x{n}' for name, n in counts.items())}) ..."
+
+
+def evaluator_trace(entry, max_tokens=None):
+    """Budgeted trace text for a run log entry, old (raw result string) or new (compact trace)"""
+    trace = entry.get("trace")
+    if trace is None:
+        trace = parse_trace(str(entry.get("result", "")))
+    return summarize_trace(trace, max_tokens)
+
+
+def measure(entries, max_tokens=None, together_client=None, runs=1):
+    """Log bytes and evaluator prompt tokens (and latency with a client) before and after"""
+    from evaluator import EVALUATOR_PROMPT, Evaluation, evaluate
+    report = {"entries": len(entries), "raw_bytes": 0, "compact_bytes": 0, "gzip_bytes": 0,
+              "raw_prompt_tokens": 0, "summary_prompt_tokens": 0}
+    latencies = {"raw": [], "summary": []}
+    for entry in entries:
+        raw = str(entry.get("result", ""))
+        trace = parse_trace(raw)
+        summary = summarize_trace(trace, max_tokens)
+        report["raw_bytes"] += len(raw.encode())
+        report["compact_bytes"] += len(json.dumps(trace, separators=(",", ":")).encode())
+        report["gzip_bytes"] += len(encode_trace(trace))
+        prompt = lambda text: EVALUATOR_PROMPT.format(task=entry.get("task"), steps=entry.get("steps"), trace=text,
+                                                      feedback=entry.get("feedback"), comment=entry.get("comment"))
+        report["raw_prompt_tokens"] += estimate_tokens(prompt(raw))
+        report["summary_prompt_tokens"] += estimate_tokens(prompt(summary))
+        if together_client is not None:
+            for _ in range(runs):
+                for kind, text in (("raw", raw), ("summary", summary)):
+                    start = time.perf_counter()
+                    evaluate(together_client, Evaluation, entry.get("task"), entry.get("steps"), text,
+                             entry.get("feedback"), entry.get("comment"))
+                    latencies[kind].append(time.perf_counter() - start)
+    report["bytes_reduction"] = 1 - report["gzip_bytes"] / report["raw_bytes"] if report["raw_bytes"] else None
+    report["prompt_token_reduction"] = (1 - report["summary_prompt_tokens"] / report["raw_prompt_tokens"]
+                                        if report["raw_prompt_tokens"] else None)
+    if latencies["raw"]:
+        report["eval_latency_p50_raw"] = statistics.median(latencies["raw"])
+        report["eval_latency_p50_summary"] = statistics.median(latencies["summary"])
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact agent traces")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    measure_parser = subparsers.add_parser("measure", help="Compare raw and compact traces of logged runs")
+    measure_parser.add_argument("--log", default="browser_agent_logs.json")
+    measure_parser.add_argument("--max-tokens", type=int, help="Evaluator trace budget")
+    measure_parser.add_argument("--evaluate", action="store_true", help="Also time the evaluator on both")
+    measure_parser.add_argument("--runs", type=int, default=1, help="Evaluator calls per entry and variant")
+    show = subparsers.add_parser("show", help="Print the compact trace and evaluator summary of logged runs")
+    show.add_argument("--log", default="browser_agent_logs.json")
+    show.add_argument("--max-tokens", type=int)
+    args = parser.parse_args()
+
+    with open(args.log) as f:
+        entries = json.load(f)
+    if args.command == "show":
+        for entry in entries:
+            trace = parse_trace(str(entry.get("result", "")))
+            print(json.dumps(trace, indent=2, ensure_ascii=False))
+            print(summarize_trace(trace, args.max_tokens))
+        return
+    client = None
+    if args.evaluate:
+        from together import Together
+        client = Together(api_key=os.environ["TOGETHER_API_KEY"])
+    print(json.dumps(measure(entries, args.max_tokens, client, args.runs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Offline batch evaluation of recorded agent runs.
+
+Replays runs from the run log through the LLM evaluator concurrently:
+
+- asyncio with a configurable number of in-flight requests
+- a token-bucket rate limiter for the provider's requests/sec budget
+- retries of transient errors (timeouts, dropped connections, rate limits, 5xx) with
+  exponential backoff and jitter
+- a result cache keyed by (prompt hash, model), so re-scoring is free
+
+    python batch_eval.py --concurrency 16 --rate 8 --feedback negative
+    python batch_eval.py --fake --limit 1000      # benchmark the pipeline offline
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+from agent_trace import evaluator_trace
+from evaluator import EVAL_MODEL, EVALUATOR_PROMPT, Evaluation, JSON_llm
+from run_log import DEFAULT_LOG_PATH, RunLog
+
+DEFAULT_CACHE_PATH = "eval_cache.db"
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class EvalCache:
+    """Evaluator responses keyed by (sha256 of the prompt, model)"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS results (prompt_hash TEXT, model TEXT, response TEXT, "
+                         "PRIMARY KEY (prompt_hash, model))")
+
+    def get(self, prompt_hash, model):
+        with self._lock:
+            row = self._db.execute("SELECT response FROM results WHERE prompt_hash = ? AND model = ?",
+                                   (prompt_hash, model)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, prompt_hash, model, response):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                             (prompt_hash, model, json.dumps(response)))
+
+
+class FakeEvalClient:
+    """Stand-in for the Together client: fixed latency, random failures, deterministic verdicts"""
+
+    def __init__(self, latency=0.2, failure_rate=0.05, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, messages, model, response_format=None):
+        time.sleep(self.latency)
+        if self._random.random() < self.failure_rate:
+            raise ConnectionError("fake transient failure")
+        digest = hashlib.sha256(messages[-1]["content"].encode()).digest()
+        verdict = ("PASS", "NEEDS_IMPROVEMENT", "FAIL")[digest[0] % 3]
+        content = json.dumps({"evaluation": verdict, "feedback": f"fake verdict for {digest[:4].hex()}"})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def build_prompt(run):
+    return EVALUATOR_PROMPT.format(task=run.get("task", ""), steps=run.get("steps", ""),
+                                   trace=evaluator_trace(run), feedback=run.get("feedback", ""),
+                                   comment=run.get("comment", ""))
+
+
+# Provider errors worth retrying, matched by name so the together client stays an optional import
+TRANSIENT_ERROR_NAMES = frozenset({"RateLimitError", "Timeout", "APITimeoutError", "APIConnectionError",
+                                   "ServiceUnavailableError", "InternalServerError"})
+
+
+def is_transient(error):
+    """Timeouts, connection failures, rate limits and 5xx responses; not bad input, auth or bad output"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in TRANSIENT_ERROR_NAMES:
+        return True
+    status = getattr(error, "status_code", None) or getattr(error, "http_status", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+async def evaluate_run(run, client, model, cache, bucket, semaphore, retries, timeout, stats):
+    """Evaluate one run, consulting the cache first and retrying transient failures"""
+    prompt = build_prompt(run)
+    prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
+    response = cache.get(prompt_hash, model)
+    if response is not None:
+        stats["cache_hits"] += 1
+        return {"id": run.get("id"), "task": run.get("task"), "cached": True, **response}
+
+    async with semaphore:
+        for attempt in range(retries + 1):
+            await bucket.acquire()
+            start = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(
+                    asyncio.to_thread(JSON_llm, client, prompt, Evaluation, None, model), timeout)
+                Evaluation(**response)
+                break
+            except Exception as e:
+                if attempt == retries or not is_transient(e):
+                    stats["errors"] += 1
+                    return {"id": run.get("id"), "task": run.get("task"), "error": f"{type(e).__name__}: {e}"}
+                stats["retries"] += 1
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, min(30.0, 0.5 * 2 ** attempt)))
+            finally:
+                stats["latencies"].append(time.perf_counter() - start)
+
+    cache.put(prompt_hash, model, response)
+    return {"id": run.get("id"), "task": run.get("task"), "cached": False, **response}
+
+
+async def evaluate_runs(runs, client, model=EVAL_MODEL, cache=None, concurrency=8, rate=4.0,
+                        retries=3, timeout=60.0, on_result=None):
+    """Evaluate runs concurrently; calls on_result(result) as each one finishes"""
+    cache = cache or EvalCache()
+    bucket = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"cache_hits": 0, "retries": 0, "errors": 0, "latencies": []}
+    start = time.perf_counter()
+
+    tasks = [asyncio.create_task(evaluate_run(run, client, model, cache, bucket, semaphore, retries, timeout, stats))
+             for run in runs]
+    results = []
+    for task in asyncio.as_completed(tasks):
+        result = await task
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    elapsed = time.perf_counter() - start
+    latencies = sorted(stats.pop("latencies"))
+    stats.update({
+        "runs": len(results),
+        "elapsed_seconds": elapsed,
+        "runs_per_second": len(results) / elapsed if elapsed else 0.0,
+        "call_p50": latencies[len(latencies) // 2] if latencies else None,
+        "call_p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+    })
+    return results, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score recorded agent runs with the LLM evaluator")
+    parser.add_argument("--db", default=os.getenv("RUN_LOG_PATH", DEFAULT_LOG_PATH), help="Run log database")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="Evaluation result cache")
+    parser.add_argument("--model", default=EVAL_MODEL)
+    parser.add_argument("--concurrency", type=int, default=8, help="Max in-flight evaluator calls")
+    parser.add_argument("--rate", type=float, default=4.0, help="Max evaluator calls per second")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-call timeout in seconds")
+    parser.add_argument("--feedback", choices=["positive", "negative"])
+    parser.add_argument("--task", dest="task_contains", help="Substring of the task")
+    parser.add_argument("--since", help="ISO timestamp lower bound")
+    parser.add_argument("--limit", type=int)
+    parser.add_argument("--write-back", action="store_true", help="Store evaluations on the runs in the log")
+    parser.add_argument("--fake", action="store_true", help="Use the offline fake evaluator client")
+    parser.add_argument("--fake-latency", type=float, default=0.2)
+    parser.add_argument("--fake-runs", type=int, help="With --fake, replay the log cyclically up to N runs")
+    args = parser.parse_args()
+    if args.fake and args.write_back:
+        parser.error("--write-back cannot be combined with --fake")
+
+    run_log = RunLog(args.db)
+    runs = list(run_log.query(limit=args.limit, feedback=args.feedback,
+                              task_contains=args.task_contains, since=args.since))
+    model = args.model
+    if args.fake:
+        client = FakeEvalClient(latency=args.fake_latency)
+        # Fake verdicts get their own cache key, so a later real run never reuses them
+        model = f"fake:{args.model}"
+        if args.fake_runs and runs:
+            # Vary the comment so every synthetic run has its own prompt hash
+            runs = [dict(runs[i % len(runs)], id=None, comment=f"synthetic {i}") for i in range(args.fake_runs)]
+    else:
+        from together import Together
+        api_key = os.getenv("TOGETHER_API_KEY")
+        if not api_key:
+            print("Error: Please set the TOGETHER_API_KEY environment variable.")
+            sys.exit(1)
+        client = Together(api_key=api_key)
+
+    def on_result(result):
+        print(json.dumps(result), flush=True)
+        if args.write_back and result.get("id") is not None and "evaluation" in result:
+            run_log.update(result["id"], evaluation=result["evaluation"], evaluation_feedback=result["feedback"])
+
+    _, stats = asyncio.run(evaluate_runs(runs, client, model, EvalCache(args.cache), args.concurrency,
+                                         args.rate, args.retries, args.timeout, on_result))
+    print(json.dumps(stats), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Non-interactive batch execution of browser tasks.
+
+Tasks are read as JSON lines ({"task": "...", "id": "..."}; a bare JSON string or
+plain text line also works). Resolution (plan cache lookup or documentation
+search plus Gemini) runs in threads with bounded concurrency and feeds a queue
+drained by N browser workers, so plans for upcoming tasks are generated while
+earlier ones are still in the browser. Each finished task is evaluated by the
+LLM evaluator in place of human feedback and reported as soon as it completes.
+Each task is one request in the span log: its resolve, browser and evaluation
+spans share the trace id reported in its result.
+
+    python cli_browser_agent.py --batch tasks.jsonl --workers 4 --output results.jsonl
+    cat tasks.jsonl | python cli_browser_agent.py --batch - --workers 2
+"""
+import asyncio
+import json
+import time
+
+from spans import activate, end_span, start_span
+
+
+def read_tasks(lines):
+    """Parse task lines into [{"id": ..., "task": ...}], skipping blanks"""
+    tasks = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except json.JSONDecodeError:
+            item = line
+        if isinstance(item, str):
+            item = {"task": item}
+        if not isinstance(item, dict) or not item.get("task"):
+            print(f"Warning: skipping line {number} without a task")
+            continue
+        tasks.append({**item, "id": item.get("id", len(tasks) + 1)})
+    return tasks
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+async def run_batch(tasks, resolve, execute, record, workers=2, resolve_concurrency=4, on_result=None):
+    """Resolve tasks concurrently and execute them on `workers` browser workers.
+
+    resolve(task) -> plan dict with "steps" (None when there is nothing to run) runs in a thread,
+    execute(steps) is awaited on a worker, and record(task, plan, result) -> run log entry
+    runs in a thread. on_result(result) is called as each task finishes. Returns summary stats.
+    """
+    semaphore = asyncio.Semaphore(resolve_concurrency)
+    # Bounded so resolution never runs far ahead of the browsers
+    queue = asyncio.Queue(maxsize=max(1, workers * 2))
+    results = []
+    start = time.perf_counter()
+
+    def finish(item, submitted, request, **fields):
+        result = {"id": item["id"], "task": item["task"], **fields,
+                  "latency_seconds": round(time.perf_counter() - submitted, 3)}
+        if request is not None:
+            result["trace"] = request["trace"]
+        # The span log keeps only the error's kind ("resolve", the exception type, ...), not its message
+        end_span(request, fields["error"].split(":")[0] if "error" in fields else None)
+        results.append(result)
+        if on_result:
+            on_result(result)
+
+    async def resolve_one(item):
+        submitted = time.perf_counter()
+        request = start_span("request", mode="batch", id=item["id"])
+        async with semaphore:
+            try:
+                with activate(request):
+                    plan = await asyncio.to_thread(resolve, item["task"])
+            except Exception as e:
+                finish(item, submitted, request, error=f"resolve: {type(e).__name__}: {e}")
+                return
+        if plan.get("steps") is None:
+            finish(item, submitted, request, plan_source=plan.get("source"), error="no steps generated",
+                   response=plan.get("text"))
+            return
+        await queue.put((item, plan, submitted, request))
+
+    async def worker():
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            item, plan, submitted, request = entry
+            fields = {"plan_source": plan.get("source"), "plan_id": plan.get("plan_id"), "steps": plan["steps"]}
+            try:
+                with activate(request):
+                    execute_start = time.perf_counter()
+                    history = await execute(plan["steps"])
+                    fields["execute_seconds"] = round(time.perf_counter() - execute_start, 3)
+                    final_result = getattr(history, "final_result", None)
+                    if callable(final_result):
+                        fields["final_result"] = final_result()
+                    log_entry = await asyncio.to_thread(record, item["task"], plan, history)
+                    fields.update(run_id=log_entry.get("id"), evaluation=log_entry.get("evaluation"),
+                                  evaluation_feedback=log_entry.get("evaluation_feedback"))
+            except Exception as e:
+                fields["error"] = f"{type(e).__name__}: {e}"
+            finish(item, submitted, request, **fields)
+
+    worker_tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+    await asyncio.gather(*(resolve_one(item) for item in tasks))
+    for _ in worker_tasks:
+        await queue.put(None)
+    await asyncio.gather(*worker_tasks)
+
+    elapsed = time.perf_counter() - start
+    latencies = sorted(result["latency_seconds"] for result in results)
+    evaluations = [result.get("evaluation") for result in results]
+    return {
+        "tasks": len(results),
+        "errors": sum(1 for result in results if "error" in result),
+        "passed": evaluations.count("PASS"),
+        "failed": evaluations.count("FAIL"),
+        "elapsed_seconds": round(elapsed, 3),
+        "tasks_per_second": len(results) / elapsed if elapsed else 0.0,
+        "latency_p50": _percentile(latencies, 0.5),
+        "latency_p95": _percentile(latencies, 0.95),
+        "latency_p99": _percentile(latencies, 0.99),
+    }
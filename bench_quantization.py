@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Memory / latency / recall trade-off of the local index storage modes.
+
+Loads the descriptors of a local set (or generates a clustered synthetic
+corpus of the same dimensionality), builds one temporary set per storage mode,
+and searches it with held-out noisy copies of corpus vectors. Recall is
+measured against exact float32 search, for several re-rank factors
+(0 = approximate scores only).
+
+    python bench_quantization.py --set vector_index/pdf_instructions_image_text
+    python bench_quantization.py --synthetic 20000 --output bench_quantization.json
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import vector_index
+from quantization import STORAGE_MODES
+from vector_index import DescriptorSet
+
+
+def load_set_vectors(path):
+    """Live float32 vectors of an existing local descriptor set"""
+    descriptor_set = DescriptorSet(path)
+    return np.asarray(descriptor_set.vectors[:descriptor_set.count])[descriptor_set.live]
+
+
+def synthetic_vectors(n, dimensions=1024, clusters=64, noise=0.6, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimensions))
+    vectors = centers[rng.integers(0, clusters, n)] + noise * rng.normal(size=(n, dimensions))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def make_queries(vectors, n_queries, noise=0.3, seed=1):
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), n_queries)] + noise * rng.normal(size=(n_queries, vectors.shape[1])) \
+        / np.sqrt(vectors.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def hot_bytes(descriptor_set):
+    """Bytes scanned per search: compressed codes (plus PQ codebooks), or the float32 vectors"""
+    if descriptor_set.codec is None:
+        return descriptor_set.count * descriptor_set.vectors.shape[1] * 4
+    total = sum(descriptor_set.count * int(np.prod(codes.shape[1:], dtype=np.int64)) * codes.itemsize
+                for codes in descriptor_set.codes.values())
+    codebooks = getattr(descriptor_set.codec, "codebooks", None)
+    return total + (codebooks.nbytes if codebooks is not None else 0)
+
+
+def benchmark(vectors, queries, modes, rerank_factors, k, engine, work_dir):
+    exact = [set(np.argsort(-(vectors @ query))[:k].tolist()) for query in queries]
+    top1 = [int(np.argmax(vectors @ query)) for query in queries]
+    results = []
+    for storage in modes:
+        path = os.path.join(work_dir, storage)
+        start = time.perf_counter()
+        descriptor_set = DescriptorSet.create(path, vectors.shape[1], engine, "IP", storage)
+        for offset in range(0, len(vectors), 1000):
+            batch = vectors[offset:offset + 1000]
+            descriptor_set.add(batch, [{"row": offset + i} for i in range(len(batch))])
+        build_seconds = time.perf_counter() - start
+        memory = hot_bytes(descriptor_set)
+        for factor in (rerank_factors if storage != "float32" else [0]):
+            vector_index.RERANK_FACTOR = factor
+            latencies, recall, recall_1 = [], 0.0, 0
+            for query, truth, best in zip(queries, exact, top1):
+                start = time.perf_counter()
+                hits = descriptor_set.search(query, k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                rows = [row for row, _ in hits]
+                recall += len(truth.intersection(rows)) / k
+                recall_1 += bool(rows) and rows[0] == best
+            latencies.sort()
+            results.append({
+                "storage": storage,
+                "rerank_factor": factor,
+                "engine": engine,
+                "vectors": len(vectors),
+                "hot_bytes_per_vector": memory / len(vectors),
+                "hot_mb": memory / 2 ** 20,
+                "compression": len(vectors) * vectors.shape[1] * 4 / memory,
+                "build_seconds": build_seconds,
+                "latency_p50_ms": latencies[len(latencies) // 2],
+                "latency_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                f"recall@{k}": recall / len(queries),
+                "recall@1": recall_1 / len(queries),
+            })
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare float32/float16/int8/PQ descriptor storage")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--set", help="Path of a local descriptor set to take vectors from")
+    source.add_argument("--synthetic", type=int, default=10000, help="Synthetic 1024-d corpus size")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--modes", nargs="+", choices=STORAGE_MODES, default=list(STORAGE_MODES))
+    parser.add_argument("--rerank-factors", nargs="+", type=int, default=[0, 4, 10])
+    parser.add_argument("--engine", choices=vector_index.LocalConnector.ENGINES, default="Flat")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--output", default="bench_quantization.json")
+    args = parser.parse_args()
+
+    vectors = load_set_vectors(args.set) if args.set else synthetic_vectors(args.synthetic)
+    queries = make_queries(vectors, args.queries)
+    work_dir = tempfile.mkdtemp(prefix="bench_quantization_")
+    try:
+        results = benchmark(vectors, queries, args.modes, args.rerank_factors, args.k, args.engine, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as f:
+        json.dump({"source": args.set or f"synthetic:{args.synthetic}", "dimensions": int(vectors.shape[1]),
+                   "queries": args.queries, "results": results}, f, indent=2)
+    print(f"{'storage':<9}{'rerank':>7}{'B/vec':>8}{'x':>6}{'p50 ms':>9}{'p95 ms':>9}{f'R@{args.k}':>7}{'R@1':>6}")
+    for r in results:
+        print(f"{r['storage']:<9}{r['rerank_factor']:>7}{r['hot_bytes_per_vector']:>8.0f}{r['compression']:>6.1f}"
+              f"{r['latency_p50_ms']:>9.2f}{r['latency_p95_ms']:>9.2f}{r[f'recall@{args.k}']:>7.3f}{r['recall@1']:>6.2f}")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""Offline retrieval benchmark over the bundled Scribe PDFs.
+
+Builds a throwaway local index (vector_index.LocalConnector) per model and
+engine from the headings of the four bundled PDFs, plus the images in
+extracted_images for SigLIP, with the document centroids and BM25 heading index
+ingestion would build. It then runs the labeled queries in
+benchmark_queries.jsonl through retrieval_service, as the CLI does, and reports:
+
+- ingest throughput (encode and index items/sec)
+- query latency percentiles
+- memory (RSS growth from model load and encoding, index size on disk)
+- document-level recall@1, recall@k and MRR
+
+Each model is measured twice: "service" is the production path, broken down by
+the queries the BM25 fast path answered and those that took the two-stage dense
+search; "two_stage" disables the fast path so every query takes the dense search.
+
+Models: minilm (text path, pdf_instructions_correct2), siglip (multimodal path,
+pdf_instructions_image_text) and hashing (dependency-free baseline, searched with
+a single flat k-NN pass since the service has no hashing path).
+Models load from the local Hugging Face cache only, unless --allow-download is
+given. Results are written as JSON for comparison between runs.
+
+    python bench_retrieval.py --models minilm siglip --engines Flat IVF --output bench_results.json
+    python bench_retrieval.py seed        # add logged tasks to the query file for labeling
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import doc_index
+from lexical_index import LexicalIndex
+from retrieval_service import DEFAULT_SETS, RetrievalService
+from vector_index import LocalConnector
+
+BUNDLED_PDFS = ["create_organization.pdf", "create_new_user.pdf", "invite_team_member.pdf", "create_new_project.pdf"]
+DEFAULT_QUERIES_PATH = "benchmark_queries.jsonl"
+DEFAULT_IMAGES_DIR = "extracted_images"
+HASHING_DIMENSIONS = 512
+
+
+def _rss_mb():
+    """Current resident set size of this process in MB"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # Peak, not current, where /proc is unavailable (ru_maxrss is KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda fraction: values[min(len(values) - 1, int(len(values) * fraction))]
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "mean": sum(values) / len(values),
+            "max": values[-1]}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_queries(path=DEFAULT_QUERIES_PATH):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_corpus(pdf_paths, images_dir=DEFAULT_IMAGES_DIR, with_images=True):
+    """Headings per PDF as [(pdf_name, text)] and extracted images as [(pdf_name, image_index, path)]"""
+    from pdf_extract import iter_pdf_pages
+    texts = []
+    for pdf_path in pdf_paths:
+        pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+        for record in iter_pdf_pages(pdf_path):
+            texts.extend((pdf_name, heading) for heading in record["headings"])
+    images = []
+    pdf_names = {os.path.splitext(os.path.basename(p))[0] for p in pdf_paths}
+    if with_images and os.path.isdir(images_dir):
+        for file_name in sorted(os.listdir(images_dir)):
+            match = re.match(r"(.+)_image_(\d+)\.png$", file_name)
+            if match and match.group(1) in pdf_names:
+                images.append((match.group(1), int(match.group(2)), os.path.join(images_dir, file_name)))
+    return texts, images
+
+
+class HashingModel:
+    """Signed feature hashing of word unigrams and bigrams; a lexical baseline with no model files"""
+
+    name = "hashing"
+    kind = None
+    supports_images = False
+
+    def encode_texts(self, texts):
+        vectors = np.zeros((len(texts), HASHING_DIMENSIONS), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = re.findall(r"\w+", text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                digest = hashlib.md5(feature.encode()).digest()
+                index = int.from_bytes(digest[:4], "little") % HASHING_DIMENSIONS
+                vectors[i, index] += 1.0 if digest[4] & 1 else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+
+class MiniLMModel:
+    name = "minilm"
+    kind = "text"
+    supports_images = False
+
+    def __init__(self):
+        from sentence_transformers import SentenceTransformer
+        from query_pdf import TEXT_MODEL_NAME
+        self.model = SentenceTransformer(TEXT_MODEL_NAME)
+        self.service_resources = {"text_model": self.model}
+
+    def encode_texts(self, texts):
+        return np.asarray(self.model.encode(texts, normalize_embeddings=True), dtype=np.float32)
+
+
+class SiglipModel:
+    name = "siglip"
+    kind = "image_text"
+    supports_images = True
+
+    def __init__(self):
+        from siglip_encoder import initialize_siglip_model
+        self.model, self.preprocess, self.tokenizer = initialize_siglip_model()
+        self.service_resources = {"siglip": (self.model, self.preprocess, self.tokenizer)}
+
+    def encode_texts(self, texts):
+        from process_image_text import TEXT_BATCH_SIZE
+        from siglip_encoder import encode_text_batches
+        return encode_text_batches(texts, self.model, self.tokenizer, TEXT_BATCH_SIZE)
+
+    def encode_images(self, images):
+        from process_image_text import IMAGE_BATCH_SIZE
+        from siglip_encoder import encode_image_batches
+        return encode_image_batches(images, self.model, self.preprocess, IMAGE_BATCH_SIZE)
+
+
+MODELS = {"hashing": HashingModel, "minilm": MiniLMModel, "siglip": SiglipModel}
+
+
+def build_index(root, set_name, engine, vectors, properties, batch_size=100):
+    """Create a set on a LocalConnector, add descriptors in multi-command batches and index its documents"""
+    db = LocalConnector(root)
+    db.query([{"AddDescriptorSet": {"name": set_name, "dimensions": int(vectors.shape[1]),
+                                    "engine": engine, "metric": "IP"}}])
+    for start in range(0, len(properties), batch_size):
+        q = [{"AddDescriptor": {"set": set_name, "properties": props}}
+             for props in properties[start:start + batch_size]]
+        db.query(q, [vector.astype("float32").tobytes() for vector in vectors[start:start + batch_size]])
+    doc_index.refresh_document_index(db, set_name)
+    return db
+
+
+def build_lexical_index(set_name, kind, texts):
+    """The BM25 heading index ingestion writes for a set, over the benchmark corpus"""
+    index = LexicalIndex(set_name, kind)
+    for pdf_name in sorted({pdf_name for pdf_name, _ in texts}):
+        index.replace(pdf_name, [{"pdf_name": pdf_name, "page": None, "text": text}
+                                 for name, text in texts if name == pdf_name])
+    index.save()
+    return index
+
+
+def rank_documents(entities):
+    """Distinct pdf_names in order of their best-scoring descriptor"""
+    ranked = []
+    for entity in entities:
+        if entity.get("pdf_name") not in ranked:
+            ranked.append(entity.get("pdf_name"))
+    return ranked
+
+
+def flat_search(db, set_name, model, k):
+    """search(query) -> (ranked pdf_names, path) with one k-NN pass over every descriptor"""
+    def search(query_text):
+        embedding = model.encode_texts([query_text])[0]
+        responses, _ = db.query([{"FindDescriptor": {
+            "set": set_name, "k_neighbors": max(20, 5 * k), "distances": True,
+            "results": {"list": ["pdf_name"]}}}], [embedding.astype("float32").tobytes()])
+        return rank_documents(responses[0]["FindDescriptor"]["entities"]), "flat"
+    return search
+
+
+def service_search(service, kind, set_name, k):
+    """search(query) -> (ranked pdf_names, path) through RetrievalService, as the CLI searches"""
+    def search(query_text):
+        documents = service.rank_documents(kind, query_text, set_name, n_docs=k)
+        lexical = bool(documents) and documents[0].get("source") == "lexical"
+        return [document["pdf_name"] for document in documents], "fast_path" if lexical else "two_stage"
+    return search
+
+
+def _quality(best_ranks, k):
+    n = len(best_ranks)
+    return {
+        "recall@1": sum(best == 1 for best in best_ranks) / n if n else None,
+        f"recall@{k}": sum(best is not None and best <= k for best in best_ranks) / n if n else None,
+        "mrr": sum(1.0 / best for best in best_ranks if best) / n if n else None,
+    }
+
+
+def run_queries(search, queries, k, repeats):
+    """Latency and document-level recall@1, recall@k and MRR, overall and per search path"""
+    paths = {}
+    misses = []
+    for repeat in range(repeats):
+        for query in queries:
+            start = time.perf_counter()
+            ranked, path = search(query["query"])
+            stats = paths.setdefault(path, {"latencies": [], "best_ranks": []})
+            stats["latencies"].append((time.perf_counter() - start) * 1000)
+            if repeat:
+                continue
+            ranks = [ranked.index(name) + 1 for name in query["relevant"] if name in ranked]
+            best = min(ranks) if ranks else None
+            stats["best_ranks"].append(best)
+            if best != 1:
+                misses.append({"query": query["query"], "relevant": query["relevant"], "path": path,
+                               "ranked": ranked[:k]})
+    return {
+        **_quality([best for stats in paths.values() for best in stats["best_ranks"]], k),
+        "latency_ms": _percentiles([ms for stats in paths.values() for ms in stats["latencies"]]),
+        "paths": {path: {"queries": len(stats["best_ranks"]), **_quality(stats["best_ranks"], k),
+                         "latency_ms": _percentiles(stats["latencies"])}
+                  for path, stats in paths.items()},
+        "misses": misses,
+    }
+
+
+def benchmark_model(model_name, engines, texts, images, queries, k, repeats, work_dir):
+    """Load one model, encode the corpus once and benchmark every engine on it"""
+    rss_start = _rss_mb()
+    start = time.perf_counter()
+    model = MODELS[model_name]()
+    load_seconds = time.perf_counter() - start
+    rss_loaded = _rss_mb()
+
+    start = time.perf_counter()
+    vectors = model.encode_texts([text for _, text in texts])
+    properties = [{"pdf_name": pdf_name, "text": text} for pdf_name, text in texts]
+    if model.supports_images and images:
+        from PIL import Image
+        pil_images = [Image.open(path).convert("RGB") for _, _, path in images]
+        vectors = np.concatenate([vectors, model.encode_images(pil_images)])
+        properties += [{"pdf_name": pdf_name, "image_index": index} for pdf_name, index, _ in images]
+    encode_seconds = time.perf_counter() - start
+    rss_encoded = _rss_mb()
+
+    results = []
+    for engine in engines:
+        root = os.path.join(work_dir, f"{model_name}_{engine}")
+        set_name = DEFAULT_SETS.get(model.kind, f"bench_{model_name}")
+        start = time.perf_counter()
+        db = build_index(root, set_name, engine, vectors, properties)
+        index_seconds = time.perf_counter() - start
+        index_bytes = sum(os.path.getsize(os.path.join(dirpath, f))
+                          for dirpath, _, files in os.walk(root) for f in files)
+        base = {
+            "model": model_name,
+            "engine": engine,
+            "k": k,
+            "corpus": {"texts": len(texts), "images": len(properties) - len(texts), "dimensions": int(vectors.shape[1])},
+            "ingest": {
+                "model_load_seconds": load_seconds,
+                "encode_seconds": encode_seconds,
+                "encode_items_per_second": len(properties) / encode_seconds if encode_seconds else None,
+                "index_seconds": index_seconds,
+                "index_items_per_second": len(properties) / index_seconds if index_seconds else None,
+            },
+            "memory_mb": {
+                "model_rss": rss_loaded - rss_start,
+                "encode_rss": rss_encoded - rss_loaded,
+                "index_on_disk": index_bytes / 2 ** 20,
+            },
+        }
+        if model.kind is None:
+            results.append({**base, "mode": "flat", **run_queries(flat_search(db, set_name, model, k),
+                                                                  queries, k, repeats)})
+            continue
+        build_lexical_index(set_name, model.kind, texts)
+        service = RetrievalService(resources={"db": db, **model.service_resources})
+        search = service_search(service, model.kind, set_name, k)
+        results.append({**base, "mode": "service", **run_queries(search, queries, k, repeats)})
+        fast_path = os.environ.get("LEXICAL_FAST_PATH")
+        os.environ["LEXICAL_FAST_PATH"] = "0"
+        try:
+            results.append({**base, "mode": "two_stage", **run_queries(search, queries, k, repeats)})
+        finally:
+            if fast_path is None:
+                del os.environ["LEXICAL_FAST_PATH"]
+            else:
+                os.environ["LEXICAL_FAST_PATH"] = fast_path
+    return results
+
+
+def seed_queries(queries_path, log_path="browser_agent_logs.json"):
+    """Append logged tasks that are not in the query file yet, labeled by PDF name overlap"""
+    existing = {query["query"] for query in load_queries(queries_path)} if os.path.exists(queries_path) else set()
+    with open(log_path) as f:
+        logs = json.load(f)
+    pdf_names = [os.path.splitext(name)[0] for name in BUNDLED_PDFS]
+    added = 0
+    with open(queries_path, "a") as f:
+        for entry in logs:
+            task = entry.get("task", "").strip()
+            if not task or task in existing:
+                continue
+            words = set(re.findall(r"\w+", task.lower()))
+            label = max(pdf_names, key=lambda name: len(words & set(name.split("_"))))
+            f.write(json.dumps({"query": task, "relevant": [label], "source": log_path, "needs_review": True}) + "\n")
+            existing.add(task)
+            added += 1
+    print(f"Added {added} queries to {queries_path}; review the guessed labels marked needs_review")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval benchmark (recall@k, latency, memory)")
+    parser.add_argument("command", nargs="?", choices=["run", "seed"], default="run")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES_PATH)
+    parser.add_argument("--pdfs", nargs="+", default=BUNDLED_PDFS)
+    parser.add_argument("--images-dir", default=DEFAULT_IMAGES_DIR)
+    parser.add_argument("--models", nargs="+", choices=sorted(MODELS), default=["minilm", "siglip"])
+    parser.add_argument("--engines", nargs="+", choices=LocalConnector.ENGINES, default=["Flat", "IVF"])
+    parser.add_argument("-k", type=int, default=3, help="Documents considered for recall@k")
+    parser.add_argument("--repeats", type=int, default=5, help="Passes over the queries for latency")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--allow-download", action="store_true", help="Allow fetching models from the Hub")
+    parser.add_argument("--use-embedding-cache", action="store_true",
+                        help="Keep the embedding cache on (latencies then measure cache hits)")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        seed_queries(args.queries)
+        return
+
+    if not args.allow_download:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    if not args.use_embedding_cache:
+        os.environ["EMBEDDING_CACHE"] = "0"
+
+    queries = load_queries(args.queries)
+    texts, images = load_corpus(args.pdfs, args.images_dir)
+    work_dir = tempfile.mkdtemp(prefix="bench_retrieval_")
+    # The service reads the benchmark corpus's heading indexes, not the ones ingestion wrote
+    os.environ["LEXICAL_INDEX_DIR"] = os.path.join(work_dir, "lexical_index")
+    results = []
+    try:
+        for model_name in args.models:
+            try:
+                results.extend(benchmark_model(model_name, args.engines, texts, images, queries,
+                                               args.k, args.repeats, work_dir))
+            except Exception as e:
+                print(f"Skipping {model_name}: {type(e).__name__}: {e}", file=sys.stderr)
+                results.append({"model": model_name, "error": f"{type(e).__name__}: {e}"})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "queries": len(queries),
+            "pdfs": [os.path.basename(path) for path in args.pdfs],
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'model':<10}{'engine':<7}{'path':<20}{'queries':>8}{'R@1':>6}{f'R@{args.k}':>6}{'MRR':>6}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'enc/s':>9}{'idx/s':>10}{'model MB':>10}")
+    for result in results:
+        if "error" in result:
+            print(f"{result['model']:<10}error: {result['error']}")
+            continue
+        rows = [(result["mode"], sum(path["queries"] for path in result["paths"].values()), result)]
+        if result["mode"] == "service":
+            rows += [(f"  {name}", path["queries"], path) for name, path in sorted(result["paths"].items())]
+        for label, count, stats in rows:
+            latency = stats["latency_ms"]
+            print(f"{result['model']:<10}{result['engine']:<7}{label:<20}{count:>8}{stats['recall@1']:>6.2f}"
+                  f"{stats[f'recall@{args.k}']:>6.2f}{stats['mrr']:>6.2f}{latency['p50']:>9.2f}{latency['p95']:>9.2f}"
+                  f"{result['ingest']['encode_items_per_second']:>9.1f}"
+                  f"{result['ingest']['index_items_per_second']:>10.1f}{result['memory_mb']['model_rss']:>10.1f}")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
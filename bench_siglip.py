@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Throughput and embedding drift of the SigLIP inference modes.
+
+Encodes the labeled queries in benchmark_queries.jsonl and the screenshots in
+extracted_images with the reference mode (fp32, the embeddings the existing
+sets were ingested with on CPU) and with each candidate mode, then reports
+texts/sec, images/sec, load time, and the cosine similarity of every candidate
+embedding to its reference. Exits with code 1 if any embedding falls below
+--min-cosine.
+
+    python bench_siglip.py                                  # fp32 vs bf16 vs int8 on CPU
+    python bench_siglip.py --precisions bf16 --threads 8 --compile --output bench_siglip.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from bench_retrieval import DEFAULT_IMAGES_DIR, DEFAULT_QUERIES_PATH, load_queries
+
+
+def load_images(images_dir, limit):
+    from PIL import Image
+    paths = sorted(os.path.join(images_dir, name) for name in os.listdir(images_dir) if name.endswith(".png"))
+    return [Image.open(path).convert("RGB") for path in paths[:limit]]
+
+
+def run_mode(precision, device, threads, compile, texts, images, batch_size, repeats):
+    """Embeddings and timings for one inference mode"""
+    from siglip_encoder import encode_image_batches, encode_text_batches, initialize_siglip_model
+    start = time.perf_counter()
+    model, preprocess, tokenizer = initialize_siglip_model(device, precision, threads, compile)
+    result = {"precision": precision, "device": device, "threads": threads, "compile": compile,
+              "load_seconds": time.perf_counter() - start}
+    # One untimed pass so one-off costs (compilation, allocator warm-up) are not counted
+    text_vectors = encode_text_batches(texts, model, tokenizer, batch_size)
+    image_vectors = encode_image_batches(images, model, preprocess, batch_size) if images else None
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        encode_text_batches(texts, model, tokenizer, batch_size)
+    result["texts_per_second"] = len(texts) * repeats / (time.perf_counter() - start)
+    if images:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            encode_image_batches(images, model, preprocess, batch_size)
+        result["images_per_second"] = len(images) * repeats / (time.perf_counter() - start)
+    return result, text_vectors, image_vectors
+
+
+def cosine_report(vectors, reference):
+    cosines = np.sum(vectors * reference, axis=1) / (
+        np.linalg.norm(vectors, axis=1) * np.linalg.norm(reference, axis=1))
+    return {"min": float(cosines.min()), "mean": float(cosines.mean())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SigLIP inference modes against the fp32 reference")
+    parser.add_argument("--precisions", nargs="+", default=["bf16", "int8"],
+                        choices=["fp32", "fp16", "bf16", "int8"])
+    parser.add_argument("--device", default="cpu", choices=["cpu", "cuda"])
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = default)")
+    parser.add_argument("--compile", action="store_true", help="Also torch.compile the candidate modes")
+    parser.add_argument("--queries", default=DEFAULT_QUERIES_PATH)
+    parser.add_argument("--images-dir", default=DEFAULT_IMAGES_DIR)
+    parser.add_argument("--max-images", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--min-cosine", type=float, default=0.98,
+                        help="Lowest acceptable cosine similarity to the reference embedding")
+    parser.add_argument("--allow-download", action="store_true", help="Allow fetching the model from the Hub")
+    parser.add_argument("--output", help="Write the results as JSON")
+    args = parser.parse_args()
+    if not args.allow_download:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+
+    texts = [query["query"] for query in load_queries(args.queries)]
+    images = load_images(args.images_dir, args.max_images) if os.path.isdir(args.images_dir) else []
+
+    reference, ref_texts, ref_images = run_mode("fp32", "cpu", args.threads, False, texts, images,
+                                                args.batch_size, args.repeats)
+    results = [reference]
+    failures = []
+    for precision in args.precisions:
+        result, text_vectors, image_vectors = run_mode(precision, args.device, args.threads, args.compile,
+                                                       texts, images, args.batch_size, args.repeats)
+        result["text_cosine"] = cosine_report(text_vectors, ref_texts)
+        result["text_speedup"] = result["texts_per_second"] / reference["texts_per_second"]
+        if images:
+            result["image_cosine"] = cosine_report(image_vectors, ref_images)
+            result["image_speedup"] = result["images_per_second"] / reference["images_per_second"]
+        for tower in ("text", "image"):
+            cosine = result.get(f"{tower}_cosine")
+            if cosine and cosine["min"] < args.min_cosine:
+                failures.append(f"{precision} {tower} embeddings drift to cosine {cosine['min']:.4f} "
+                                f"(minimum {args.min_cosine})")
+        results.append(result)
+
+    print(f"{'mode':<8}{'load s':>8}{'text/s':>9}{'x':>6}{'image/s':>9}{'x':>6}{'text cos':>10}{'image cos':>11}")
+    for r in results:
+        print(f"{r['precision']:<8}{r['load_seconds']:>8.1f}{r['texts_per_second']:>9.1f}"
+              f"{r.get('text_speedup', 1.0):>6.2f}{r.get('images_per_second', 0.0):>9.2f}"
+              f"{r.get('image_speedup', 1.0):>6.2f}{r.get('text_cosine', {}).get('min', 1.0):>10.4f}"
+              f"{r.get('image_cosine', {}).get('min', 1.0):>11.4f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"texts": len(texts), "images": len(images), "min_cosine": args.min_cosine,
+                       "results": results, "ok": not failures}, f, indent=2)
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
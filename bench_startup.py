@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Startup-time benchmark and regression guard for cli_browser_agent.
+
+Runs fresh interpreters to measure the cost of `import cli_browser_agent` and of
+`cli_browser_agent.py --help`, lists the slowest imports from -X importtime, and
+fails (exit code 1) if startup exceeds the budget or if a heavy dependency is
+imported before the stage that needs it runs.
+
+    python bench_startup.py                     # median of 5 runs against the default budget
+    python bench_startup.py --max-import-ms 200 --json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# Must only be imported lazily by the stage that uses them
+HEAVY_MODULES = ("torch", "sentence_transformers", "open_clip", "weave", "google.genai", "browser_use",
+                 "langchain_openai", "together", "fitz", "aperturedb")
+
+
+def _run(args, env=None):
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable] + args, cwd=HERE, capture_output=True, text=True,
+                             env={**os.environ, **(env or {})})
+    return (time.perf_counter() - start) * 1000, process
+
+
+def import_time_ms(runs):
+    """Median wall time of importing the CLI module in a fresh interpreter"""
+    return statistics.median(_run(["-c", "import cli_browser_agent"])[0] for _ in range(runs))
+
+
+def help_time_ms(runs):
+    return statistics.median(_run(["cli_browser_agent.py", "--help"])[0] for _ in range(runs))
+
+
+def baseline_ms(runs):
+    """Bare interpreter startup, subtracted to get the CLI's own cost"""
+    return statistics.median(_run(["-c", "pass"])[0] for _ in range(runs))
+
+
+def heavy_imports():
+    """Heavy modules present in sys.modules after importing the CLI"""
+    code = ("import sys, json, cli_browser_agent; "
+            f"print(json.dumps([m for m in {list(HEAVY_MODULES)!r} if m in sys.modules]))")
+    _, process = _run(["-c", code])
+    if process.returncode != 0:
+        raise RuntimeError(f"import cli_browser_agent failed:\n{process.stderr}")
+    return json.loads(process.stdout)
+
+
+def slowest_imports(top=10):
+    """(module, cumulative microseconds) of the slowest imports under cli_browser_agent"""
+    _, process = _run(["-X", "importtime", "-c", "import cli_browser_agent"])
+    rows = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        # "import time: <self us> | <cumulative us> | <indented module name>"
+        _, cumulative_us, module = line[len("import time:"):].split("|")
+        rows.append((module.strip(), int(cumulative_us)))
+    return sorted(rows, key=lambda row: -row[1])[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure and guard cli_browser_agent startup time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=300.0,
+                        help="Budget for importing the CLI, on top of bare interpreter startup")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    base = baseline_ms(args.runs)
+    results = {
+        "interpreter_ms": base,
+        "import_ms": import_time_ms(args.runs) - base,
+        "help_ms": help_time_ms(args.runs) - base,
+        "heavy_imports": heavy_imports(),
+        "slowest_imports_us": slowest_imports(),
+        "budget_import_ms": args.max_import_ms,
+    }
+    failures = []
+    if results["import_ms"] > args.max_import_ms:
+        failures.append(f"import took {results['import_ms']:.0f} ms (budget {args.max_import_ms:.0f} ms)")
+    if results["heavy_imports"]:
+        failures.append(f"heavy modules imported at startup: {', '.join(results['heavy_imports'])}")
+    results["ok"] = not failures
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"interpreter   {base:8.1f} ms")
+        print(f"import CLI    {results['import_ms']:8.1f} ms  (budget {args.max_import_ms:.0f} ms)")
+        print(f"--help        {results['help_ms']:8.1f} ms")
+        print("slowest imports (cumulative):")
+        for module, cumulative_us in results["slowest_imports_us"]:
+            print(f"  {module:<40}{cumulative_us / 1000:8.1f} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    sys.exit(0 if results["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
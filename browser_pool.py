@@ -0,0 +1,152 @@
+"""Pool of warm browser contexts and the CLI's single persistent event loop.
+
+One Browser is launched per process and a fixed number of contexts are kept open
+across tasks and follow-ups, so Chrome launch and login are paid once. Contexts
+that hit an error are closed and replaced; if the replacement cannot be created
+the slot is left empty and the next borrower creates it. Configuration comes
+from the environment:
+
+    CHROME_PATH            Chrome binary to drive (default: the macOS Google Chrome install);
+                           set it empty to use Playwright's bundled Chromium
+    BROWSER_HEADLESS       1 to run headless, e.g. against local HTML fixtures (with CHROME_PATH empty)
+    BROWSER_POOL_SIZE      number of warm contexts (default 1)
+    BROWSER_COOKIES_FILE   cookie jar that keeps contexts logged in across CLI runs
+"""
+import asyncio
+import atexit
+import os
+from contextlib import asynccontextmanager
+
+from spans import span
+
+DEFAULT_CHROME_PATH = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
+
+_loop = None
+
+
+def get_event_loop():
+    """The process-wide event loop every async stage of the CLI runs on"""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+        atexit.register(shutdown)
+    return _loop
+
+
+def run_sync(coro):
+    """Run a coroutine to completion on the persistent loop"""
+    return get_event_loop().run_until_complete(coro)
+
+
+class BrowserPool:
+    """Fixed-size pool of reusable browser contexts on one shared Browser"""
+
+    def __init__(self, size=None, chrome_path=None, headless=None, cookies_file=None):
+        self.size = size or int(os.getenv("BROWSER_POOL_SIZE", "1"))
+        self.chrome_path = chrome_path or os.getenv("CHROME_PATH", DEFAULT_CHROME_PATH) or None
+        if headless is None:
+            headless = os.getenv("BROWSER_HEADLESS", "0") == "1"
+        self.headless = headless
+        self.cookies_file = cookies_file or os.getenv("BROWSER_COOKIES_FILE") or None
+        self.browser = None
+        self._idle = None
+        self._contexts = []
+        self._start_lock = asyncio.Lock()
+
+    async def start(self):
+        async with self._start_lock:
+            if self.browser is not None:
+                return
+            # browser_use is imported on first launch so importing the CLI stays fast
+            from browser_use import Browser, BrowserConfig
+            with span("browser_launch", size=self.size, headless=self.headless):
+                try:
+                    self.browser = Browser(config=BrowserConfig(headless=self.headless,
+                                                                chrome_instance_path=self.chrome_path))
+                except Exception:
+                    print("Failed to start a new Chrome instance. Ensure that all existing Chrome instances are closed and try again.")
+                    raise
+                self._idle = asyncio.Queue()
+                for _ in range(self.size):
+                    self._idle.put_nowait(await self._replacement())
+
+    async def _new_context(self):
+        from browser_use.browser.context import BrowserContextConfig
+        with span("browser_context"):
+            context = await self.browser.new_context(config=BrowserContextConfig(cookies_file=self.cookies_file))
+        self._contexts.append(context)
+        return context
+
+    async def _replacement(self):
+        """A new context, or None (an empty slot for the next borrower to fill) if creating it failed"""
+        try:
+            return await self._new_context()
+        except Exception as e:
+            print(f"Warning: failed to create browser context: {e}")
+            return None
+
+    async def _checkout(self):
+        context = await self._idle.get()
+        if context is None:
+            try:
+                context = await self._new_context()
+            except BaseException:
+                # Keep the slot so the pool does not shrink
+                self._idle.put_nowait(None)
+                raise
+        return context
+
+    async def _discard(self, context):
+        self._contexts.remove(context)
+        try:
+            await context.close()
+        except Exception as e:
+            print(f"Warning: failed to close browser context: {e}")
+
+    @asynccontextmanager
+    async def session(self):
+        """Borrow a warm context; it is replaced instead of returned if the task raised"""
+        await self.start()
+        context = await self._checkout()
+        healthy = False
+        try:
+            yield context
+            healthy = True
+        finally:
+            if not healthy:
+                await self._discard(context)
+                context = await self._replacement()
+            self._idle.put_nowait(context)
+
+    async def close(self):
+        for context in list(self._contexts):
+            await self._discard(context)
+        if self.browser is not None:
+            await self.browser.close()
+            self.browser = None
+
+
+_pool = None
+
+
+def get_browser_pool(size=None):
+    """Process-wide pool; size only applies when the pool is first created"""
+    global _pool
+    if _pool is None:
+        _pool = BrowserPool(size=size)
+    return _pool
+
+
+def shutdown():
+    """Close the pool's browser and the event loop; safe to call more than once"""
+    global _pool, _loop
+    if _loop is None or _loop.is_closed():
+        return
+    if _pool is not None:
+        try:
+            _loop.run_until_complete(_pool.close())
+        except Exception as e:
+            print(f"Warning: failed to close browser: {e}")
+        _pool = None
+    _loop.close()
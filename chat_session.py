@@ -0,0 +1,167 @@
+"""Follow-up conversation that remembers the task, the guide and what the browser did.
+
+The opening context (task, executed steps, agent result and the uploaded PDF
+guide) is sent once into a Gemini context cache, so later turns reference it
+instead of paying for it again. When the provider will not cache it (the
+context is below the model's minimum cacheable size, or caching is turned
+off), the context is sent inline with every turn instead. In both cases,
+earlier turns are kept in a rolling window that drops the oldest exchanges
+first, to stay within a token budget. Replies stream back, and each turn
+records its latency, time to first token, and token counts (prompt, cached,
+output).
+
+    CHAT_CONTEXT_CACHE=0    never create a provider-side cache
+    CHAT_CACHE_TTL          cache lifetime in seconds (default 900)
+    CHAT_CONTEXT_TOKENS     token budget for the rolling history (default 8000)
+"""
+import os
+import sys
+import time
+
+from spans import span
+
+CHAT_MODEL = "gemini-2.0-flash-001"
+SYSTEM_INSTRUCTION = ("You help a user get things done in the Stytch dashboard. A browser agent has already "
+                      "attempted the user's task with the steps below; answer follow-up questions using the "
+                      "task, those steps, the agent's result and the attached guide.")
+# Rough size of a token in characters, for budgeting the history without a count_tokens round trip
+CHARS_PER_TOKEN = 4
+MAX_RESULT_CHARS = 4000
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def result_summary(result):
+    """Final answer of a browser-use history (or histories), trimmed for the chat context"""
+    histories = result if isinstance(result, list) else [result]
+    finals = []
+    for history in histories:
+        final_result = getattr(history, "final_result", None)
+        finals.append(str(final_result() if callable(final_result) else history))
+    return "\n".join(finals)[-MAX_RESULT_CHARS:]
+
+
+class ChatSession:
+    """Multi-turn chat over a fixed opening context; see the module docstring"""
+
+    def __init__(self, client, task, steps=None, result=None, doc_file=None, model=CHAT_MODEL,
+                 context_tokens=None, use_cache=None, cache_ttl=None):
+        self.client = client
+        self.model = model
+        self.task = task
+        self.steps = steps
+        self.result = result
+        self.doc_file = doc_file
+        self.context_tokens = context_tokens or int(os.getenv("CHAT_CONTEXT_TOKENS", "8000"))
+        self.use_cache = use_cache if use_cache is not None else os.getenv("CHAT_CONTEXT_CACHE", "1") != "0"
+        self.cache_ttl = cache_ttl or int(os.getenv("CHAT_CACHE_TTL", "900"))
+        self.history = []
+        self.turns = []
+        self._context = None
+        self._cache_name = None
+
+    def _opening_context(self):
+        """The opening user content: task, steps and result as text, plus the guide if there is one"""
+        from google.genai import types
+        from upload_cache import get_upload_cache
+
+        text = f"Task: {self.task}"
+        if self.steps:
+            text += f"\n\nSteps executed by the browser agent:\n{self.steps}"
+        if self.result is not None:
+            text += f"\n\nBrowser agent result:\n{result_summary(self.result)}"
+        parts = [types.Part(text=text)]
+        if self.doc_file:
+            with span("gemini_upload", chat=True):
+                upload_file = get_upload_cache().get_or_upload(self.client, self.doc_file)
+            parts.append(types.Part(file_data=types.FileData(mime_type=upload_file.mime_type,
+                                                             file_uri=upload_file.uri)))
+        return types.Content(role="user", parts=parts)
+
+    def _prepare(self):
+        """Build the opening context once, and move it into a provider cache when possible"""
+        from google.genai import types
+
+        if self._context is not None:
+            return
+        self._context = self._opening_context()
+        if not self.use_cache:
+            return
+        try:
+            with span("chat_cache_create", model=self.model):
+                cache = self.client.caches.create(model=self.model, config=types.CreateCachedContentConfig(
+                    contents=[self._context], system_instruction=SYSTEM_INSTRUCTION, ttl=f"{self.cache_ttl}s"))
+            self._cache_name = cache.name
+        except Exception as e:
+            # Most often the context is below the model's minimum cacheable token count
+            print(f"Chat context not cached ({type(e).__name__}), sending it inline", file=sys.stderr)
+
+    def _window(self):
+        """The most recent history turns (user/model pairs) that fit in the token budget"""
+        kept, used = [], 0
+        for index in range(len(self.history) - 2, -1, -2):
+            pair = self.history[index:index + 2]
+            cost = sum(estimate_tokens(part.text or "") for content in pair for part in content.parts)
+            if used + cost > self.context_tokens:
+                break
+            kept[:0] = pair
+            used += cost
+        return kept
+
+    def send(self, message):
+        """Stream the reply to a message as text chunks; the turn's stats are appended to self.turns"""
+        from google.genai import types
+
+        self._prepare()
+        user_content = types.Content(role="user", parts=[types.Part(text=message)])
+        window = self._window()
+        contents = window + [user_content]
+        if self._cache_name:
+            config = types.GenerateContentConfig(cached_content=self._cache_name)
+        else:
+            contents = [self._context] + contents
+            config = types.GenerateContentConfig(system_instruction=SYSTEM_INSTRUCTION)
+
+        start = time.perf_counter()
+        stats = {"turn": len(self.turns) + 1, "cached_context": self._cache_name is not None,
+                 "history_turns": len(window) // 2}
+        reply, usage = [], None
+        with span("chat_turn", model=self.model, cached_context=stats["cached_context"]) as attrs:
+            for chunk in self.client.models.generate_content_stream(model=self.model, contents=contents,
+                                                                    config=config):
+                if chunk.usage_metadata is not None:
+                    usage = chunk.usage_metadata
+                if chunk.text:
+                    if not reply:
+                        stats["first_token_seconds"] = round(time.perf_counter() - start, 3)
+                    reply.append(chunk.text)
+                    yield chunk.text
+            stats["latency_seconds"] = round(time.perf_counter() - start, 3)
+            stats["prompt_tokens"] = getattr(usage, "prompt_token_count", None)
+            stats["cached_tokens"] = getattr(usage, "cached_content_token_count", None) or 0
+            stats["output_tokens"] = getattr(usage, "candidates_token_count", None)
+            attrs.update({key: stats[key] for key in ("prompt_tokens", "cached_tokens", "output_tokens")})
+        self.history += [user_content, types.Content(role="model", parts=[types.Part(text="".join(reply))])]
+        self.turns.append(stats)
+
+    def totals(self):
+        """Token and latency totals over all turns"""
+        return {
+            "turns": len(self.turns),
+            "prompt_tokens": sum(turn["prompt_tokens"] or 0 for turn in self.turns),
+            "cached_tokens": sum(turn["cached_tokens"] for turn in self.turns),
+            "output_tokens": sum(turn["output_tokens"] or 0 for turn in self.turns),
+            "latency_seconds": round(sum(turn["latency_seconds"] for turn in self.turns), 3),
+        }
+
+    def close(self):
+        """Delete the provider-side cache rather than wait for its TTL"""
+        if self._cache_name is None:
+            return
+        try:
+            self.client.caches.delete(name=self._cache_name)
+        except Exception as e:
+            print(f"Warning: failed to delete chat context cache: {e}", file=sys.stderr)
+        self._cache_name = None
@@ -1,129 +1,282 @@
 #!/usr/bin/env python3
+from __future__ import annotations
+
+# Only light modules are imported up front so `--help` and the task prompt appear
+# immediately; google.genai, browser_use, langchain_openai, together, weave and the
+# embedding models are imported by the stage that first needs them (see warm_up).
 import sys
-import asyncio
 import os
 import argparse
+import contextlib
 import json
+import threading
+import time
 from datetime import datetime
-from google import genai
-from google.genai import types
-from browser_use import Agent, Browser, BrowserConfig
-from langchain_openai import ChatOpenAI
-from query_pdf import search_pdf
-import weave
-from together import Together
-from typing import Any, Optional, Dict, List, Literal
-from pydantic import Field, BaseModel, ValidationError
+from typing import Optional
 
+import tracing
+from browser_pool import get_browser_pool, run_sync, shutdown
+from spans import span
 
-weave.init('metis')
 
-@weave.op()
-def activate_browser_agent(together_client, steps: str, task: str) -> str:
-    """Activates the browser-use agent to complete the given step by step instructions using a real browser."""
-    print("Executing browser steps:", steps)
-    
-    async def run_agent():
+def warm_up() -> threading.Thread:
+    """Import the heavy client libraries and load the query model in the background"""
+    def load():
         try:
-            browser = Browser(
-                config=BrowserConfig(
-                    chrome_instance_path='/Applications/Google Chrome.app/Contents/MacOS/Google Chrome'
-                )
-            )
+            with span("warm_up"):
+                import google.genai
+                import together
+                import evaluator
+                from plan_cache import get_plan_cache
+                from run_log import get_run_log
+                import retrieval_service
+                get_run_log()
+                get_plan_cache()
+                retrieval_service.get_service().preload(kinds=("text",))
         except Exception as e:
-            print("Failed to start a new Chrome instance. Ensure that all existing Chrome instances are closed and try again.")
-            raise e
-        agent = Agent(task=steps, llm=ChatOpenAI(model="gpt-4o"), browser=browser)
-        result = await agent.run()
-        input('Press Enter to close the browser...')
-        await browser.close()
-        return result
-
-    result = asyncio.run(run_agent())
-    
-    # Get feedback after browser use
-    current_call = weave.require_current_call()
+            # The stage that needs the failed resource will raise a proper error itself
+            print(f"Warning: background warm-up failed: {e}", file=sys.stderr)
+
+    thread = threading.Thread(target=load, name="warm-up", daemon=True)
+    thread.start()
+    return thread
+
+async def run_browser_steps(steps: str):
+    """Run the browser-use agent on a warm context from the pool; the browser stays open for the next task."""
+    from browser_use import Agent
+    from langchain_openai import ChatOpenAI
+    async with get_browser_pool().session() as context:
+        agent = Agent(task=steps, llm=ChatOpenAI(model="gpt-4o"),
+                      browser=context.browser, browser_context=context)
+        with span("agent_run") as attrs:
+            history = await agent.run()
+            attrs["steps"] = len(getattr(history, "history", ()))
+        return history
+
+def record_run(together_client, task: str, steps: str, result, feedback: str, comment: str,
+               plan_id: Optional[int] = None) -> dict:
+    """Evaluate a finished run, append it to the run log and update the plan cache."""
+    from agent_trace import compact_trace, summarize_trace
+    from evaluator import single_eval
+    from plan_cache import get_plan_cache
+    from run_log import get_run_log
+
+    # The full AgentHistoryList repr is mostly DOM coordinates; keep the compact trace instead
+    trace = compact_trace(result)
+    log_entry = {
+        "timestamp": datetime.now().isoformat(),
+        "task": str(task),
+        "steps": str(steps),
+        "result": str(trace["final_result"]),
+        "trace": trace,
+        "plan_id": plan_id,
+        "feedback": feedback,
+        "comment": str(comment) if comment else ""
+    }
+
+    # LLM Evaluation
+    with span("evaluate"):
+        evaluation, evaluation_feedback = single_eval(together_client, task, steps, summarize_trace(trace), feedback,
+                                                      log_entry["comment"])
+    log_entry["evaluation"] = evaluation
+    log_entry["evaluation_feedback"] = evaluation_feedback
+
+    # Append to the run log
+    log_entry["id"] = get_run_log().append(log_entry)
+
+    # Keep only plans that worked in the plan cache
+    if plan_id is not None and evaluation == "FAIL":
+        get_plan_cache().evict(plan_id)
+    elif plan_id is None:
+        get_plan_cache().add(task, steps, log_entry)
+    return log_entry
+
+def collect_feedback(together_client, task: str, steps: str, result, plan_id: Optional[int] = None) -> None:
+    """Ask the user how the run went, record it, and forward the feedback to weave."""
+    while True:
+        feedback = input("Was this helpful? (y/n): ").strip().lower()
+        if feedback in ('y', 'n'):
+            break
+        print("Please enter either y or n")
+    comment = input("Any additional comments? (press Enter to skip): ").strip()
+
     # Create and save log entry
     try:
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "task": str(task),
-            "steps": str(steps),
-            "result": str(result)
-        }
-        
-        while True:
-            feedback = input("Was this helpful? (y/n): ").strip().lower()
-            if feedback == 'y':
-                current_call.feedback.add_reaction("👍")
-                break
-            elif feedback == 'n':
-                current_call.feedback.add_reaction("👎")
-                break
-            print("Please enter either y or n")
-        
-        comment = input("Any additional comments? (press Enter to skip): ").strip()
-        if comment:
-            current_call.feedback.add_note(comment)
-        
-        # Add feedback to log entry
-        log_entry["feedback"] = "positive" if feedback == 'y' else "negative"
-        log_entry["comment"] = str(comment) if comment else ""
-
-        # LLM Evaluation
-        evaluation, feedback = single_eval(together_client, task, steps, str(result), log_entry["feedback"], log_entry["comment"])
-
-        # Adding a note
-        current_call.feedback.add_note(f"LLM Reflection: {feedback}")
-
-        # Adding custom key/value pairs.
-        current_call.feedback.add("llm_evaluation", { "value": {evaluation} })
-        
-        # Append to log file
-        log_file = "browser_agent_logs.json"
-        logs = []
-        
-        # Read existing logs if file exists
-        if os.path.exists(log_file) and os.path.getsize(log_file) > 0:
-            try:
-                with open(log_file, 'r') as f:
-                    logs = json.load(f)
-            except json.JSONDecodeError:
-                # If file is corrupted, start fresh
-                logs = []
-        
-        # Ensure logs is a list
-        if not isinstance(logs, list):
-            logs = []
-            
-        logs.append(log_entry)
-        
-        # Write updated logs
-        with open(log_file, 'w') as f:
-            json.dump(logs, f, indent=2, default=str)
+        log_entry = record_run(together_client, task, steps, result,
+                               "positive" if feedback == 'y' else "negative", comment, plan_id)
     except Exception as e:
         print(f"Warning: Failed to save log: {e}")
+        return
+
+    current_call = None
+    with contextlib.suppress(Exception):
+        current_call = tracing.current_call()
+    if current_call is not None:
+        try:
+            current_call.feedback.add_reaction("👍" if feedback == 'y' else "👎")
+            if comment:
+                current_call.feedback.add_note(comment)
+            # Adding a note
+            current_call.feedback.add_note(f"LLM Reflection: {log_entry['evaluation_feedback']}")
+            # Adding custom key/value pairs.
+            current_call.feedback.add("llm_evaluation", { "value": {log_entry['evaluation']} })
+        except Exception as e:
+            print(f"Warning: Failed to send feedback to weave: {e}")
+
+@tracing.op
+def activate_browser_agent(together_client, steps: str, task: str, plan_id: Optional[int] = None) -> str:
+    """Activates the browser-use agent to complete the given step by step instructions using a real browser."""
+    print("Executing browser steps:", steps)
+    
+    result = run_sync(run_browser_steps(steps))
     
+    # Get feedback after browser use
+    collect_feedback(together_client, task, steps, result, plan_id)
     return result
 
-def get_user_input() -> str:
-    """Get task from user input."""
+@tracing.op
+def activate_streaming_agent(together_client, client: genai.Client, task: str) -> tuple[dict, dict]:
+    """Generate the plan as a stream and execute its steps as they arrive, on a browser launched meanwhile."""
+    from step_stream import numbered, run_streamed
+
+    started = time.perf_counter()
+    plan, chunks = stream_plan(client, task)
+    with span("streamed_run", source=plan["source"]) as attrs:
+        result = run_sync(run_streamed(task, chunks, started=started))
+        attrs["time_to_first_action"] = result["time_to_first_action"]
+        attrs["steps"] = len(result["steps"])
+    if not result["steps"]:
+        print("No browser steps were generated.")
+        return plan, result
+    print(f"Time to first action: {result['time_to_first_action']:.2f}s, "
+          f"first step parsed: {result['time_to_first_step']:.2f}s, total: {result['total_seconds']:.2f}s")
+
+    # Get feedback after browser use
+    collect_feedback(together_client, task, numbered(result["steps"]), result["histories"], plan["plan_id"])
+    return plan, result
+
+def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Run browser agent with a task")
     parser.add_argument("task", nargs='?', help="Task for the browser agent")
-    args = parser.parse_args()
+    parser.add_argument("--batch", metavar="FILE",
+                        help="Run tasks from a JSONL file ('-' for stdin) without prompts")
+    parser.add_argument("--workers", type=int, default=2, help="Parallel browser workers in batch mode")
+    parser.add_argument("--resolve-concurrency", type=int, default=4,
+                        help="Tasks resolved (docs + plan) concurrently in batch mode")
+    parser.add_argument("--output", default="-", help="Where batch results are streamed as JSONL ('-' for stdout)")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream the plan and start executing steps before generation finishes")
+    return parser.parse_args()
 
+def get_user_input(args: argparse.Namespace) -> str:
+    """Get task from user input."""
     if not args.task:
         args.task = input("What what you want to achieve on stych: ")
 
     return args.task
 
-@weave.op
-def call_gemini(client: genai.Client, user_task: str, file_path: str | None) -> types.GenerateContentResponse:
-    """Make Gemini API call with the given task and optional file path."""
-    # File upload is optional. If a file path is provided, upload the file.
+def resolve_plan(client: genai.Client, user_task: str) -> dict:
+    """Find steps for a task: a cached plan if one fits, otherwise the relevant PDF plus a Gemini generation."""
+    with span("resolve_plan") as attrs:
+        plan = _resolve_plan(client, user_task)
+        attrs["source"] = plan["source"]
+    return plan
+
+def _cached_plan(user_task: str) -> Optional[dict]:
+    from plan_cache import get_plan_cache
+
+    # Reuse a cached plan for near-duplicate tasks instead of generating a new one
+    with span("plan_cache_lookup") as attrs:
+        cached_plan = get_plan_cache().lookup(user_task)
+        attrs["hit"] = cached_plan is not None
+    if cached_plan:
+        plan_id, steps, similarity = cached_plan
+        return {"steps": steps, "plan_id": plan_id, "source": "plan_cache", "similarity": similarity}
+    return None
+
+def _find_doc_file(user_task: str) -> str | None:
+    from query_pdf import search_pdf
+
+    # Find relevant PDF
+    with span("search_pdf"):
+        search_result = search_pdf(user_task, "pdf_instructions_correct2")
+    return search_result['pdf_name']+".pdf" if search_result else None
+
+def _resolve_plan(client: genai.Client, user_task: str) -> dict:
+    from plan_cache import get_plan_cache
+
+    cached_plan = _cached_plan(user_task)
+    if cached_plan:
+        return cached_plan
+    file_path = _find_doc_file(user_task)
+
+    # Call Gemini with weave attributes
+    start = time.perf_counter()
+    with tracing.attributes({'user_intent': user_task, 'doc_file': file_path}):
+        response = call_gemini(client, user_task, file_path)
+    get_plan_cache().record_generation(time.perf_counter() - start)
+
+    if response.function_calls:
+        return {"steps": response.function_calls[0].args.get('steps', ''), "plan_id": None,
+                "source": "gemini", "doc_file": file_path}
+    return {"steps": None, "plan_id": None, "source": "gemini", "doc_file": file_path, "text": response.text}
+
+def stream_plan(client: genai.Client, user_task: str):
+    """(plan, chunks): a cached plan as a single chunk, or a lazily streamed Gemini generation.
+
+    The documentation search and generation only start when `chunks` is first iterated,
+    so they run in the producer thread while the browser launches.
+    """
+    cached_plan = _cached_plan(user_task)
+    if cached_plan:
+        return cached_plan, [cached_plan["steps"]]
+    plan = {"steps": None, "plan_id": None, "source": "gemini_stream", "doc_file": None}
+
+    def chunks():
+        from plan_cache import get_plan_cache
+        plan["doc_file"] = _find_doc_file(user_task)
+        start = time.perf_counter()
+        yield from call_gemini_stream(client, user_task, plan["doc_file"])
+        get_plan_cache().record_generation(time.perf_counter() - start)
+
+    return plan, chunks()
+
+def _gemini_contents(client: genai.Client, user_task: str, file_path: str | None, instruction: str,
+                     attempt: int) -> tuple[list, bool]:
+    """Prompt parts for a plan request, with the PDF attached from the upload cache when given."""
+    from google import genai
+    from upload_cache import get_upload_cache
+
     upload_file = None
     if file_path and file_path.strip():
-        upload_file = client.files.upload(file=file_path)
+        with span("gemini_upload", attempt=attempt):
+            upload_file = get_upload_cache().get_or_upload(client, file_path)
+
+    # Create content parts including both text and file
+    content_parts = [genai.types.Part(text=(user_task + "\n" + instruction))]
+    if upload_file:
+        content_parts.append(genai.types.Part(file_data=genai.types.FileData(
+            mime_type=upload_file.mime_type,
+            file_uri=upload_file.uri
+        )))
+    return content_parts, upload_file is not None
+
+def _upload_rejected(error, file_path: str | None, with_file: bool, attempt: int) -> bool:
+    """Whether a ClientError means the cached file URI is stale; the upload is then invalidated."""
+    from upload_cache import get_upload_cache
+
+    if not with_file or attempt > 0 or error.code not in (400, 403, 404):
+        return False
+    print(f"Cached upload of {file_path} was rejected ({error.code}), re-uploading")
+    get_upload_cache().invalidate(file_path)
+    return True
+
+@tracing.op
+def call_gemini(client: genai.Client, user_task: str, file_path: str | None) -> types.GenerateContentResponse:
+    """Make Gemini API call with the given task and optional file path."""
+    from google.genai import types
+    from google.genai import errors as genai_errors
+
     # Define the function declaration for activate_browser_agent
     function = types.FunctionDeclaration(
         name='activate_browser_agent',
@@ -142,145 +295,175 @@ def call_gemini(client: genai.Client, user_task: str, file_path: str | None) ->
 
     tool = types.Tool(function_declarations=[function])
 
-    # Generate content with function calling enabled
-    # Create content parts including both text and file
-    content_parts = [genai.types.Part(text=(user_task + "\nPlease provide detailed step by step instructions for browser use."))]
-    if upload_file:
-        content_parts.append(genai.types.Part(file_data=genai.types.FileData(
-            mime_type=upload_file.mime_type,
-            file_uri=upload_file.uri
-        )))
-    
-    return client.models.generate_content(
-        model="gemini-2.0-flash-001",
-        contents=content_parts,
-        config=types.GenerateContentConfig(
-            tools=[tool],
-            automatic_function_calling=types.AutomaticFunctionCallingConfig(maximum_remote_calls=2),
-            tool_config=types.ToolConfig(
-                function_calling_config=types.FunctionCallingConfig(mode='ANY')
-            )
-        )
-    )
+    # File upload is optional. If a file path is provided, reuse a cached upload of the
+    # same content; re-upload once if the provider rejects the cached file URI.
+    for attempt in range(2):
+        content_parts, with_file = _gemini_contents(
+            client, user_task, file_path, "Please provide detailed step by step instructions for browser use.", attempt)
 
+        # Generate content with function calling enabled
+        try:
+            with span("gemini_generate", attempt=attempt, with_file=with_file):
+                return client.models.generate_content(
+                    model="gemini-2.0-flash-001",
+                    contents=content_parts,
+                    config=types.GenerateContentConfig(
+                        tools=[tool],
+                        automatic_function_calling=types.AutomaticFunctionCallingConfig(maximum_remote_calls=2),
+                        tool_config=types.ToolConfig(
+                            function_calling_config=types.FunctionCallingConfig(mode='ANY')
+                        )
+                    )
+                )
+        except genai_errors.ClientError as e:
+            if not _upload_rejected(e, file_path, with_file, attempt):
+                raise
 
-# Simple JSON mode LLM call helper function - will be used by the Evaluator
-def JSON_llm(together_client, user_prompt : str, schema : BaseModel, system_prompt : Optional[str] = None):
-    """ Run a language model with the given user prompt and system prompt, and return a structured JSON object. """
-    try:
-        messages = []
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        
-        messages.append({"role": "user", "content": user_prompt})
-        
-        extract = together_client.chat.completions.create(
-            messages=messages,
-            model="meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo",
-            response_format={
-                "type": "json_object",
-                "schema": schema.model_json_schema(),
-            },
-        )
-        
-        response = json.loads(extract.choices[0].message.content)
-        return response
-        
-    except ValidationError as e:
-        raise ValueError(f"Schema validation failed: {str(e)}")
-    
-EVALUATOR_PROMPT = """Evaluate this following trace for an agent executing a task. You should be evaluate whether or not it was successful at solving the task.
-If it was not successful, then explain what stage it failed in the execution trace.
-Only output "PASS" if all criteria are met and you have no further suggestions for improvements, otherwise output "FAIL".
-Provide detailed feedback if there are areas that need improvement. You should specify what needs improvement and why.
-Only output JSON.
-
-Task: {task}
-Steps: {steps}
-Trace: {trace}
-Feedback: {feedback}
-Comment: {comment}
-
-Output:"""
-
-def evaluate(together_client, schema, task, steps, trace, feedback, comment) -> tuple[str, str]:
-    """Evaluate if a solution meets requirements."""
-    full_prompt = EVALUATOR_PROMPT.format(task=task, steps=steps, trace=trace, feedback=feedback, comment=comment)
-    
-    response = JSON_llm(together_client, full_prompt, schema)
-    
-    evaluation = response["evaluation"]
-    feedback = response["feedback"]
+def call_gemini_stream(client: genai.Client, user_task: str, file_path: str | None):
+    """Stream a plan from Gemini as text chunks of a numbered step list."""
+    from google.genai import errors as genai_errors
 
-    print("=== EVALUATION START ===")
-    print(f"Status: {evaluation}")
-    print(f"Feedback: {feedback}")
-    print("=== EVALUATION END ===\n")
+    # Function-call arguments only arrive complete, so the streamed plan is requested as plain text
+    instruction = ("Reply only with detailed step by step instructions for browser use, as a numbered list "
+                   "with one step per line (\"1. ...\"). The PDF file is already available to the agent - "
+                   "do NOT ask for a URL.")
+    for attempt in range(2):
+        content_parts, with_file = _gemini_contents(client, user_task, file_path, instruction, attempt)
+        received = False
+        start = time.perf_counter()
+        try:
+            with span("gemini_generate", attempt=attempt, with_file=with_file, stream=True) as attrs:
+                for chunk in client.models.generate_content_stream(model="gemini-2.0-flash-001",
+                                                                   contents=content_parts):
+                    if chunk.text:
+                        if not received:
+                            attrs["first_chunk_seconds"] = round(time.perf_counter() - start, 3)
+                        received = True
+                        yield chunk.text
+            return
+        except genai_errors.ClientError as e:
+            # Once text was handed to the executor the request cannot be replayed
+            if received or not _upload_rejected(e, file_path, with_file, attempt):
+                raise
 
-    return evaluation, feedback
 
-def single_eval(together_client, task, steps, trace, feedback, comment) -> tuple[str, list[dict]]:
-    #Build a schema for the evaluation
-    class Evaluation(BaseModel):
-        evaluation: Literal["PASS", "NEEDS_IMPROVEMENT", "FAIL"]
-        feedback: str
+def run_batch_mode(args: argparse.Namespace, client: genai.Client, together_client) -> None:
+    """Run every task from args.batch through resolve -> browser workers -> automatic evaluation."""
+    from batch_runner import read_tasks, run_batch
 
-    # While the generated response is not passing, keep generating and evaluating
-    return evaluate(together_client, Evaluation, task, steps, trace, feedback, comment)
+    if args.batch == '-':
+        tasks = read_tasks(sys.stdin)
+    else:
+        with open(args.batch) as f:
+            tasks = read_tasks(f)
+    get_browser_pool(size=args.workers)
 
+    def resolve(task):
+        return resolve_plan(client, task)
 
-@weave.op()
-def main():
-    # Ensure the Google API key is set via the environment variable
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("Error: Please set the GEMINI_API_KEY environment variable.")
-        sys.exit(1)
-    together_api_key = os.getenv("TOGETHER_API_KEY")
-    if not together_api_key:
-        print("Error: Please set the TOGETHER_API_KEY environment variable.")
+    def record(task, plan, result):
+        # No human in the loop: the LLM evaluator provides the feedback
+        return record_run(together_client, task, plan["steps"], result, "none (batch mode)", "", plan["plan_id"])
+
+    def on_result(result):
+        output.write(json.dumps(result, default=str) + "\n")
+        output.flush()
+
+    # Keep stdout clean for results; progress messages from planning and the agent go to stderr
+    with contextlib.ExitStack() as stack:
+        output = sys.stdout if args.output == '-' else stack.enter_context(open(args.output, 'a'))
+        stack.enter_context(contextlib.redirect_stdout(sys.stderr))
+        summary = run_sync(run_batch(tasks, resolve, run_browser_steps, record, workers=args.workers,
+                                     resolve_concurrency=args.resolve_concurrency, on_result=on_result))
+    print(json.dumps(summary), file=sys.stderr)
+
+def require_env(name: str) -> str:
+    value = os.getenv(name)
+    if not value:
+        print(f"Error: Please set the {name} environment variable.")
         sys.exit(1)
-    together_client = Together(api_key= together_api_key)
-    
-    # Get user input and find relevant PDF
-    user_task = get_user_input()
-    search_result = search_pdf(user_task, "pdf_instructions_correct2")
-    file_path = search_result['pdf_name']+".pdf" if search_result else None
-    
-    # Create the Gen AI client using the API key
-    client = genai.Client(api_key=api_key)
+    return value
 
-    # Call Gemini with weave attributes
-    with weave.attributes({'user_intent': user_task, 'doc_file': file_path}):
-        response = call_gemini(client, user_task, file_path)
-    
+def run_planned(together_client, client: genai.Client, user_task: str) -> tuple[dict, object]:
+    """Generate the whole plan, then execute it; returns the plan and the agent's result."""
+    plan = resolve_plan(client, user_task)
     # Execute the browser agent if we get steps
-    if response.function_calls:
-        steps = response.function_calls[0].args.get('steps', '')
-        print("Browser agent result:")
-        print(steps)
+    if plan["steps"] is not None:
+        if plan["source"] == "plan_cache":
+            print(f"Using cached plan {plan['plan_id']} (similarity {plan['similarity']:.2f}):")
+        else:
+            print("Browser agent result:")
+        print(plan["steps"])
         # Actually execute the browser automation
-        activate_browser_agent(together_client, steps, user_task)
-    else:
-        print("Response from Gen AI:")
-        print(response.text)
-    while True:
-        followup = input("Enter follow-up message (or press Enter to exit): ")
-        if not followup.strip():
-            break
-        followup_response = client.models.generate_content(
-            model="gemini-2.0-flash-001",
-            contents=followup,
-            config=types.GenerateContentConfig(
-                automatic_function_calling=types.AutomaticFunctionCallingConfig(maximum_remote_calls=0),
-                tools=[],
-                tool_config=types.ToolConfig(
-                    function_calling_config=types.FunctionCallingConfig(mode='NONE')
-                )
-            )
-        )
-        print("Follow-up response:")
-        print(followup_response.text)
+        return plan, activate_browser_agent(together_client, plan["steps"], user_task, plan["plan_id"])
+    print("Response from Gen AI:")
+    print(plan["text"])
+    return plan, None
+
+def follow_up(client: genai.Client, task: str, steps: str | None, result, doc_file: str | None) -> None:
+    """Answer follow-up messages in one chat session until the user enters an empty line."""
+    chat = None
+    try:
+        while True:
+            followup = input("Enter follow-up message (or press Enter to exit): ")
+            if not followup.strip():
+                break
+            # Each follow-up is its own request in the span log
+            with span("request", mode="follow_up"):
+                if chat is None:
+                    from chat_session import ChatSession
+                    chat = ChatSession(client, task, steps, result, doc_file)
+                print("Follow-up response:")
+                for text in chat.send(followup):
+                    print(text, end="", flush=True)
+            turn = chat.turns[-1]
+            print(f"\n[{turn['latency_seconds']:.2f}s, first token {turn.get('first_token_seconds', 0):.2f}s, "
+                  f"{turn['prompt_tokens']} prompt tokens ({turn['cached_tokens']} cached), "
+                  f"{turn['output_tokens']} output tokens]", file=sys.stderr)
+    finally:
+        if chat is not None:
+            print(f"Follow-ups: {json.dumps(chat.totals())}", file=sys.stderr)
+            chat.close()
+
+@tracing.op
+def main(args: argparse.Namespace):
+    from google import genai
+    from together import Together
+
+    together_client = Together(api_key=require_env("TOGETHER_API_KEY"))
+    
+    # Create the Gen AI client using the API key
+    client = genai.Client(api_key=require_env("GEMINI_API_KEY"))
+
+    if args.batch:
+        run_batch_mode(args, client, together_client)
+        return
+
+    user_task = get_user_input(args)
+
+    # One root span per request, so every stage span of this task shares its trace id
+    with span("request", mode="stream" if args.stream else "planned"):
+        if args.stream:
+            from step_stream import numbered
+            plan, streamed = activate_streaming_agent(together_client, client, user_task)
+            steps, result = numbered(streamed["steps"]) or None, streamed["histories"] or None
+        else:
+            plan, result = run_planned(together_client, client, user_task)
+            steps = plan["steps"]
+    follow_up(client, user_task, steps, result, plan.get("doc_file"))
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    # Ensure the API keys are set before anything slow happens
+    require_env("GEMINI_API_KEY")
+    require_env("TOGETHER_API_KEY")
+    # Tracing init, client imports and the query model load while the user types the task
+    tracing.init_tracing(background=True)
+    if os.getenv("CLI_WARMUP", "1") != "0":
+        warm_up()
+    if not args.batch:
+        get_user_input(args)
+    try:
+        main(args)
+    finally:
+        shutdown()
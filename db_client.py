@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""Shared, pooled database client for ApertureDB and compatible servers.
+
+connect_to_db returns the process-wide DBClient, which speaks the same
+`query(q, blobs)` interface as aperturedb.Connector on top of a bounded pool of
+connections:
+
+- connections are reused across searches and ingest batches, and idle ones are
+  health-checked (GetStatus) before reuse
+- failed round trips are retried with jittered exponential backoff on a fresh
+  connection. Only read-only transactions (Find*, GetStatus) are retried once
+  the request may have been sent, so writes are never applied twice.
+- socket timeouts and TCP keepalive on every connection
+- round-trip latency, retry and pool metrics (stats())
+
+Configuration comes from the environment:
+
+    APERTUREDB_HOST, APERTUREDB_PORT (55555), APERTUREDB_USER (admin), APERTUREDB_PASSWORD
+    APERTUREDB_USE_SSL         0 to disable TLS (default 1)
+    VECTOR_REMOTE              host:port of a fake server (VECTOR_BACKEND=remote)
+    DB_POOL_SIZE               max open connections (default 4)
+    DB_TIMEOUT                 socket / pool wait timeout in seconds (default 30)
+    DB_RETRIES                 retries after the first attempt (default 3)
+    DB_BACKOFF                 base backoff in seconds (default 0.2)
+    DB_HEALTHCHECK_IDLE        idle seconds after which a connection is checked (default 30)
+
+The fake server serves a local index (vector_index.LocalConnector) over TCP with
+length-prefixed JSON + blob frames, optionally with injected latency and
+dropped connections, so pooling and retries can be exercised offline:
+
+    python db_client.py serve --port 55600 --root /tmp/fake_index --fail-rate 0.1
+    VECTOR_BACKEND=remote VECTOR_REMOTE=127.0.0.1:55600 python query_pdf.py
+    python db_client.py check --remote 127.0.0.1:55600 --queries 200   # round-trip stats
+"""
+import argparse
+import contextlib
+import json
+import os
+import queue
+import random
+import socket
+import socketserver
+import struct
+import threading
+import time
+from collections import deque
+
+READ_ONLY_COMMANDS = ("FindDescriptor", "FindDescriptorSet", "GetStatus")
+TRANSIENT_ERRORS = (OSError, EOFError)
+LATENCY_WINDOW = 10000
+
+
+class DBUnavailable(ConnectionError):
+    """No connection could be obtained or the query kept failing after retries"""
+
+
+def _keepalive(sock, timeout):
+    sock.settimeout(timeout)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+
+def _recv_exactly(sock, n):
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise EOFError("connection closed by peer")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def send_frames(sock, header, blobs):
+    """One message: length-prefixed JSON header with the blob count, then length-prefixed blobs"""
+    payload = json.dumps({**header, "blobs": len(blobs)}).encode()
+    parts = [struct.pack("!I", len(payload)), payload]
+    for blob in blobs:
+        parts += [struct.pack("!I", len(blob)), blob]
+    sock.sendall(b"".join(parts))
+
+
+def recv_frames(sock):
+    (length,) = struct.unpack("!I", _recv_exactly(sock, 4))
+    header = json.loads(_recv_exactly(sock, length))
+    blobs = []
+    for _ in range(header.pop("blobs")):
+        (length,) = struct.unpack("!I", _recv_exactly(sock, 4))
+        blobs.append(_recv_exactly(sock, length))
+    return header, blobs
+
+
+class RemoteConnector:
+    """Connection to a fake server (serve below); same query(q, blobs) interface as aperturedb.Connector"""
+
+    def __init__(self, host, port, timeout=30.0):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        _keepalive(self.sock, timeout)
+
+    def query(self, q, blobs=None):
+        send_frames(self.sock, {"query": q}, list(blobs or []))
+        header, out_blobs = recv_frames(self.sock)
+        if "error" in header:
+            raise ValueError(header["error"])
+        return header["responses"], out_blobs
+
+    def close(self):
+        with contextlib.suppress(OSError):
+            self.sock.close()
+
+
+def _aperturedb_factory(timeout):
+    password = os.getenv("APERTUREDB_PASSWORD")
+    if not password:
+        raise DBUnavailable("Set APERTUREDB_PASSWORD (and APERTUREDB_HOST/APERTUREDB_USER) to use ApertureDB")
+    host = os.getenv("APERTUREDB_HOST", "metis-t3oknmxh.farm0000.cloud.aperturedata.io")
+
+    def connect():
+        from aperturedb import Connector
+        connection = Connector.Connector(host=host, port=int(os.getenv("APERTUREDB_PORT", "55555")),
+                                         user=os.getenv("APERTUREDB_USER", "admin"), password=password,
+                                         use_ssl=os.getenv("APERTUREDB_USE_SSL", "1") != "0")
+        # The connector keeps its (TLS) socket in .conn; apply the timeout and keepalive where it does
+        sock = getattr(connection, "conn", None)
+        if isinstance(sock, socket.socket):
+            _keepalive(sock, timeout)
+        return connection
+    return connect
+
+
+def _remote_factory(timeout):
+    host, _, port = os.getenv("VECTOR_REMOTE", "127.0.0.1:55600").rpartition(":")
+    return lambda: RemoteConnector(host, int(port), timeout)
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+class DBClient:
+    """Bounded pool of connections behind a retrying query(q, blobs)"""
+
+    def __init__(self, connect, pool_size=None, timeout=None, retries=None, backoff=None, healthcheck_idle=None):
+        self._connect = connect
+        self.pool_size = pool_size or int(os.getenv("DB_POOL_SIZE", "4"))
+        self.timeout = timeout or float(os.getenv("DB_TIMEOUT", "30"))
+        self.retries = retries if retries is not None else int(os.getenv("DB_RETRIES", "3"))
+        self.backoff = backoff or float(os.getenv("DB_BACKOFF", "0.2"))
+        self.healthcheck_idle = healthcheck_idle or float(os.getenv("DB_HEALTHCHECK_IDLE", "30"))
+        self._idle = queue.LifoQueue()
+        # Counts open connections, idle or in use; released when a connection is closed
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {"queries": 0, "failed_queries": 0, "retries": 0, "connections_opened": 0,
+                         "connections_closed": 0, "health_checks": 0, "failed_health_checks": 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _open(self):
+        try:
+            connection = self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+        self._count("connections_opened")
+        return connection
+
+    def _close(self, connection):
+        close = getattr(connection, "close", None)
+        if callable(close):
+            with contextlib.suppress(Exception):
+                close()
+        self._count("connections_closed")
+        self._slots.release()
+
+    def _healthy(self, connection):
+        self._count("health_checks")
+        try:
+            responses, _ = connection.query([{"GetStatus": {}}])
+            return responses[0]["GetStatus"].get("status", 0) == 0
+        except Exception:
+            self._count("failed_health_checks")
+            return False
+
+    def _acquire(self):
+        """An idle connection (checked if it sat unused), or a new one if the pool has room"""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                connection, last_used = self._idle.get_nowait()
+            except queue.Empty:
+                if self._slots.acquire(timeout=0.05):
+                    return self._open()
+                if time.monotonic() > deadline:
+                    raise DBUnavailable(f"No DB connection available within {self.timeout}s "
+                                        f"(pool size {self.pool_size})")
+                continue
+            if time.monotonic() - last_used < self.healthcheck_idle or self._healthy(connection):
+                return connection
+            self._close(connection)
+
+    def _release(self, connection):
+        self._idle.put((connection, time.monotonic()))
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a pooled connection; it is closed instead of returned if the caller raised"""
+        connection = self._acquire()
+        try:
+            yield connection
+        except BaseException:
+            self._close(connection)
+            raise
+        self._release(connection)
+
+    def query(self, q, blobs=None):
+        """Run a transaction, retrying transient failures on a fresh connection"""
+        blobs = list(blobs or [])
+        read_only = all(next(iter(command)) in READ_ONLY_COMMANDS for command in q)
+        for attempt in range(self.retries + 1):
+            sent = False
+            try:
+                with self.connection() as connection:
+                    sent = True
+                    start = time.perf_counter()
+                    result = connection.query(q, blobs)
+                    elapsed = time.perf_counter() - start
+                with self._lock:
+                    self._latencies.append(elapsed)
+                    self.counters["queries"] += 1
+                return result
+            except DBUnavailable:
+                # Pool exhausted or not configured; waiting longer would not help
+                self._count("failed_queries")
+                raise
+            except TRANSIENT_ERRORS as e:
+                # A write that may have reached the server is not replayed
+                if attempt == self.retries or (sent and not read_only):
+                    self._count("failed_queries")
+                    raise DBUnavailable(f"DB query failed after {attempt + 1} attempts: {e}") from e
+                self._count("retries")
+                # Full jitter, so clients that failed together do not retry together
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def stats(self):
+        """Round-trip latency percentiles (seconds) and pool/retry counters"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            counters = dict(self.counters)
+        return {**counters, "pool_size": self.pool_size, "idle": self._idle.qsize(),
+                "round_trip_p50": _percentile(latencies, 0.5), "round_trip_p95": _percentile(latencies, 0.95),
+                "round_trip_p99": _percentile(latencies, 0.99)}
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(backend="aperturedb"):
+    """Process-wide DBClient per backend ('aperturedb' or 'remote')"""
+    with _clients_lock:
+        if backend not in _clients:
+            timeout = float(os.getenv("DB_TIMEOUT", "30"))
+            factories = {"aperturedb": _aperturedb_factory, "remote": _remote_factory}
+            if backend not in factories:
+                raise ValueError(f"Unknown DB backend: {backend}")
+            _clients[backend] = DBClient(factories[backend](timeout), timeout=timeout)
+        return _clients[backend]
+
+
+class _FakeHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                header, blobs = recv_frames(self.request)
+            except (EOFError, OSError):
+                return
+            if server.delay:
+                time.sleep(server.delay)
+            # Drop the connection before answering, as a flaky network or server restart would
+            if server.fail_rate and random.random() < server.fail_rate:
+                self.request.close()
+                return
+            try:
+                responses, out_blobs = server.connector.query(header["query"], blobs)
+                send_frames(self.request, {"responses": responses}, out_blobs)
+            except (EOFError, OSError):
+                return
+            except Exception as e:
+                send_frames(self.request, {"error": f"{type(e).__name__}: {e}"}, [])
+
+
+class FakeServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """TCP server answering the query/blob protocol from a LocalConnector"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, root, delay=0.0, fail_rate=0.0):
+        from vector_index import LocalConnector
+        self.connector = LocalConnector(root)
+        self.delay = delay
+        self.fail_rate = fail_rate
+        super().__init__(address, _FakeHandler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pooled DB client and fake server")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve = subparsers.add_parser("serve", help="Serve a local index over the fake protocol")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=55600)
+    serve.add_argument("--root", default=os.getenv("VECTOR_INDEX_DIR", "vector_index"))
+    serve.add_argument("--delay", type=float, default=0.0, help="Seconds added to every request")
+    serve.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests whose connection is dropped")
+    check = subparsers.add_parser("check", help="Run GetStatus round trips and print client stats")
+    check.add_argument("--remote", help="host:port of a fake server (default: ApertureDB from the environment)")
+    check.add_argument("--queries", type=int, default=50)
+    check.add_argument("--threads", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        with FakeServer((args.host, args.port), args.root, args.delay, args.fail_rate) as server:
+            print(f"Serving {args.root} on {args.host}:{args.port}")
+            server.serve_forever()
+        return
+    if args.remote:
+        os.environ["VECTOR_REMOTE"] = args.remote
+    client = get_client("remote" if args.remote else "aperturedb")
+    errors = []
+
+    def worker(n):
+        for _ in range(n):
+            try:
+                client.query([{"GetStatus": {}}])
+            except DBUnavailable as e:
+                errors.append(str(e))
+
+    threads = [threading.Thread(target=worker, args=(args.queries // args.threads,)) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(json.dumps({**client.stats(), "errors": len(errors)}, indent=2))
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
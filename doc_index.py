@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""Document-level centroid index for two-stage (coarse-to-fine) PDF search.
+
+Every descriptor set `<set>` gets a companion set `<set>_docs` holding up to
+DOC_CENTROIDS k-means centroids of each PDF's descriptors. A search first
+shortlists the PDFs whose centroids are closest to the query, then runs the
+k-NN search over the shortlisted PDFs' descriptors only, projecting just
+`pdf_name` and the score, and aggregates the hits into ranked documents.
+Several queries share both round trips: each stage is one transaction with a
+FindDescriptor command per query.
+When a set has no document index yet, or the shortlist query fails, the search
+runs in a single stage over the whole set.
+
+Centroids are only computed at ingest time: process_image_text recomputes the
+PDFs it re-ingests and then indexes any PDF added, removed or resized by other
+means. Searches never write; they only check that the document set exists. Sets
+populated elsewhere (such as the text set) are indexed by hand:
+
+    python doc_index.py refresh pdf_instructions_correct2   # PDFs added, removed or resized
+    python doc_index.py build pdf_instructions_correct2     # every PDF
+"""
+import argparse
+import os
+from collections import Counter
+
+import numpy as np
+
+from vector_index import connect_to_db, kmeans
+
+DOC_CENTROIDS = int(os.getenv("DOC_CENTROIDS", "2"))
+SHORTLIST_DOCS = int(os.getenv("SHORTLIST_DOCS", "3"))
+
+
+def doc_set_name(descriptorset_name):
+    return f"{descriptorset_name}_docs"
+
+
+def fetch_vectors(db, descriptorset_name, pdf_name):
+    """All descriptor vectors of one PDF"""
+    q = [{
+        "FindDescriptor": {
+            "set": descriptorset_name,
+            "constraints": {"pdf_name": ["==", pdf_name]},
+            "results": {"list": ["pdf_name"], "blobs": True},
+        }
+    }]
+    _, blobs = db.query(q)
+    return np.stack([np.frombuffer(blob, dtype=np.float32) for blob in blobs]) if blobs else None
+
+
+def count_pdf_descriptors(db, descriptorset_name):
+    """{pdf_name: descriptor count} over a whole set"""
+    q = [{"FindDescriptor": {"set": descriptorset_name, "results": {"list": ["pdf_name"]}}}]
+    responses, _ = db.query(q)
+    return Counter(entity["pdf_name"] for entity in responses[0]["FindDescriptor"].get("entities") or [])
+
+
+def list_pdf_names(db, descriptorset_name):
+    return sorted(count_pdf_descriptors(db, descriptorset_name))
+
+
+def document_centroids(vectors, n_centroids=DOC_CENTROIDS):
+    """Up to n_centroids normalized k-means centroids of a PDF's (normalized) descriptors"""
+    vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+    if len(vectors) <= n_centroids:
+        return vectors
+    centroids, _ = kmeans(vectors, n_centroids)
+    return centroids
+
+
+def update_document_index(db, descriptorset_name, pdf_names, n_centroids=DOC_CENTROIDS):
+    """Recompute the centroids of the given PDFs from their current descriptors"""
+    doc_set = doc_set_name(descriptorset_name)
+    responses, _ = db.query([{"FindDescriptorSet": {"with_name": doc_set}}])
+    exists = responses[0]["FindDescriptorSet"].get("returned", 0)
+    for pdf_name in pdf_names:
+        vectors = fetch_vectors(db, descriptorset_name, pdf_name)
+        if exists:
+            db.query([{"DeleteDescriptor": {"set": doc_set, "constraints": {"pdf_name": ["==", pdf_name]}}}])
+        if vectors is None:
+            continue
+        if not exists:
+            db.query([{"AddDescriptorSet": {"name": doc_set, "dimensions": int(vectors.shape[1]),
+                                            "engine": "Flat", "metric": "IP"}}])
+            exists = True
+        centroids = document_centroids(vectors, n_centroids)
+        q = [{"AddDescriptor": {"set": doc_set, "properties": {"pdf_name": pdf_name, "centroid": i,
+                                                               "descriptors": len(vectors)}}}
+             for i in range(len(centroids))]
+        db.query(q, [centroid.astype("float32").tobytes() for centroid in centroids])
+
+
+def refresh_document_index(db, descriptorset_name, n_centroids=DOC_CENTROIDS):
+    """Recompute the centroids of PDFs added, removed or resized since they were indexed.
+
+    Each centroid records how many descriptors its PDF had; a PDF re-ingested with
+    the same count keeps its old centroids until a full build. Returns the PDF
+    names that were refreshed.
+    """
+    counts = count_pdf_descriptors(db, descriptorset_name)
+    responses, _ = db.query([{"FindDescriptorSet": {"with_name": doc_set_name(descriptorset_name)}}])
+    indexed = {}
+    if responses[0]["FindDescriptorSet"].get("returned", 0):
+        q = [{"FindDescriptor": {"set": doc_set_name(descriptorset_name),
+                                 "results": {"list": ["pdf_name", "descriptors"]}}}]
+        responses, _ = db.query(q)
+        indexed = {entity["pdf_name"]: entity.get("descriptors")
+                   for entity in responses[0]["FindDescriptor"].get("entities") or []}
+    stale = sorted(name for name in set(counts) | set(indexed) if counts.get(name) != indexed.get(name))
+    update_document_index(db, descriptorset_name, stale, n_centroids)
+    return stale
+
+
+def sync_document_index(db, descriptorset_name, pdf_names, n_centroids=DOC_CENTROIDS):
+    """After ingestion: recompute the re-ingested PDFs, then any PDF added, removed or resized elsewhere"""
+    update_document_index(db, descriptorset_name, pdf_names, n_centroids)
+    return sorted(set(pdf_names) | set(refresh_document_index(db, descriptorset_name, n_centroids)))
+
+
+def has_document_index(db, descriptorset_name):
+    """Whether a set's document index exists; a cheap metadata query, safe on the search path"""
+    responses, _ = db.query([{"FindDescriptorSet": {"with_name": doc_set_name(descriptorset_name)}}])
+    return bool(responses[0]["FindDescriptorSet"].get("returned", 0))
+
+
+def shortlist_documents(db, descriptorset_name, query_bytes, n_docs=SHORTLIST_DOCS):
+    """PDF names whose centroids are closest to the query, or None without a document index"""
+    return shortlist_documents_many(db, descriptorset_name, [query_bytes], n_docs)[0]
+
+
+def shortlist_documents_many(db, descriptorset_name, query_bytes_list, n_docs=SHORTLIST_DOCS):
+    """shortlist_documents for several queries in one transaction"""
+    q = [{
+        "FindDescriptor": {
+            "set": doc_set_name(descriptorset_name),
+            "k_neighbors": n_docs * DOC_CENTROIDS,
+            "distances": True,
+            "results": {"list": ["pdf_name"]},
+        }
+    } for _ in query_bytes_list]
+    try:
+        responses, _ = db.query(q, list(query_bytes_list))
+    except Exception:
+        # A missing document set is reported as an error by some backends; any failure
+        # here only costs the shortlist, the single-stage search still answers
+        return [None] * len(query_bytes_list)
+    if not isinstance(responses, list) or len(responses) != len(q):
+        return [None] * len(query_bytes_list)
+    return [_shortlist(response, n_docs) for response in responses]
+
+
+def _shortlist(response, n_docs):
+    """PDF names from one shortlist response, or None if it is an error or malformed"""
+    try:
+        response = response["FindDescriptor"]
+        if response.get("status", 0) != 0 or not response.get("entities"):
+            return None
+        names = []
+        for entity in response["entities"]:
+            if entity["pdf_name"] not in names:
+                names.append(entity["pdf_name"])
+    except (KeyError, TypeError, AttributeError):
+        return None
+    return names[:n_docs]
+
+
+def rank_documents(db, descriptorset_name, query_embedding, n_docs=SHORTLIST_DOCS, k=20, two_stage=True):
+    """Documents ranked by their best descriptor score: [{pdf_name, score, hits}] best first"""
+    return rank_documents_many(db, descriptorset_name, [query_embedding], n_docs, k, two_stage)[0]
+
+
+def rank_documents_many(db, descriptorset_name, query_embeddings, n_docs=SHORTLIST_DOCS, k=20, two_stage=True):
+    """rank_documents for several queries: one shortlist and one k-NN transaction for all of them.
+
+    With two_stage=False (a set without a document index) the shortlist round trip is skipped.
+    """
+    query_bytes_list = [embedding.astype("float32").tobytes() for embedding in query_embeddings]
+    if two_stage:
+        shortlists = shortlist_documents_many(db, descriptorset_name, query_bytes_list, n_docs)
+    else:
+        shortlists = [None] * len(query_bytes_list)
+    q = []
+    for shortlist in shortlists:
+        body = {
+            "set": descriptorset_name,
+            "k_neighbors": k,
+            "distances": True,
+            "results": {"list": ["pdf_name"]},
+        }
+        if shortlist:
+            body["constraints"] = {"pdf_name": ["in", shortlist]}
+        q.append({"FindDescriptor": body})
+    responses, _ = db.query(q, query_bytes_list)
+    rankings = []
+    for response in responses:
+        documents = {}
+        for entity in response["FindDescriptor"].get("entities") or []:
+            document = documents.setdefault(entity["pdf_name"], {"pdf_name": entity["pdf_name"],
+                                                                  "score": entity["_distance"], "hits": 0})
+            document["score"] = max(document["score"], entity["_distance"])
+            document["hits"] += 1
+        rankings.append(sorted(documents.values(), key=lambda document: -document["score"]))
+    return rankings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Document-level centroid index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Rebuild the centroids of every PDF in a descriptor set")
+    refresh = subparsers.add_parser("refresh", help="Rebuild only PDFs added, removed or resized since indexing")
+    for subparser in (build, refresh):
+        subparser.add_argument("descriptorset_name")
+        subparser.add_argument("--centroids", type=int, default=DOC_CENTROIDS, help="Centroids per PDF")
+    args = parser.parse_args()
+
+    db = connect_to_db()
+    if args.command == "refresh":
+        pdf_names = refresh_document_index(db, args.descriptorset_name, args.centroids)
+    else:
+        pdf_names = list_pdf_names(db, args.descriptorset_name)
+        update_document_index(db, args.descriptorset_name, pdf_names, args.centroids)
+    print(f"Indexed {len(pdf_names)} documents into {doc_set_name(args.descriptorset_name)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Persistent embedding cache shared by ingestion and query.
+
+Entries are keyed by (model id, preprocessing version, content hash). Each
+(model, modality, preprocessing version) namespace has its own directory with a
+memory-mapped vector file, grown on demand up to a fixed capacity, and a SQLite
+index mapping content hashes to slots. When a namespace is full the least
+recently used slot is reused.
+
+Set EMBEDDING_CACHE=0 to bypass the cache, EMBEDDING_CACHE_DIR to move it and
+EMBEDDING_CACHE_MAX_ENTRIES to bound its size per namespace.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "metis", "embeddings")
+DEFAULT_MAX_ENTRIES = 100_000
+# Rows allocated when a namespace is first written; the file doubles as it fills, up to max_entries
+INITIAL_CAPACITY = 1024
+
+
+def content_hash(data):
+    """sha256 of text, raw bytes, a still-encoded PageImage, or a PIL image's decoded pixels"""
+    if isinstance(data, str):
+        data = data.encode()
+    elif isinstance(getattr(data, "data", None), bytes):
+        # PageImage: the encoded bytes (same as PageImage.hash), so a cache hit never decodes it
+        data = data.data
+    elif not isinstance(data, (bytes, bytearray)):
+        # PIL image: hash mode and size too so identical pixel buffers of different shapes differ
+        data = f"{data.mode}:{data.size}".encode() + data.tobytes()
+    return hashlib.sha256(data).hexdigest()
+
+
+def vector_digest(vector):
+    """Short checksum stored next to each slot to detect a vector overwritten by another process"""
+    return hashlib.sha1(np.ascontiguousarray(vector, dtype=np.float32).tobytes()).hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """One cache namespace: vectors.npy (memmap) plus an LRU index in index.sqlite"""
+
+    def __init__(self, model_id, modality, preprocess_version, root=None, max_entries=None):
+        self.namespace = f"{model_id}|{modality}|v{preprocess_version}"
+        self.max_entries = max_entries or int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+        root = root or os.getenv("EMBEDDING_CACHE_DIR", DEFAULT_CACHE_DIR)
+        self.path = os.path.join(root, hashlib.sha1(self.namespace.encode()).hexdigest()[:16])
+        os.makedirs(self.path, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._vectors_id = None
+        self._db = sqlite3.connect(os.path.join(self.path, "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries "
+                         "(key TEXT PRIMARY KEY, slot INTEGER UNIQUE, last_used REAL, digest TEXT)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        if "digest" not in [row[1] for row in self._db.execute("PRAGMA table_info(entries)")]:
+            try:
+                # Caches written before digests were stored; their entries miss once and are rewritten
+                self._db.execute("ALTER TABLE entries ADD COLUMN digest TEXT")
+            except sqlite3.OperationalError:
+                pass  # another process added it first
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)")
+        self._db.execute("INSERT OR IGNORE INTO meta VALUES ('namespace', ?)", (self.namespace,))
+        self._db.commit()
+
+    def _map_vectors(self):
+        """Map vectors.npy, remapping it when another process created or grew it since"""
+        try:
+            st = os.stat(os.path.join(self.path, "vectors.npy"))
+        except FileNotFoundError:
+            self._vectors = self._vectors_id = None
+            return None
+        if self._vectors is None or self._vectors_id != (st.st_ino, st.st_size):
+            self._vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r+")
+            self._vectors_id = (st.st_ino, st.st_size)
+        return self._vectors
+
+    def _reserve(self, slot, dimensions):
+        """vectors.npy with room for `slot`, doubling it when full; the SQLite write lock must be held"""
+        vectors = self._map_vectors()
+        if vectors is not None and slot < len(vectors):
+            return vectors
+        capacity = len(vectors) if vectors is not None else INITIAL_CAPACITY
+        while capacity <= slot:
+            capacity *= 2
+        capacity = max(min(capacity, self.max_entries), slot + 1)
+        # Every writer holds the write lock, so nobody writes the old file while it is copied
+        vectors_path = os.path.join(self.path, "vectors.npy")
+        tmp_path = f"{vectors_path}.{os.getpid()}.tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dimensions))
+        if vectors is not None:
+            grown[:len(vectors)] = vectors
+        grown.flush()
+        del grown
+        os.replace(tmp_path, vectors_path)
+        return self._map_vectors()
+
+    def get_many(self, keys):
+        """Cached vectors for keys (None where missing); refreshes LRU time of hits.
+
+        Another process may evict a slot and overwrite it before its index change commits,
+        so a vector only counts as a hit if it still matches the digest stored with its key.
+        """
+        with self._lock:
+            found = {}
+            vectors = self._map_vectors()
+            if vectors is not None:
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    rows = self._db.execute(
+                        f"SELECT key, slot, digest FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                    found.update((key, (slot, digest)) for key, slot, digest in rows)
+            results, hit_keys = [], []
+            for key in keys:
+                vector = None
+                if key in found:
+                    slot, digest = found[key]
+                    candidate = np.array(vectors[slot]) if slot < len(vectors) else None
+                    if candidate is not None and vector_digest(candidate) == digest:
+                        vector = candidate
+                        hit_keys.append(key)
+                results.append(vector)
+            now = time.time()
+            self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in hit_keys])
+            self._db.commit()
+            self.hits += len(hit_keys)
+            self.misses += len(keys) - len(hit_keys)
+            return results
+
+    def put_many(self, keys, vectors):
+        """Store vectors, evicting least recently used entries when full"""
+        with self._lock:
+            vectors = np.asarray(vectors, dtype=np.float32)
+            now = time.time()
+            # Hold SQLite's write lock while picking slots and writing or growing the file,
+            # so concurrent processes never pick the same slot or write a file being replaced
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                store = None
+                for key, vector in zip(keys, vectors):
+                    row = self._db.execute("SELECT slot FROM entries WHERE key = ?", (key,)).fetchone()
+                    if row:
+                        slot = row[0]
+                    else:
+                        (count,) = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()
+                        if count < self.max_entries:
+                            # Slots are only ever reused by eviction, so slots 0..count-1 are exactly the used ones
+                            slot = count
+                        else:
+                            key_evicted, slot = self._db.execute(
+                                "SELECT key, slot FROM entries ORDER BY last_used LIMIT 1").fetchone()
+                            self._db.execute("DELETE FROM entries WHERE key = ?", (key_evicted,))
+                    store = self._reserve(slot, vectors.shape[1])
+                    store[slot] = vector
+                    self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                                     (key, slot, now, vector_digest(vector)))
+                if store is not None:
+                    store.flush()
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def get_or_compute(self, items, compute, keys=None):
+        """Vectors for items, calling compute(missing_items) once for all cache misses"""
+        keys = keys or [content_hash(item) for item in items]
+        cached = self.get_many(keys)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+        if missing:
+            computed = np.asarray(compute([items[i] for i in missing]), dtype=np.float32)
+            self.put_many([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, computed):
+                cached[i] = vector
+        return np.stack(cached) if cached else np.empty((0, 0), dtype=np.float32)
+
+    def stats(self):
+        (entries,) = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {"namespace": self.namespace, "entries": entries, "max_entries": self.max_entries,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(model_id, modality, preprocess_version):
+    """Process-wide cache for a namespace, or None when EMBEDDING_CACHE=0"""
+    if os.getenv("EMBEDDING_CACHE", "1") == "0":
+        return None
+    key = (model_id, modality, preprocess_version)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EmbeddingCache(model_id, modality, preprocess_version)
+        return _caches[key]
+
+
+def cached_encode(model_id, modality, preprocess_version, items, compute, keys=None):
+    """Encode items through the cache for the namespace, or directly if caching is off"""
+    cache = get_cache(model_id, modality, preprocess_version)
+    if cache is None:
+        return np.asarray(compute(items), dtype=np.float32)
+    return cache.get_or_compute(items, compute, keys)
+
+
+def cache_stats():
+    """Hit/miss counters for every namespace used in this process"""
+    return [cache.stats() for cache in _caches.values()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the embedding cache")
+    parser.add_argument("--dir", default=os.getenv("EMBEDDING_CACHE_DIR", DEFAULT_CACHE_DIR))
+    args = parser.parse_args()
+    if not os.path.isdir(args.dir):
+        print("Embedding cache is empty")
+        return
+    for entry in sorted(os.listdir(args.dir)):
+        index_path = os.path.join(args.dir, entry, "index.sqlite")
+        if not os.path.exists(index_path):
+            continue
+        db = sqlite3.connect(index_path)
+        (namespace,) = db.execute("SELECT value FROM meta WHERE name = 'namespace'").fetchone()
+        (entries,) = db.execute("SELECT COUNT(*) FROM entries").fetchone()
+        print(json.dumps({"namespace": namespace, "entries": entries}))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""LLM evaluator for browser agent runs, shared by the CLI and batch_eval"""
+import json
+from typing import Optional, Literal
+from pydantic import BaseModel, ValidationError
+
+EVAL_MODEL = "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo"
+
+# Schema for the evaluation
+class Evaluation(BaseModel):
+    evaluation: Literal["PASS", "NEEDS_IMPROVEMENT", "FAIL"]
+    feedback: str
+
+# Simple JSON mode LLM call helper function - will be used by the Evaluator
+def JSON_llm(together_client, user_prompt : str, schema : BaseModel, system_prompt : Optional[str] = None, model : str = EVAL_MODEL):
+    """ Run a language model with the given user prompt and system prompt, and return a structured JSON object. """
+    try:
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        
+        messages.append({"role": "user", "content": user_prompt})
+        
+        extract = together_client.chat.completions.create(
+            messages=messages,
+            model=model,
+            response_format={
+                "type": "json_object",
+                "schema": schema.model_json_schema(),
+            },
+        )
+        
+        response = json.loads(extract.choices[0].message.content)
+        return response
+        
+    except ValidationError as e:
+        raise ValueError(f"Schema validation failed: {str(e)}")
+    
+EVALUATOR_PROMPT = """Evaluate this following trace for an agent executing a task. You should be evaluate whether or not it was successful at solving the task.
+If it was not successful, then explain what stage it failed in the execution trace.
+Only output "PASS" if all criteria are met and you have no further suggestions for improvements, otherwise output "FAIL".
+Provide detailed feedback if there are areas that need improvement. You should specify what needs improvement and why.
+Only output JSON.
+
+Task: {task}
+Steps: {steps}
+Trace: {trace}
+Feedback: {feedback}
+Comment: {comment}
+
+Output:"""
+
+def evaluate(together_client, schema, task, steps, trace, feedback, comment) -> tuple[str, str]:
+    """Evaluate if a solution meets requirements."""
+    full_prompt = EVALUATOR_PROMPT.format(task=task, steps=steps, trace=trace, feedback=feedback, comment=comment)
+    
+    response = JSON_llm(together_client, full_prompt, schema)
+    
+    evaluation = response["evaluation"]
+    feedback = response["feedback"]
+
+    print("=== EVALUATION START ===")
+    print(f"Status: {evaluation}")
+    print(f"Feedback: {feedback}")
+    print("=== EVALUATION END ===\n")
+
+    return evaluation, feedback
+
+def single_eval(together_client, task, steps, trace, feedback, comment) -> tuple[str, list[dict]]:
+    # While the generated response is not passing, keep generating and evaluating
+    return evaluate(together_client, Evaluation, task, steps, trace, feedback, comment)
@@ -0,0 +1,185 @@
+"""Content-hash manifest for incremental re-ingestion.
+
+The manifest remembers, per PDF, the file hash and for every page a hash of its
+text and non-boilerplate images. A sync run then only re-parses PDFs whose file
+hash changed, and only re-encodes the pages whose hash changed; descriptors of
+stale pages are deleted before the new ones are added. PDFs that were deleted
+from disk are reported so their descriptors can be removed too.
+
+Boilerplate images (the Scribe logo and similar) are detected by content hash:
+an image is boilerplate once it appears in BOILERPLATE_MIN_PDFS different PDFs
+or on BOILERPLATE_MIN_PAGES pages of the corpus. Pages are counted before the
+extractor drops repeated xrefs, so a logo placed on every page of one PDF counts
+once per page. Pages whose images became (or stopped being) boilerplate are
+re-ingested.
+"""
+import hashlib
+import json
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf_extract import iter_pdf_pages
+
+MANIFEST_VERSION = 3
+DEFAULT_MANIFEST_PATH = "ingest_manifest.json"
+BOILERPLATE_MIN_PDFS = 2
+BOILERPLATE_MIN_PAGES = 3
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pdf_name_for(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def scan_pdf(pdf_path):
+    """Hash a PDF, each page's text and each page's raw image bytes, without decoding images.
+
+    "images" are the hashes of the images the extractor yields for the page (new xrefs
+    only), "placed_images" the hashes of every image placed on it, repeats included.
+    """
+    pages, xref_hashes = [], {}
+    for record in iter_pdf_pages(pdf_path):
+        xref_hashes.update((image.xref, image.hash) for image in record["images"])
+        pages.append({"text_hash": sha256_bytes(record["text"].encode()),
+                      "images": [image.hash for image in record["images"]],
+                      "placed_images": [xref_hashes[xref] for xref in record["xrefs"] if xref in xref_hashes]})
+    return {"pdf_name": pdf_name_for(pdf_path), "path": os.path.abspath(pdf_path),
+            "sha256": file_hash(pdf_path), "pages": pages}
+
+
+def page_entries(scan, boilerplate):
+    """Per-page manifest entries: content hash plus the image_index the page starts at"""
+    entries, image_index = [], 0
+    for page in scan["pages"]:
+        kept = [h for h in page["images"] if h not in boilerplate]
+        entries.append({
+            "hash": sha256_bytes((page["text_hash"] + "," + ",".join(kept)).encode()),
+            "images": page["images"],
+            "placed_images": page["placed_images"],
+            "first_image_index": image_index,
+        })
+        image_index += len(kept)
+    return entries
+
+
+class IngestManifest:
+    """JSON manifest of ingested PDFs, their page hashes and known boilerplate images"""
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = path
+        self.data = {"version": MANIFEST_VERSION, "files": {}, "boilerplate_images": []}
+        if os.path.exists(path):
+            with open(path) as f:
+                loaded = json.load(f)
+            if loaded.get("version") == MANIFEST_VERSION:
+                self.data = loaded
+
+    @property
+    def files(self):
+        return self.data["files"]
+
+    @property
+    def boilerplate(self):
+        return set(self.data["boilerplate_images"])
+
+    def removed(self):
+        """Names of recorded PDFs whose file no longer exists"""
+        return sorted(name for name, entry in self.files.items() if not os.path.exists(entry["path"]))
+
+    def detect_boilerplate(self, scans, removed=()):
+        """Boilerplate image hashes across the stored corpus with `scans` replacing their old entries"""
+        pdfs_per_image, pages_per_image = Counter(), Counter()
+        pages_by_pdf = {name: entry["pages"] for name, entry in self.files.items() if name not in removed}
+        pages_by_pdf.update({scan["pdf_name"]: scan["pages"] for scan in scans})
+        for pages in pages_by_pdf.values():
+            seen_in_pdf = set()
+            for page in pages:
+                for image_hash in set(page["placed_images"]):
+                    pages_per_image[image_hash] += 1
+                    seen_in_pdf.add(image_hash)
+            pdfs_per_image.update(seen_in_pdf)
+        return {h for h in pages_per_image
+                if pdfs_per_image[h] >= BOILERPLATE_MIN_PDFS or pages_per_image[h] >= BOILERPLATE_MIN_PAGES}
+
+    def plan(self, pdf_paths, workers=None, force=False):
+        """Decide what to re-ingest.
+
+        Returns (jobs, scans, boilerplate, removed) where each job is a dict with the PDF
+        path, the pages to (re-)ingest, the pages whose descriptors must be deleted first,
+        and whether every descriptor of the PDF should be deleted instead; `removed` are
+        the names of recorded PDFs deleted from disk, whose descriptors must all go.
+        """
+        removed = self.removed()
+        changed = [path for path in pdf_paths
+                   if force or self.files.get(pdf_name_for(path), {}).get("sha256") != file_hash(path)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scans = list(pool.map(scan_pdf, changed))
+            boilerplate = self.detect_boilerplate(scans, removed)
+
+            # Unchanged PDFs with an image that became, or stopped being, boilerplate need those pages redone
+            flipped = boilerplate ^ self.boilerplate
+            scanned = {scan["pdf_name"] for scan in scans}
+            affected = [entry["path"] for name, entry in self.files.items()
+                        if name not in scanned and name not in removed
+                        and any(flipped.intersection(page["images"]) for page in entry["pages"])]
+            scans.extend(pool.map(scan_pdf, affected))
+
+        jobs = []
+        for scan in scans:
+            new_pages = page_entries(scan, boilerplate)
+            old = self.files.get(scan["pdf_name"])
+            if force or old is None:
+                # Unknown to the manifest: clear anything left over from earlier unmanaged runs
+                jobs.append({"path": scan["path"], "pdf_name": scan["pdf_name"],
+                             "pages": set(range(len(new_pages))), "delete_pages": set(), "delete_all": True})
+                continue
+            old_pages = old["pages"]
+            changed_pages = {i for i, page in enumerate(new_pages)
+                             if i >= len(old_pages)
+                             or page["hash"] != old_pages[i]["hash"]
+                             or page["first_image_index"] != old_pages[i]["first_image_index"]}
+            removed_pages = set(range(len(new_pages), len(old_pages)))
+            if changed_pages or removed_pages:
+                jobs.append({"path": scan["path"], "pdf_name": scan["pdf_name"], "pages": changed_pages,
+                             "delete_pages": (changed_pages | removed_pages) & set(range(len(old_pages))),
+                             "delete_all": False})
+        return jobs, scans, boilerplate, removed
+
+    def record(self, scans, boilerplate, failed=()):
+        """Store the scanned state once its descriptors have been written.
+
+        Scans whose path is in `failed` are not recorded: their stale pages were already
+        deleted, so they keep their old page hashes but lose their file hash, which makes
+        the next sync re-plan them.
+        """
+        for scan in scans:
+            if scan["path"] in failed:
+                if scan["pdf_name"] in self.files:
+                    self.files[scan["pdf_name"]]["sha256"] = None
+                continue
+            self.files[scan["pdf_name"]] = {"path": scan["path"], "sha256": scan["sha256"],
+                                            "pages": page_entries(scan, boilerplate)}
+        self.data["boilerplate_images"] = sorted(boilerplate)
+
+    def forget(self, pdf_names):
+        """Drop PDFs whose descriptors were deleted"""
+        for pdf_name in pdf_names:
+            self.files.pop(pdf_name, None)
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.replace(tmp_path, self.path)
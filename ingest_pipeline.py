@@ -0,0 +1,261 @@
+"""Staged, streaming ingestion of many PDFs.
+
+    parse (process pool) -> bounded page queue -> batched encoder -> bounded upload queue -> uploader
+
+Parse workers stream one record per page, so the bounded queues keep memory flat
+no matter how many PDFs are ingested: when the encoder falls behind, workers
+block on put() instead of piling up decoded pages.
+"""
+import glob
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import process_image_text as pit
+from pdf_extract import iter_pdf_pages
+
+_DONE = None
+
+
+def expand_inputs(inputs):
+    """Resolve files, directories and glob patterns into a de-duplicated list of PDF paths"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True)))
+        elif glob.has_magic(item):
+            paths.extend(sorted(glob.glob(item, recursive=True)))
+        else:
+            paths.append(item)
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+
+def parse_pdf_pages(pdf_path, page_queue, pages=None, skip_hashes=()):
+    """Parse worker: stream one PDF into page_queue as per-page records.
+
+    Only pages in `pages` (all pages if None) are emitted. Images whose content
+    hash is in `skip_hashes` are dropped; image_index keeps counting across all
+    pages so it stays stable when only some pages are re-ingested. Images stay
+    encoded until the encoder stage decodes them.
+    """
+    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    image_index, items = 0, 0
+
+    for record in iter_pdf_pages(pdf_path):
+        wanted = pages is None or record["page"] in pages
+        images = []
+        for image in record["images"]:
+            if image.hash in skip_hashes:
+                continue
+            if wanted:
+                images.append((image_index, image))
+            image_index += 1
+        if wanted:
+            items += len(record["headings"]) + len(images)
+            page_queue.put({"pdf_name": pdf_name, "page": record["page"],
+                            "headings": record["headings"], "images": images})
+    return pdf_name, items
+
+
+class _Stage(threading.Thread):
+    """Thread that keeps draining its input after a failure so upstream never blocks forever"""
+
+    def __init__(self, name, in_queue):
+        super().__init__(name=name, daemon=True)
+        self.in_queue = in_queue
+        self.error = None
+        self.busy_seconds = 0.0
+
+    def run(self):
+        while True:
+            item = self.in_queue.get()
+            if item is _DONE:
+                break
+            if self.error is not None:
+                continue
+            start = time.perf_counter()
+            try:
+                self.handle(item)
+            except Exception as e:
+                self.error = e
+            self.busy_seconds += time.perf_counter() - start
+        if self.error is None:
+            start = time.perf_counter()
+            try:
+                self.finish()
+            except Exception as e:
+                self.error = e
+            self.busy_seconds += time.perf_counter() - start
+        self.close()
+
+    def handle(self, item):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class EncoderStage(_Stage):
+    """Accumulates headings and images across pages and encodes them in full batches"""
+
+    def __init__(self, in_queue, out_queue, model, preprocess, tokenizer, image_batch_size, text_batch_size,
+                 output_dir="extracted_images"):
+        super().__init__("encoder", in_queue)
+        self.out_queue = out_queue
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self.model, self.preprocess, self.tokenizer = model, preprocess, tokenizer
+        self.image_batch_size = image_batch_size
+        self.text_batch_size = text_batch_size
+        self.texts, self.text_properties = [], []
+        self.images, self.image_properties = [], []
+        # Heading documents for the lexical index, per PDF
+        self.heading_docs = {}
+
+    def handle(self, record):
+        docs = self.heading_docs.setdefault(record["pdf_name"], [])
+        docs.extend({"pdf_name": record["pdf_name"], "page": record["page"], "text": heading}
+                    for heading in record["headings"])
+        for heading in record["headings"]:
+            self.texts.append(heading)
+            self.text_properties.append({"pdf_name": record["pdf_name"], "page": record["page"], "text": heading})
+            if len(self.texts) >= self.text_batch_size:
+                self._flush_texts()
+        for image_index, page_image in record["images"]:
+            self._export(page_image, os.path.join(self.output_dir, f"{record['pdf_name']}_image_{image_index}.png"))
+            # Kept encoded: encode_images only decodes the images the embedding cache misses
+            self.images.append(page_image)
+            self.image_properties.append({"pdf_name": record["pdf_name"], "page": record["page"],
+                                          "image_index": image_index})
+            if len(self.images) >= self.image_batch_size:
+                self._flush_images()
+
+    @staticmethod
+    def _export(page_image, path):
+        """Save an image as PNG, copying the bytes as they are when it already is one"""
+        if page_image.ext == "png":
+            with open(path, "wb") as f:
+                f.write(page_image.data)
+        else:
+            page_image.decode().save(path)
+
+    def _flush_texts(self):
+        if self.texts:
+            embeddings = pit.encode_texts(self.texts, self.model, self.tokenizer, self.text_batch_size)
+            self.out_queue.put((embeddings, self.text_properties))
+            self.texts, self.text_properties = [], []
+
+    def _flush_images(self):
+        if self.images:
+            embeddings = pit.encode_images(self.images, self.model, self.preprocess, self.image_batch_size)
+            self.out_queue.put((embeddings, self.image_properties))
+            self.images, self.image_properties = [], []
+
+    def finish(self):
+        self._flush_texts()
+        self._flush_images()
+
+    def close(self):
+        self.out_queue.put(_DONE)
+
+
+class UploaderStage(_Stage):
+    """Sends encoded batches to the descriptor set"""
+
+    def __init__(self, in_queue, db, descriptorset_name, upload_batch_size):
+        super().__init__("uploader", in_queue)
+        self.db = db
+        self.descriptorset_name = descriptorset_name
+        self.upload_batch_size = upload_batch_size
+        self.uploaded = 0
+
+    def handle(self, batch):
+        embeddings, properties_list = batch
+        pit.add_descriptors(self.db, np.asarray(embeddings), properties_list,
+                            self.descriptorset_name, self.upload_batch_size)
+        self.uploaded += len(properties_list)
+
+
+def run_pipeline(jobs, descriptorset_name, db, model, preprocess, tokenizer,
+                 skip_image_hashes=(), workers=None, queue_size=32,
+                 image_batch_size=pit.IMAGE_BATCH_SIZE, text_batch_size=pit.TEXT_BATCH_SIZE,
+                 upload_batch_size=pit.UPLOAD_BATCH_SIZE, lexical_index=None):
+    """Ingest jobs through the staged pipeline and return throughput stats.
+
+    Each job is a PDF path or an IngestManifest job dict selecting the pages to ingest.
+    If lexical_index is given, the headings of the re-ingested pages replace their old
+    entries in it once every stage succeeded.
+    """
+    start = time.perf_counter()
+    manager = mp.Manager()
+    page_queue = manager.Queue(maxsize=queue_size)
+    upload_queue = queue.Queue(maxsize=queue_size)
+
+    encoder = EncoderStage(page_queue, upload_queue, model, preprocess, tokenizer,
+                           image_batch_size, text_batch_size)
+    uploader = UploaderStage(upload_queue, db, descriptorset_name, upload_batch_size)
+    encoder.start()
+    uploader.start()
+
+    parsed, failed = [], []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {}
+            for job in jobs:
+                if isinstance(job, str):
+                    job = {"path": job, "pages": None, "delete_all": True}
+                future = pool.submit(parse_pdf_pages, job["path"], page_queue, job["pages"], skip_image_hashes)
+                futures[future] = job
+            for future, job in futures.items():
+                path = job["path"]
+                try:
+                    pdf_name, items = future.result()
+                    parsed.append(pdf_name)
+                    print(f"Parsed {items} items from PDF {pdf_name}")
+                except Exception as e:
+                    failed.append(path)
+                    print(f"Warning: failed to parse {path}: {e}")
+    finally:
+        page_queue.put(_DONE)
+        encoder.join()
+        uploader.join()
+        manager.shutdown()
+
+    for stage in (encoder, uploader):
+        if stage.error is not None:
+            raise RuntimeError(f"{stage.name} stage failed") from stage.error
+
+    if lexical_index is not None:
+        for job in futures.values():
+            if job["path"] in failed:
+                continue
+            pdf_name = os.path.splitext(os.path.basename(job["path"]))[0]
+            pages = None if job.get("delete_all") else set(job["pages"]) | set(job.get("delete_pages", ()))
+            lexical_index.replace(pdf_name, encoder.heading_docs.get(pdf_name, []), pages)
+        lexical_index.save()
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "pdfs": len(parsed),
+        "failed": failed,
+        "descriptors": uploader.uploaded,
+        "elapsed_seconds": elapsed,
+        "items_per_second": uploader.uploaded / elapsed if elapsed else 0.0,
+        "encoder_busy_seconds": encoder.busy_seconds,
+        "uploader_busy_seconds": uploader.busy_seconds,
+    }
+    print(f"\nIngested {stats['pdfs']} PDFs, {stats['descriptors']} descriptors in {elapsed:.2f}s "
+          f"({stats['items_per_second']:.1f} items/sec)")
+    print(f"  encoder busy {encoder.busy_seconds:.2f}s, uploader busy {uploader.busy_seconds:.2f}s")
+    for cache in pit.cache_stats():
+        print(f"  embedding cache {cache['namespace']}: {cache['hits']} hits, {cache['misses']} misses")
+    stats["embedding_cache"] = pit.cache_stats()
+    return stats
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""BM25 index over the cleaned PDF headings, fused with dense search.
+
+Task text often matches a Scribe heading almost verbatim ("Create New User"), so
+retrieval first scores the query against the headings with BM25. When the best
+document wins clearly (every known query term matched, the heading mostly made
+of query terms, and a score margin over the next PDF, smaller for an exact
+heading match), the lexical result is returned directly without loading an
+embedding model or querying the DB.
+Otherwise the lexical ranking is combined with the dense k-NN ranking by
+reciprocal-rank fusion.
+
+Each descriptor set has its own index file, <set>.json, recording the search
+kind (text or image_text) it was built for; a search only takes the fast path
+from an index of its own kind. Ingestion (process_image_text) keeps the
+image_text set's index in step with its descriptors; `build` indexes PDFs into
+any set directly. Tuning comes from the environment:
+
+    LEXICAL_INDEX_DIR       index directory (default lexical_index/ next to this module)
+    LEXICAL_FAST_PATH=0     always run the dense search
+    LEXICAL_MIN_MARGIN      best/second PDF score ratio for the fast path (default 1.5)
+    LEXICAL_MIN_COVERAGE    share of the heading's terms found in the query (default 0.5)
+
+    python lexical_index.py build --set pdf_instructions_correct2 create_new_user.pdf ...
+    python lexical_index.py search --set pdf_instructions_image_text "invite team member"
+"""
+import argparse
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lexical_index")
+DEFAULT_SET = "pdf_instructions_image_text"
+INDEX_VERSION = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Margin over the next PDF required when every heading term is in the query
+EXACT_MATCH_MARGIN = 1.25
+RRF_K = 60
+
+_STOPWORDS = frozenset("a an and are as at be by for from how i in is it me my of on or our please the this "
+                       "to with you your".split())
+
+
+def tokenize(text):
+    """Lowercase word tokens without stopwords, with a plural 's' stripped"""
+    tokens = []
+    for token in re.findall(r"\w+", text.lower()):
+        if token in _STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def rrf_fuse(rankings, k=RRF_K):
+    """Reciprocal-rank fusion of ranked key lists; returns [(key, score)] best first"""
+    scores = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def index_path(descriptorset_name, directory=None):
+    """The index file of a descriptor set"""
+    directory = directory or os.getenv("LEXICAL_INDEX_DIR", DEFAULT_INDEX_DIR)
+    return os.path.join(directory, f"{descriptorset_name}.json")
+
+
+class LexicalIndex:
+    """One descriptor set's heading documents ({pdf_name, page, text}) with an in-memory BM25 inverted index"""
+
+    def __init__(self, descriptorset_name, kind=None, path=None):
+        self.descriptorset_name = descriptorset_name
+        # The search kind the set is queried with; taken from the file once one exists
+        self.kind = kind
+        self.path = path or index_path(descriptorset_name)
+        self.docs = []
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.min_margin = float(os.getenv("LEXICAL_MIN_MARGIN", "1.5"))
+        self.min_coverage = float(os.getenv("LEXICAL_MIN_COVERAGE", "0.5"))
+        # Empty until ingestion writes the index file
+        self._build()
+        self.refresh()
+
+    def refresh(self):
+        """Reload the index if ingestion rewrote the file"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path) as f:
+            data = json.load(f)
+        with self._lock:
+            current = data.get("version") == INDEX_VERSION
+            self.docs = data.get("docs", []) if current else []
+            self.kind = (data.get("kind") if current else None) or self.kind
+            self._mtime = mtime
+            self._build()
+
+    def _build(self):
+        self._terms = [Counter(tokenize(doc["text"])) for doc in self.docs]
+        self._lengths = [sum(terms.values()) for terms in self._terms]
+        self._avg_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0.0
+        self._postings = {}
+        for i, terms in enumerate(self._terms):
+            for term, tf in terms.items():
+                self._postings.setdefault(term, []).append((i, tf))
+        n = len(self.docs)
+        self._idf = {term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                     for term, postings in self._postings.items()}
+
+    def replace(self, pdf_name, docs, pages=None):
+        """Drop a PDF's headings (only those on `pages` if given) and add `docs` in their place"""
+        with self._lock:
+            self.docs = [doc for doc in self.docs
+                         if doc["pdf_name"] != pdf_name or (pages is not None and doc.get("page") not in pages)]
+            self.docs.extend(docs)
+            self._build()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w") as f:
+                json.dump({"version": INDEX_VERSION, "set": self.descriptorset_name, "kind": self.kind,
+                           "docs": self.docs}, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+
+    def search(self, query, k=20):
+        """Top-k (doc_index, bm25 score) for a query"""
+        scores = {}
+        with self._lock:
+            for term in set(tokenize(query)):
+                idf = self._idf.get(term)
+                if idf is None:
+                    continue
+                for i, tf in self._postings[term]:
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[i] / self._avg_length)
+                    scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+    def fast_path(self, query, hits=None, kind=None):
+        """A search result dict (pdf_name, text, similarity) if the lexical match is clear-cut, else None.
+
+        With kind given, an index built for another search kind (or of unknown kind) never answers.
+        """
+        if os.getenv("LEXICAL_FAST_PATH", "1") == "0":
+            return None
+        if kind is not None and self.kind != kind:
+            return None
+        hits = self.search(query) if hits is None else hits
+        if not hits:
+            return None
+        best, score = hits[0]
+        doc = self.docs[best]
+        query_terms = set(tokenize(query))
+        known_terms = {term for term in query_terms if term in self._idf}
+        doc_terms = set(self._terms[best])
+        # Every query term the corpus knows must be in the heading, and the heading must be mostly query terms
+        if not known_terms <= doc_terms or len(doc_terms & query_terms) < self.min_coverage * len(doc_terms):
+            return None
+        runner_up = next((s for i, s in hits if self.docs[i]["pdf_name"] != doc["pdf_name"]), 0.0)
+        # An exact heading match needs a smaller lead over the other PDFs than a partial one
+        margin = EXACT_MATCH_MARGIN if doc_terms <= query_terms else self.min_margin
+        if runner_up and score < margin * runner_up:
+            return None
+        return {"pdf_name": doc["pdf_name"], "text": doc["text"], "similarity": score, "source": "lexical"}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(descriptorset_name, kind=None):
+    """Process-wide index of a descriptor set; kind only applies while the set has no index file"""
+    path = index_path(descriptorset_name)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = LexicalIndex(descriptorset_name, kind, path)
+        index = _indexes[path]
+    index.refresh()
+    return index
+
+
+def main():
+    from retrieval_service import DEFAULT_SETS
+
+    parser = argparse.ArgumentParser(description="BM25 index over PDF headings")
+    parser.add_argument("--dir", default=os.getenv("LEXICAL_INDEX_DIR", DEFAULT_INDEX_DIR))
+    parser.add_argument("--set", default=DEFAULT_SET, help="Descriptor set the index belongs to")
+    parser.add_argument("--kind", choices=sorted(DEFAULT_SETS),
+                        help="Search kind of the set (default: inferred from the standard set names)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Index the headings of PDFs, replacing their old entries")
+    build.add_argument("pdfs", nargs="+")
+    search = subparsers.add_parser("search", help="Show BM25 matches and whether the fast path applies")
+    search.add_argument("query")
+    args = parser.parse_args()
+
+    kind = args.kind or {name: kind for kind, name in DEFAULT_SETS.items()}.get(args.set)
+    index = LexicalIndex(args.set, kind, index_path(args.set, args.dir))
+    if args.command == "build":
+        if index.kind is None:
+            parser.error(f"--kind is required for the new set {args.set}")
+        index.kind = args.kind or index.kind
+        from pdf_extract import iter_pdf_pages
+        for pdf_path in args.pdfs:
+            pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
+            docs = [{"pdf_name": pdf_name, "page": record["page"], "text": heading}
+                    for record in iter_pdf_pages(pdf_path) for heading in record["headings"]]
+            index.replace(pdf_name, docs)
+            print(f"Indexed {len(docs)} headings from {pdf_name}")
+        index.save()
+        return
+    hits = index.search(args.query, k=10)
+    for i, score in hits:
+        print(f"{score:7.3f}  {index.docs[i]['pdf_name']}: {index.docs[i]['text']}")
+    print(json.dumps({"fast_path": index.fast_path(args.query, hits, kind=index.kind)}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Single-pass, lazy PDF page extraction shared by ingestion, scanning and indexing.
+
+Each PDF is opened once with PyMuPDF. `iter_pdf_pages` yields one record per
+page with its text, cleaned headings and embedded images; image bytes are only
+decoded into a PIL Image when `PageImage.decode()` is called, and an image xref
+already yielded on an earlier page is not yielded again. Every xref placed on the
+page, repeats included, is listed in "xrefs".
+"""
+import hashlib
+import io
+import re
+
+import fitz  # PyMuPDF
+
+
+def clean_heading(text):
+    """Clean up a heading by removing unwanted text and whitespace"""
+    # Remove the "Made with Scribe" text
+    text = re.sub(r'Made with Scribe.*?com\n*', '', text)
+    # Remove numbered prefixes
+    text = re.sub(r'^\d+\.?\s*', '', text)
+    # Remove extra whitespace, newlines, and tabs
+    text = ' '.join(text.split())
+    return text
+
+
+def split_headings(text):
+    """Split one page of extracted text into cleaned heading sections"""
+    # Split text into sections
+    sections = re.split(r'\n(?=[A-Z][^a-z]*\n|[0-9]+\.)', text)
+    # Clean each section and filter out empty ones
+    cleaned_sections = [clean_heading(section) for section in sections]
+    return [section for section in cleaned_sections
+            if section.strip() and
+            section != "https://scribehow.com" and
+            len(section) > 5]  # Filter out very short sections
+
+
+class PageImage:
+    """An embedded image kept as its raw encoded bytes until decode() is called"""
+
+    __slots__ = ("xref", "data", "ext", "_hash")
+
+    def __init__(self, xref, data, ext):
+        self.xref = xref
+        self.data = data
+        self.ext = ext
+        self._hash = None
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            self._hash = hashlib.sha256(self.data).hexdigest()
+        return self._hash
+
+    def decode(self):
+        from PIL import Image
+        return Image.open(io.BytesIO(self.data))
+
+
+def iter_pdf_pages(pdf_path):
+    """Yield {"page", "text", "headings", "images", "xrefs"} for each page of a PDF"""
+    seen_xrefs = set()
+    doc = fitz.open(pdf_path)
+    try:
+        for page_num, page in enumerate(doc):
+            text = page.get_text()
+            images = []
+            xrefs = [img[0] for img in page.get_images()]
+            for xref in xrefs:
+                if xref in seen_xrefs:
+                    continue
+                seen_xrefs.add(xref)
+                base_image = doc.extract_image(xref)
+                images.append(PageImage(xref, base_image["image"], base_image["ext"]))
+            yield {"page": page_num, "text": text, "headings": split_headings(text), "images": images,
+                   "xrefs": xrefs}
+    finally:
+        doc.close()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""Semantic cache of browser plans, used to skip Gemini for near-duplicate tasks.
+
+Plans are stored as templates: entities found in the task (names, emails, phone
+numbers, quoted strings, URLs) are replaced by numbered slots where the steps type
+them (after "type", "enter", "fill", ...). A value that is also an ordinary word of
+the task ("user" in "create user named Test User") or that the steps mention
+elsewhere is pinned instead, so the plan is only reused for that same value. A new
+task is normalized the same way and embedded with MiniLM; if a stored plan is
+similar enough, names the same actions (create, delete, invite, ...) and the new
+task provides every slot the template needs, the template is filled with the new
+entities instead of calling Gemini.
+
+Only plans from runs with positive feedback or a PASS evaluation are stored, and
+a cached plan that later fails evaluation is evicted.
+
+    python plan_cache.py seed      # add successful plans from the run log
+    python plan_cache.py stats     # hit rate and generation latency saved
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+DEFAULT_CACHE_PATH = "plan_cache.db"
+DEFAULT_THRESHOLD = float(os.getenv("PLAN_CACHE_THRESHOLD", "0.9"))
+
+_EMAIL = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+_URL = re.compile(r'https?://\S+')
+_PHONE = re.compile(r'\+?\d[\d\s().-]{3,}\d')
+_QUOTED = re.compile(r'"([^"]+)"|\'([^\']+)\'')
+_NAME = re.compile(r'\b(?:named|called)\s+([A-Za-z][\w\'-]*(?:\s+(?!(?:phone|email|with|and|at)\b)[A-Za-z][\w\'-]*)?)',
+                   re.IGNORECASE)
+_SLOT = re.compile(r'\{\{(\w+)(?:=([^}]*))?\}\}')
+# A value counts as typed input when one of these verbs comes before it in the same clause
+_INPUT_VERB = re.compile(r'\b(?:type|typing|enter|fill|input|paste|write)\w*\b', re.IGNORECASE)
+_PRIMARY_SLOT = re.compile(r'^(?:email|url|phone|quoted|name)_\d+$')
+TEMPLATE_VERSION = "2"
+# Embeddings of "create user named X" and "delete user named X" are close, so the action
+# words outside the slots must match exactly; a miss only costs a Gemini call
+ACTION_WORDS = frozenset("""
+    create add make delete remove update edit change rename modify set invite revoke enable disable
+    reset assign unassign grant view list find show search export import copy duplicate archive restore
+    suspend activate deactivate cancel approve reject send resend verify rotate
+""".split())
+
+
+def extract_entities(task):
+    """Ordered {slot: value} of the entities in a task, plus the task with slots in their place"""
+    entities = {}
+    normalized = task
+
+    def take(kind, pattern, value_of=lambda match: match.group(0)):
+        nonlocal normalized
+        for i, match in enumerate(pattern.finditer(normalized)):
+            entities[f"{kind}_{i}"] = value_of(match).strip()
+        normalized = pattern.sub(f"<{kind}>", normalized)
+
+    take("email", _EMAIL)
+    take("url", _URL)
+    take("phone", _PHONE)
+    take("quoted", _QUOTED, lambda match: match.group(1) or match.group(2))
+    for i, match in enumerate(_NAME.finditer(normalized)):
+        parts = match.group(1).split()
+        entities[f"name_{i}"] = match.group(1)
+        entities[f"name_{i}_first"] = parts[0]
+        if len(parts) > 1:
+            entities[f"name_{i}_last"] = parts[-1]
+    normalized = _NAME.sub(lambda m: m.group(0).split()[0] + " <name>", normalized)
+    return entities, " ".join(normalized.lower().split())
+
+
+def action_words(normalized):
+    """Action words in a normalized task, e.g. {"create"} for "create a user named <name>" """
+    return ACTION_WORDS.intersection(re.findall(r"[a-z]+", normalized))
+
+
+def _value_pattern(value):
+    return re.compile(rf'(?<![\w@{{]){re.escape(value)}(?![\w@}}])', re.IGNORECASE)
+
+
+def _is_input(text, position):
+    """Whether the text at position is typed: an input verb precedes it in its clause"""
+    line = text[text.rfind("\n", 0, position) + 1:position]
+    clause = re.split(r'[;!?]|\.\s', re.sub(r'^\s*\d+[.)]\s*', '', line))[-1]
+    return _INPUT_VERB.search(clause) is not None
+
+
+def _in_marker(text, position):
+    return text.rfind("{{", 0, position) > text.rfind("}}", 0, position)
+
+
+def make_template(steps, entities, task=""):
+    """Turn entity values in the steps into {{slot}} markers, longest values first.
+
+    Only values the steps type are templated. Where a value is also an ordinary word of
+    the task, its typed occurrences become pinned {{slot=value}} markers and the others
+    stay text; a value the steps also mention outside typed input is pinned everywhere.
+    """
+    # The task with its whole entities (not name parts) masked, to spot values used as ordinary words
+    masked_task = task
+    for slot, value in entities.items():
+        if _PRIMARY_SLOT.match(slot):
+            masked_task = _value_pattern(value).sub(" ", masked_task)
+    template = steps
+    for slot, value in sorted(entities.items(), key=lambda item: -len(item[1])):
+        if len(value) < 2:
+            continue
+        pattern = _value_pattern(value)
+        # An ordinary word of the task: only typed occurrences can be the entity, and even those are
+        # ambiguous. Mentioned outside typed input: the plan only holds for this same value.
+        ordinary_word = pattern.search(masked_task) is not None
+        positions = [m.start() for m in pattern.finditer(template) if not _in_marker(template, m.start())]
+        pinned = ordinary_word or not all(_is_input(template, position) for position in positions)
+
+        def marker(match, text=template):
+            if _in_marker(text, match.start()) or (ordinary_word and not _is_input(text, match.start())):
+                return match.group(0)
+            return f"{{{{{slot}={match.group(0)}}}}}" if pinned else f"{{{{{slot}}}}}"
+
+        template = pattern.sub(marker, template)
+    return template
+
+
+def fill_template(template, entities):
+    """Fill {{slot}} markers; None if the new task lacks an entity the template needs
+    or differs from a pinned {{slot=value}}"""
+    for slot, pinned in _SLOT.findall(template):
+        if slot not in entities or (pinned and entities[slot].lower() != pinned.lower()):
+            return None
+    return _SLOT.sub(lambda m: m.group(2) or entities[m.group(1)], template)
+
+
+def _default_embed(texts):
+    import query_pdf
+    import retrieval_service
+    model = retrieval_service.get_service().text_model()
+    return np.stack([query_pdf.encode_query(model, text) for text in texts])
+
+
+class PlanCache:
+    """SQLite-backed plan templates with an in-memory embedding matrix for lookup"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, embed=None, threshold=DEFAULT_THRESHOLD):
+        self.embed = embed or _default_embed
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS plans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task TEXT, normalized_task TEXT UNIQUE, template TEXT, embedding BLOB,
+                source_run_id INTEGER, created_at REAL, uses INTEGER DEFAULT 0);
+            CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value REAL);
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+        """)
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'template_version'").fetchone()
+        if row is None or row[0] != TEMPLATE_VERSION:
+            # Templates from older rules may replay wrong values; `seed` rebuilds them from the run log
+            self._db.execute("DELETE FROM plans")
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('template_version', ?)", (TEMPLATE_VERSION,))
+        self._db.commit()
+        self._matrix = None
+
+    def _bump(self, **deltas):
+        self._db.executemany("INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+                             [(name, delta, delta) for name, delta in deltas.items()])
+        self._db.commit()
+
+    def _load_matrix(self):
+        if self._matrix is None:
+            rows = self._db.execute("SELECT id, template, embedding, normalized_task FROM plans").fetchall()
+            ids = [row[0] for row in rows]
+            templates = [row[1] for row in rows]
+            vectors = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows]) if rows else None
+            actions = [action_words(row[3]) for row in rows]
+            self._matrix = (ids, templates, vectors, actions)
+        return self._matrix
+
+    def lookup(self, task):
+        """Return (plan_id, steps, similarity) for a usable cached plan, or None"""
+        with self._lock:
+            start = time.perf_counter()
+            entities, normalized = extract_entities(task)
+            ids, templates, vectors, actions = self._load_matrix()
+            task_actions = action_words(normalized)
+            result = None
+            if vectors is not None:
+                similarities = vectors @ np.asarray(self.embed([normalized])[0], dtype=np.float32)
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    if actions[i] != task_actions:
+                        continue
+                    steps = fill_template(templates[i], entities)
+                    if steps is not None:
+                        result = (ids[i], steps, float(similarities[i]))
+                        break
+            if result:
+                self._db.execute("UPDATE plans SET uses = uses + 1 WHERE id = ?", (result[0],))
+                self._bump(hits=1, lookup_seconds=time.perf_counter() - start)
+            else:
+                self._bump(misses=1, lookup_seconds=time.perf_counter() - start)
+            return result
+
+    def record_generation(self, seconds):
+        """Record how long a Gemini plan generation took, to estimate latency saved by hits"""
+        with self._lock:
+            self._bump(generations=1, generation_seconds=seconds)
+
+    def add(self, task, steps, run=None):
+        """Store a plan if its run was successful (positive feedback or PASS)"""
+        run = run or {}
+        if run.get("feedback") != "positive" and run.get("evaluation") != "PASS":
+            return None
+        if run.get("evaluation") == "FAIL":
+            return None
+        entities, normalized = extract_entities(task)
+        template = make_template(steps, entities, task)
+        embedding = np.asarray(self.embed([normalized])[0], dtype=np.float32)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO plans (task, normalized_task, template, embedding, source_run_id, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(normalized_task) DO UPDATE SET "
+                "task = excluded.task, template = excluded.template, source_run_id = excluded.source_run_id",
+                (task, normalized, template, embedding.tobytes(), run.get("id"), time.time()))
+            self._db.commit()
+            self._matrix = None
+            return self._db.execute("SELECT id FROM plans WHERE normalized_task = ?", (normalized,)).fetchone()[0]
+
+    def evict(self, plan_id):
+        """Drop a plan that produced a failing run"""
+        with self._lock:
+            self._db.execute("DELETE FROM plans WHERE id = ?", (plan_id,))
+            self._bump(evictions=1)
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            values = dict(self._db.execute("SELECT name, value FROM stats").fetchall())
+            (plans,) = self._db.execute("SELECT COUNT(*) FROM plans").fetchone()
+        hits, misses = values.get("hits", 0), values.get("misses", 0)
+        generations = values.get("generations", 0)
+        mean_generation = values.get("generation_seconds", 0) / generations if generations else None
+        lookups = hits + misses
+        mean_lookup = values.get("lookup_seconds", 0) / lookups if lookups else 0.0
+        return {
+            "plans": plans,
+            "hits": int(hits),
+            "misses": int(misses),
+            "evictions": int(values.get("evictions", 0)),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "mean_generation_seconds": mean_generation,
+            "mean_lookup_seconds": mean_lookup,
+            "latency_saved_seconds": hits * (mean_generation - mean_lookup) if mean_generation else None,
+        }
+
+
+_plan_cache = None
+
+
+def get_plan_cache():
+    global _plan_cache
+    if _plan_cache is None:
+        _plan_cache = PlanCache(os.getenv("PLAN_CACHE_PATH", DEFAULT_CACHE_PATH))
+    return _plan_cache
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Semantic plan cache")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("seed", help="Add plans from successful runs in the run log")
+    subparsers.add_parser("stats", help="Print hit rate and latency saved")
+    lookup = subparsers.add_parser("lookup", help="Show the cached plan for a task")
+    lookup.add_argument("task")
+    args = parser.parse_args()
+
+    cache = get_plan_cache()
+    if args.command == "seed":
+        from run_log import get_run_log
+        added = 0
+        for run in get_run_log().query():
+            if cache.add(run["task"], run.get("steps", ""), run):
+                added += 1
+        print(f"Added {added} plans")
+    elif args.command == "lookup":
+        print(json.dumps(cache.lookup(args.task)))
+    else:
+        print(json.dumps(cache.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,194 +1,200 @@
-import torch
-import torch.nn.functional as F
-from PIL import Image
-from open_clip import create_model_from_pretrained, get_tokenizer
-import fitz  # PyMuPDF
-import io
 import numpy as np
 
-import PyPDF2
-from aperturedb import Connector as Connector
-import re
+from vector_index import connect_to_db
+from embedding_cache import cached_encode, cache_stats
+from pdf_extract import PageImage, iter_pdf_pages
+from siglip_encoder import (SIGLIP_MODEL_ID, EMBEDDING_DIMENSIONS, cache_version, initialize_siglip_model,
+                            encode_image_batches, encode_text_batches)
 import os
+import argparse
 
-def connect_to_db():
-    db = Connector.Connector(host="metis-t3oknmxh.farm0000.cloud.aperturedata.io",
-                            user="admin",
-                            password="metisadmin123!")
-    return db
-
-def clean_heading(text):
-    """Clean up a heading by removing unwanted text and whitespace"""
-    # Remove the "Made with Scribe" text
-    text = re.sub(r'Made with Scribe.*?com\n*', '', text)
-    # Remove numbered prefixes
-    text = re.sub(r'^\d+\.?\s*', '', text)
-    # Remove extra whitespace, newlines, and tabs
-    text = ' '.join(text.split())
-    return text
+IMAGE_BATCH_SIZE = int(os.getenv("IMAGE_BATCH_SIZE", "16"))
+TEXT_BATCH_SIZE = int(os.getenv("TEXT_BATCH_SIZE", "64"))
+UPLOAD_BATCH_SIZE = int(os.getenv("UPLOAD_BATCH_SIZE", "100"))
 
 def extract_headings_from_pdf(pdf_path):
     """Extract text sections from PDF"""
     headings = []
-    with open(pdf_path, 'rb') as file:
-        reader = PyPDF2.PdfReader(file)
-        for page in reader.pages:
-            text = page.extract_text()
-            # Split text into sections
-            sections = re.split(r'\n(?=[A-Z][^a-z]*\n|[0-9]+\.)', text)
-            # Clean each section and filter out empty ones
-            cleaned_sections = [clean_heading(section) for section in sections]
-            headings.extend([section for section in cleaned_sections 
-                           if section.strip() and 
-                           section != "https://scribehow.com" and
-                           len(section) > 5])  # Filter out very short sections
+    for record in iter_pdf_pages(pdf_path):
+        headings.extend(record["headings"])
     return headings
 
+def ensure_descriptor_set(db, descriptorset_name):
+    """Create the descriptor set only if it does not exist yet"""
+    responses, _ = db.query([{"FindDescriptorSet": {"with_name": descriptorset_name}}])
+    if not responses[0]["FindDescriptorSet"].get("returned", 0):
+        add_descriptor_set(db, descriptorset_name)
+
+def delete_descriptors(db, descriptorset_name, pdf_name, pages=None):
+    """Delete a PDF's descriptors, or only those from the given pages"""
+    constraints = {"pdf_name": ["==", pdf_name]}
+    if pages is not None:
+        constraints["page"] = ["in", sorted(pages)]
+    q = [{
+        "DeleteDescriptor": {
+            "set": descriptorset_name,
+            "constraints": constraints,
+        }
+    }]
+    db.query(q)
+
 def add_descriptor_set(db, descriptorset_name):
     q = [{
         "AddDescriptorSet": {
             "name": descriptorset_name,
-            "dimensions": 1024,
+            "dimensions": EMBEDDING_DIMENSIONS,
             "engine": "Flat",
             "metric": "IP",
         }
     }]
     db.query(q)
 
-def initialize_siglip_model():
-    model, preprocess = create_model_from_pretrained('hf-hub:timm/ViT-L-16-SigLIP-384')
-    tokenizer = get_tokenizer('hf-hub:timm/ViT-L-16-SigLIP-384')
-    return model, preprocess, tokenizer
+def encode_images(images, model, preprocess, batch_size=IMAGE_BATCH_SIZE):
+    """Encode PIL images or still-encoded PageImages with SigLIP, batch_size images per forward pass.
+
+    Cached by content hash (the encoded bytes for a PageImage), so only cache misses are decoded.
+    """
+    if not images:
+        return np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+
+    def encode(missing):
+        missing = [image.decode() if isinstance(image, PageImage) else image for image in missing]
+        return encode_image_batches(missing, model, preprocess, batch_size)
+
+    return cached_encode(SIGLIP_MODEL_ID, "image", cache_version(model, "image"), images, encode)
+
+def encode_texts(texts, model, tokenizer, batch_size=TEXT_BATCH_SIZE):
+    """Encode texts with SigLIP, batch_size texts per forward pass; cached by text hash"""
+    if not texts:
+        return np.empty((0, EMBEDDING_DIMENSIONS), dtype=np.float32)
+    return cached_encode(SIGLIP_MODEL_ID, "text", cache_version(model, "text"), texts,
+                         lambda missing: encode_text_batches(missing, model, tokenizer, batch_size))
 
 def encode_image(image, model, preprocess):
     """Encode an image using SigLIP model"""
-    image_input = preprocess(image).unsqueeze(0)
-    
-    with torch.no_grad(), torch.cuda.amp.autocast():
-        image_features = model.encode_image(image_input)
-        image_features = F.normalize(image_features, dim=-1)
-    
-    return image_features.cpu().numpy()[0]
+    return encode_images([image], model, preprocess)[0]
 
 def encode_text(text, model, tokenizer):
     """Encode text using SigLIP model"""
-    text_input = tokenizer([text], context_length=model.context_length)
-    
-    with torch.no_grad(), torch.cuda.amp.autocast():
-        text_features = model.encode_text(text_input)
-        text_features = F.normalize(text_features, dim=-1)
-    
-    return text_features.cpu().numpy()[0]
-
-def extract_images_from_pdf(pdf_path):
-    """Extract images from PDF"""
-    images = []
-    doc = fitz.open(pdf_path)
-    
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        image_list = page.get_images()
-        
-        for img_index, img in enumerate(image_list):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            
-            # Convert to PIL Image
-            image = Image.open(io.BytesIO(image_bytes))
-            images.append(image)
-    
-    return images
+    return encode_texts([text], model, tokenizer)[0]
+
+def extract_images_from_pdf(pdf_path, skip_hashes=()):
+    """Extract images from PDF, skipping any whose content hash is in skip_hashes"""
+    return [image.decode()
+            for record in iter_pdf_pages(pdf_path)
+            for image in record["images"]
+            if image.hash not in skip_hashes]
+
+def add_descriptors(db, embeddings, properties_list, descriptorset_name, batch_size=UPLOAD_BATCH_SIZE):
+    """Insert descriptors with batch_size AddDescriptor commands per query"""
+    for start in range(0, len(properties_list), batch_size):
+        q = [{
+            "AddDescriptor": {
+                "set": descriptorset_name,
+                "properties": properties,
+            }
+        } for properties in properties_list[start:start + batch_size]]
+        blobs = [embedding.astype('float32').tobytes() for embedding in embeddings[start:start + batch_size]]
+
+        responses, _ = db.query(q, blobs)
+        for response in responses:
+            status = response["AddDescriptor"].get("status", 0)
+            if status != 0:
+                raise RuntimeError(f"AddDescriptor failed: {response}")
 
 def add_text_descriptor(db, text_embedding, text, descriptorset_name, pdf_name):
-    embedding_bytes = text_embedding.astype('float32').tobytes()
-    q = [{
-        "AddDescriptor": {
-            "set": descriptorset_name,
-            "properties": {
-                "pdf_name": pdf_name,
-                "text": text,
-            },
-        }
-    }]
-
-    responses, blobs = db.query(q, [embedding_bytes])
+    add_descriptors(db, [text_embedding], [{"pdf_name": pdf_name, "text": text}], descriptorset_name)
 
 def add_image_descriptor(db, image_embedding, image_index, descriptorset_name, pdf_name):
-    embedding_bytes = image_embedding.astype('float32').tobytes()
-    q = [{
-        "AddDescriptor": {
-            "set": descriptorset_name,
-            "properties": {
-                "pdf_name": pdf_name,
-                "image_index": image_index,
-            },
-        }
-    }]
-
-    responses, blobs = db.query(q, [embedding_bytes])
-
-def process_pdf(pdf_path, descriptorset_name, db, model, preprocess, tokenizer):    
-    
-
-    pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    
-    # Process text
-    texts = extract_headings_from_pdf(pdf_path)
-
-    # Process images
-    images = extract_images_from_pdf(pdf_path)
-
-    if pdf_name == "invite_team_member": images.remove(images[1])
-    else: images.remove(images[0])
-
-    image_features = []
-    text_features = []
-
-    output_dir = "extracted_images"
-    os.makedirs(output_dir, exist_ok=True)
-
-    for i, image in enumerate(images):
-        image.save(os.path.join(output_dir, f"{pdf_name}_image_{i}.png"))
-        image_features.append(encode_image(image, model, preprocess))
-
-    for text in texts:
-        text_features.append(encode_text(text, model, tokenizer))
-
-    for text_feature, txt in zip(text_features, texts):
-        add_text_descriptor(db, text_feature, txt, descriptorset_name, pdf_name)
-    
-    for image_feature, image_index in zip(image_features, range(len(images))):
-        add_image_descriptor(db, image_feature, image_index, descriptorset_name, pdf_name)
-    
-    print(f"Processed {len(text)} headings and {len(images)} images from PDF {pdf_name}")
+    add_descriptors(db, [image_embedding], [{"pdf_name": pdf_name, "image_index": image_index}], descriptorset_name)
 
 if __name__ == "__main__":
-    # Example usage
+    import sys
+    import ingest_pipeline
+    from ingest_manifest import DEFAULT_MANIFEST_PATH, IngestManifest
+    from doc_index import sync_document_index
+    from lexical_index import get_lexical_index
 
     # Get current directory path
     current_dir = os.path.dirname(os.path.abspath(__file__))
     
-    # PDF file names
+    # Bundled PDF file names, used when no inputs are given
     pdf_files = [
         "create_organization.pdf",
         "create_new_user.pdf",
         "invite_team_member.pdf",
         "create_new_project.pdf"
     ]
-    
+
+    parser = argparse.ArgumentParser(description="Ingest Scribe PDFs into the descriptor set")
+    parser.add_argument("inputs", nargs="*", help="PDF files, directories or glob patterns")
+    parser.add_argument("--workers", type=int, default=None, help="Parse worker processes (default: CPU count)")
+    parser.add_argument("--queue-size", type=int, default=32, help="Max pages/batches buffered between stages")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST_PATH, help="Content-hash manifest path")
+    parser.add_argument("--force", action="store_true", help="Re-ingest every PDF regardless of the manifest")
+    parser.add_argument("--image-batch-size", type=int, default=IMAGE_BATCH_SIZE)
+    parser.add_argument("--text-batch-size", type=int, default=TEXT_BATCH_SIZE)
+    parser.add_argument("--upload-batch-size", type=int, default=UPLOAD_BATCH_SIZE)
+    args = parser.parse_args()
+
     # Create full paths
-    pdf_paths = [os.path.join(current_dir, pdf_file) for pdf_file in pdf_files]
+    inputs = args.inputs or [os.path.join(current_dir, pdf_file) for pdf_file in pdf_files]
+    pdf_paths = ingest_pipeline.expand_inputs(inputs)
+
+    # Work out which PDFs and pages changed since the last sync
+    manifest = IngestManifest(args.manifest)
+    jobs, scans, boilerplate, removed = manifest.plan(pdf_paths, workers=args.workers, force=args.force)
+    print(f"{len(pdf_paths)} PDFs, {len(jobs)} with changes, {len(removed)} removed, "
+          f"{len(boilerplate)} boilerplate images")
+    if not jobs and not removed:
+        manifest.record(scans, boilerplate)
+        manifest.save()
+        sys.exit(0)
 
     # Connect to DB
     db = connect_to_db()
 
-    # Initialize models
-    model, preprocess, tokenizer = initialize_siglip_model()
-
     # Ensure descriptor set exists
     descriptorset_name = "pdf_instructions_image_text"
-    add_descriptor_set(db, descriptorset_name)
+    ensure_descriptor_set(db, descriptorset_name)
+
+    # PDFs deleted from disk lose their descriptors, headings and centroids
+    if removed:
+        lexical_index = get_lexical_index(descriptorset_name, kind="image_text")
+        for pdf_name in removed:
+            delete_descriptors(db, descriptorset_name, pdf_name)
+            lexical_index.replace(pdf_name, [])
+        lexical_index.save()
+        sync_document_index(db, descriptorset_name, removed)
+        manifest.forget(removed)
+        print(f"Removed {len(removed)} deleted PDFs: {', '.join(removed)}")
+    if not jobs:
+        manifest.record(scans, boilerplate)
+        manifest.save()
+        sys.exit(0)
+
+    # Remove descriptors of stale pages before their replacements are added
+    for job in jobs:
+        if job["delete_all"]:
+            delete_descriptors(db, descriptorset_name, job["pdf_name"])
+        elif job["delete_pages"]:
+            delete_descriptors(db, descriptorset_name, job["pdf_name"], job["delete_pages"])
+
+    # Initialize models
+    model, preprocess, tokenizer = initialize_siglip_model()
 
-    for pdf_path in pdf_paths:
-        process_pdf(pdf_path, descriptorset_name, db, model, preprocess, tokenizer)
\ No newline at end of file
+    stats = ingest_pipeline.run_pipeline(jobs, descriptorset_name, db, model, preprocess, tokenizer,
+                                         skip_image_hashes=boilerplate,
+                                         workers=args.workers, queue_size=args.queue_size,
+                                         image_batch_size=args.image_batch_size,
+                                         text_batch_size=args.text_batch_size,
+                                         upload_batch_size=args.upload_batch_size,
+                                         lexical_index=get_lexical_index(descriptorset_name, kind="image_text"))
+    # Refresh the per-PDF centroids used to shortlist documents at query time
+    sync_document_index(db, descriptorset_name, [job["pdf_name"] for job in jobs])
+    # PDFs that failed to parse stay out of date in the manifest, so the next sync retries them
+    manifest.record(scans, boilerplate, failed=set(stats["failed"]))
+    manifest.save()
+    if stats["failed"]:
+        print(f"{len(stats['failed'])} PDFs failed and will be retried on the next sync")
+        sys.exit(1)
@@ -0,0 +1,119 @@
+"""Compressed descriptor encodings for the local vector index.
+
+A descriptor set created with a `storage` other than float32 keeps a compact
+code per vector next to the float32 vectors.npy. Searches scan only the codes,
+scoring them against the uncompressed query (asymmetric distance), and then
+re-rank the best candidates with the exact float32 vectors. Those are read from
+the memory map, so only the re-ranked rows are paged in.
+
+    float16   2 bytes/dim, half precision copy
+    int8      1 byte/dim + 4 bytes/vector, symmetric per-vector scale
+    pq        PQ_BITS=8 bits per subspace of PQ_SUBVECTOR_DIM dims (64 bytes for 1024-d SigLIP)
+"""
+import os
+
+import numpy as np
+
+PQ_SUBVECTOR_DIM = int(os.getenv("PQ_SUBVECTOR_DIM", "16"))
+PQ_CENTROIDS = 256
+PQ_MAX_TRAINING = 20000
+
+
+def _scores(reconstructed, query, metric):
+    if metric == "L2":
+        return -np.sum((reconstructed - query) ** 2, axis=1)
+    return reconstructed @ query
+
+
+class Float16Codec:
+    name = "float16"
+
+    def __init__(self, dimensions):
+        self.arrays = {"codes": (np.float16, (dimensions,))}
+
+    def encode(self, vectors):
+        return {"codes": vectors.astype(np.float16)}
+
+    def scores(self, query, data, metric):
+        return _scores(data["codes"].astype(np.float32), query, metric)
+
+
+class Int8Codec:
+    name = "int8"
+
+    def __init__(self, dimensions):
+        self.arrays = {"codes": (np.int8, (dimensions,)), "scales": (np.float32, ())}
+
+    def encode(self, vectors):
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return {"codes": codes, "scales": scales.astype(np.float32)}
+
+    def scores(self, query, data, metric):
+        if metric == "L2":
+            return _scores(data["codes"].astype(np.float32) * data["scales"][:, None], query, metric)
+        # Inner product is linear, so scale after the int8 dot product
+        return (data["codes"].astype(np.float32) @ query) * data["scales"]
+
+
+def _kmeans_l2(x, n_clusters, iterations=10, seed=0):
+    """Euclidean Lloyd's k-means for PQ sub-codebooks"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (x ** 2).sum(1)[:, None] - 2 * x @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        assignments = np.argmin(distances, axis=1)
+        for c in range(n_clusters):
+            members = x[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+    return centroids
+
+
+class PQCodec:
+    """Product quantization; untrained until the set holds enough vectors to fit the codebooks"""
+
+    name = "pq"
+
+    def __init__(self, dimensions, codebooks=None):
+        self.subvector_dim = PQ_SUBVECTOR_DIM if dimensions % PQ_SUBVECTOR_DIM == 0 else 1
+        self.subspaces = dimensions // self.subvector_dim
+        self.arrays = {"codes": (np.uint8, (self.subspaces,))}
+        self.codebooks = codebooks
+
+    @property
+    def trained(self):
+        return self.codebooks is not None
+
+    def train(self, vectors, seed=0):
+        """Fit one codebook of up to PQ_CENTROIDS centroids per subspace"""
+        rng = np.random.default_rng(seed)
+        if len(vectors) > PQ_MAX_TRAINING:
+            vectors = vectors[rng.choice(len(vectors), PQ_MAX_TRAINING, replace=False)]
+        n_clusters = min(PQ_CENTROIDS, len(vectors))
+        sub = vectors.reshape(len(vectors), self.subspaces, self.subvector_dim)
+        self.codebooks = np.stack([_kmeans_l2(sub[:, m], n_clusters, seed=seed)
+                                   for m in range(self.subspaces)]).astype(np.float32)
+
+    def encode(self, vectors):
+        sub = vectors.reshape(len(vectors), self.subspaces, self.subvector_dim)
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for m in range(self.subspaces):
+            centroids = self.codebooks[m]
+            distances = -2 * sub[:, m] @ centroids.T + (centroids ** 2).sum(1)[None, :]
+            codes[:, m] = np.argmin(distances, axis=1)
+        return {"codes": codes}
+
+    def scores(self, query, data, metric):
+        # Asymmetric distance: one lookup table per subspace against the exact query
+        sub = query.reshape(self.subspaces, self.subvector_dim)
+        if metric == "L2":
+            table = -np.sum((self.codebooks - sub[:, None, :]) ** 2, axis=2)
+        else:
+            table = np.einsum("mkd,md->mk", self.codebooks, sub)
+        return table[np.arange(self.subspaces), data["codes"]].sum(axis=1)
+
+
+CODECS = {"float16": Float16Codec, "int8": Int8Codec, "pq": PQCodec}
+STORAGE_MODES = ("float32",) + tuple(CODECS)
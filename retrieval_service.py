@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""Long-lived retrieval service that keeps embedding models and the DB handle warm.
+
+Used in-process by default. Run `python retrieval_service.py --serve` to start a
+local UNIX-socket daemon; `search_pdf` talks to it whenever RETRIEVAL_SOCKET
+points at a live socket.
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import doc_index
+from lexical_index import get_lexical_index, rrf_fuse
+from spans import activate, current, span
+
+DEFAULT_SOCKET_PATH = "/tmp/metis_retrieval.sock"
+DEFAULT_SETS = {"text": "pdf_instructions_correct2", "image_text": "pdf_instructions_image_text"}
+
+
+def _connect_to_db():
+    from vector_index import connect_to_db
+    return connect_to_db()
+
+
+class RetrievalService:
+    """Holds the loaded models and DB connection between searches"""
+
+    def __init__(self, resources=None):
+        self._lock = threading.Lock()
+        # One lock per resource, so loading one model never waits for another
+        self._load_locks = {}
+        # Already loaded resources by name ("db", "text_model", "siglip"), e.g. a benchmark's local index
+        self._resources = dict(resources or {})
+        self.cold_start = {}
+        self.query_latencies = {"text": [], "image_text": [], "lexical": []}
+        # descriptorset_name -> (has a document index, time checked)
+        self._doc_indexes = {}
+
+    def _get(self, name, loader):
+        """Load a resource once and remember how long the cold start took"""
+        if name in self._resources:
+            return self._resources[name]
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            if name not in self._resources:
+                start = time.perf_counter()
+                with span("db_connect" if name.startswith("db") else "model_load", resource=name):
+                    resource = loader()
+                self.cold_start[name] = time.perf_counter() - start
+                self._resources[name] = resource
+            return self._resources[name]
+
+    def db(self):
+        return self._get("db", _connect_to_db)
+
+    def text_model(self):
+        def load():
+            from sentence_transformers import SentenceTransformer
+            from query_pdf import TEXT_MODEL_NAME
+            return SentenceTransformer(TEXT_MODEL_NAME)
+        return self._get("text_model", load)
+
+    def siglip(self):
+        from siglip_encoder import initialize_siglip_model
+        return self._get("siglip", initialize_siglip_model)
+
+    def has_document_index(self, db, descriptorset_name):
+        """Whether two-stage search can be used for a set; never builds the index (ingestion does).
+
+        A set found indexed stays so for the process; a missing index is looked up again
+        after DOC_INDEX_RECHECK_SECONDS, so one built meanwhile is picked up.
+        """
+        exists, checked = self._doc_indexes.get(descriptorset_name, (False, None))
+        if exists or (checked is not None and
+                      time.monotonic() - checked < float(os.getenv("DOC_INDEX_RECHECK_SECONDS", "60"))):
+            return exists
+        try:
+            exists = doc_index.has_document_index(db, descriptorset_name)
+        except Exception as e:
+            print(f"Warning: could not look up the document index of {descriptorset_name}: {e}")
+            exists = False
+        if not exists:
+            print(f"Warning: {descriptorset_name} has no document index, searching it in a single stage "
+                  f"(run `python doc_index.py refresh {descriptorset_name}`)")
+        self._doc_indexes[descriptorset_name] = (exists, time.monotonic())
+        return exists
+
+    def preload(self, kinds=("text", "image_text")):
+        self.db()
+        if "text" in kinds:
+            self.text_model()
+        if "image_text" in kinds:
+            self.siglip()
+
+    def rank_documents(self, kind, query_text, descriptorset_name, n_docs=3):
+        """PDFs ranked for a query, best first; kind is 'text' or 'image_text'.
+
+        Clear-cut heading matches are answered by the BM25 index alone. Otherwise a
+        two-stage dense search (document centroids, then the shortlisted PDFs'
+        descriptors) is fused with the BM25 ranking by reciprocal-rank fusion.
+        """
+        return self.rank_documents_many(kind, [query_text], descriptorset_name, n_docs)[0]
+
+    def rank_documents_many(self, kind, query_texts, descriptorset_name, n_docs=3, db=None):
+        """rank_documents for several queries with one batched encode and shared DB round trips"""
+        start = time.perf_counter()
+        if kind == "text":
+            import query_pdf as module
+        elif kind == "image_text":
+            import query_image_text_pdf as module
+        else:
+            raise ValueError(f"Unknown search kind: {kind}")
+
+        rankings = [None] * len(query_texts)
+        lexical_hits = []
+        with span("lexical_search", kind=kind, queries=len(query_texts)) as attrs:
+            lexical = get_lexical_index(descriptorset_name)
+            for i, query_text in enumerate(query_texts):
+                hits = lexical.search(query_text)
+                lexical_hits.append(hits)
+                result = lexical.fast_path(query_text, hits, kind=kind)
+                if result is not None:
+                    rankings[i] = [{"pdf_name": result["pdf_name"], "score": result["similarity"],
+                                    "source": "lexical", "text": result["text"]}]
+            attrs["fast_path"] = sum(ranking is not None for ranking in rankings)
+        dense_indexes = [i for i, ranking in enumerate(rankings) if ranking is None]
+        if len(dense_indexes) < len(query_texts):
+            self.query_latencies["lexical"].append(time.perf_counter() - start)
+        if not dense_indexes:
+            return rankings
+
+        dense_texts = [query_texts[i] for i in dense_indexes]
+        if kind == "text":
+            model = self.text_model()
+            encode = lambda: module.encode_queries(model, dense_texts)
+        else:
+            model, _, tokenizer = self.siglip()
+            encode = lambda: module.encode_text_queries(dense_texts, model, tokenizer)
+        db = db or self.db()
+        two_stage = self.has_document_index(db, descriptorset_name)
+        with span("query_encode", kind=kind, queries=len(dense_texts)):
+            query_embeddings = encode()
+        with span("find_descriptors", kind=kind, set=descriptorset_name, queries=len(dense_texts)) as attrs:
+            dense = doc_index.rank_documents_many(db, descriptorset_name, query_embeddings,
+                                                  n_docs=max(n_docs, doc_index.SHORTLIST_DOCS), two_stage=two_stage)
+            attrs["documents"] = sum(len(documents) for documents in dense)
+            attrs["two_stage"] = two_stage
+        for i, documents in zip(dense_indexes, dense):
+            fused = _fuse(documents, [(lexical.docs[j]["pdf_name"], score) for j, score in lexical_hits[i]])
+            rankings[i] = fused[:n_docs]
+        self.query_latencies[kind].append(time.perf_counter() - start)
+        return rankings
+
+    def search_many(self, query_texts, sets=None, n_docs=3):
+        """Ranked PDFs for each query from several descriptor sets, fused per query by RRF.
+
+        sets maps kind ('text', 'image_text') to descriptor set name (default: both sets).
+        Each set is searched in its own thread with its own DB connection, so the two
+        models encode and the two sets are queried concurrently. Returns one list per
+        query of {pdf_name, score, ranks: {kind: rank}} best first, whatever the number of sets.
+        """
+        sets = sets or DEFAULT_SETS
+
+        def run(kind, descriptorset_name, parent):
+            # Pool threads do not inherit the caller's span context
+            with activate(parent):
+                db = self._get(f"db:{kind}", _connect_to_db)
+                return self.rank_documents_many(kind, query_texts, descriptorset_name, n_docs, db=db)
+
+        with span("search_many", queries=len(query_texts), sets=len(sets)):
+            if len(sets) == 1:
+                ((kind, descriptorset_name),) = sets.items()
+                per_kind = {kind: self.rank_documents_many(kind, query_texts, descriptorset_name, n_docs)}
+            else:
+                with ThreadPoolExecutor(max_workers=len(sets), thread_name_prefix="search-many") as pool:
+                    futures = {kind: pool.submit(run, kind, name, current()) for kind, name in sets.items()}
+                    per_kind = {kind: future.result() for kind, future in futures.items()}
+        results = []
+        for i in range(len(query_texts)):
+            rankings = {kind: [document["pdf_name"] for document in per_kind[kind][i]] for kind in sets}
+            fused = rrf_fuse(rankings.values())
+            results.append([{"pdf_name": pdf_name, "score": score,
+                             "ranks": {kind: ranking.index(pdf_name) + 1
+                                       for kind, ranking in rankings.items() if pdf_name in ranking}}
+                            for pdf_name, score in fused[:n_docs]])
+        return results
+
+    def search(self, kind, query_text, descriptorset_name):
+        """The best PDF for a query as {pdf_name, similarity, documents}, or None"""
+        documents = self.rank_documents(kind, query_text, descriptorset_name)
+        if not documents:
+            return None
+        best = documents[0]
+        result = {"pdf_name": best["pdf_name"], "similarity": best.get("dense_score", best["score"]),
+                  "source": best.get("source", "hybrid"), "documents": documents}
+        if "text" in best:
+            result["text"] = best["text"]
+        return result
+
+    def stats(self):
+        """Cold-start load times and warm query latency summary, in seconds"""
+        warm = {}
+        for kind, latencies in self.query_latencies.items():
+            if not latencies:
+                continue
+            # The first query of each kind pays for model loading, so it is reported separately
+            later = sorted(latencies[1:]) or sorted(latencies)
+            warm[kind] = {
+                "count": len(latencies),
+                "first_query": latencies[0],
+                "warm_p50": later[len(later) // 2],
+                "warm_max": later[-1],
+            }
+        from embedding_cache import cache_stats
+        stats = {"cold_start": dict(self.cold_start), "queries": warm, "embedding_cache": cache_stats()}
+        # Round-trip and pool metrics of the pooled DB client (the local backend has none)
+        db = self._resources.get("db")
+        if callable(getattr(db, "stats", None)):
+            stats["db"] = db.stats()
+        return stats
+
+
+def _fuse(dense_documents, lexical_hits):
+    """Reciprocal-rank fusion of dense document ranks and BM25 heading hits, by PDF"""
+    lexical_scores = {}
+    for pdf_name, score in lexical_hits:
+        lexical_scores.setdefault(pdf_name, score)
+    dense_scores = {document["pdf_name"]: document["score"] for document in dense_documents}
+    fused = rrf_fuse([[document["pdf_name"] for document in dense_documents], list(lexical_scores)])
+    documents = []
+    for pdf_name, score in fused:
+        document = {"pdf_name": pdf_name, "score": score, "source": "hybrid"}
+        if pdf_name in dense_scores:
+            document["dense_score"] = dense_scores[pdf_name]
+        if pdf_name in lexical_scores:
+            document["lexical_score"] = lexical_scores[pdf_name]
+        documents.append(document)
+    return documents
+
+
+_service = None
+
+
+def get_service():
+    """Return the process-wide RetrievalService"""
+    global _service
+    if _service is None:
+        _service = RetrievalService()
+    return _service
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                service = self.server.service
+                # Spans recorded for this call join the caller's trace
+                with activate(request.get("parent")):
+                    response = self._respond(service, request)
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response, default=float) + "\n").encode())
+            self.wfile.flush()
+
+    def _respond(self, service, request):
+        if request.get("op") == "stats":
+            return {"ok": True, "stats": service.stats()}
+        if request.get("op") == "search_many":
+            return {"ok": True, "result": service.search_many(request["queries"], request.get("sets"),
+                                                              request.get("n_docs", 3))}
+        if request.get("op") == "rank_documents":
+            documents = service.rank_documents(request["kind"], request["query"], request["set"],
+                                               request.get("n_docs", 3))
+            return {"ok": True, "result": documents}
+        result = service.search(request["kind"], request["query"], request["set"])
+        return {"ok": True, "result": result}
+
+
+class RetrievalServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, service):
+        self.service = service
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RequestHandler)
+
+
+class RetrievalClient:
+    """Thin client for a running RetrievalServer"""
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+
+    def _call(self, request):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            with sock.makefile("rwb") as stream:
+                stream.write((json.dumps({**request, "parent": current()}) + "\n").encode())
+                stream.flush()
+                response = json.loads(stream.readline())
+        if not response["ok"]:
+            raise RuntimeError(f"Retrieval service error: {response['error']}")
+        return response
+
+    def search(self, kind, query_text, descriptorset_name):
+        return self._call({"op": "search", "kind": kind, "query": query_text, "set": descriptorset_name})["result"]
+
+    def rank_documents(self, kind, query_text, descriptorset_name, n_docs=3):
+        return self._call({"op": "rank_documents", "kind": kind, "query": query_text,
+                           "set": descriptorset_name, "n_docs": n_docs})["result"]
+
+    def search_many(self, query_texts, sets=None, n_docs=3):
+        return self._call({"op": "search_many", "queries": list(query_texts), "sets": sets,
+                           "n_docs": n_docs})["result"]
+
+    def stats(self):
+        return self._call({"op": "stats"})["stats"]
+
+
+def _dispatch(method, *args):
+    """Call a search method on the daemon if one is running, otherwise in-process"""
+    socket_path = os.getenv("RETRIEVAL_SOCKET")
+    if socket_path and os.path.exists(socket_path):
+        try:
+            return getattr(RetrievalClient(socket_path), method)(*args)
+        except (ConnectionError, FileNotFoundError) as e:
+            print(f"Warning: retrieval daemon unavailable ({e}), searching in-process")
+    return getattr(get_service(), method)(*args)
+
+
+def search(kind, query_text, descriptorset_name):
+    return _dispatch("search", kind, query_text, descriptorset_name)
+
+
+def rank_documents(kind, query_text, descriptorset_name, n_docs=3):
+    """Ranked PDFs [{pdf_name, score, ...}] for a query, best first"""
+    return _dispatch("rank_documents", kind, query_text, descriptorset_name, n_docs)
+
+
+def search_many(query_texts, sets=None, n_docs=3):
+    """Ranked PDFs per query across descriptor sets (default: both), fused per query"""
+    return _dispatch("search_many", query_texts, sets, n_docs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm retrieval service for PDF search")
+    parser.add_argument("--serve", action="store_true", help="Run as a UNIX-socket daemon")
+    parser.add_argument("--stats", action="store_true", help="Print stats from a running daemon")
+    parser.add_argument("--socket", default=os.getenv("RETRIEVAL_SOCKET", DEFAULT_SOCKET_PATH))
+    parser.add_argument("--preload", default="text,image_text",
+                        help="Comma-separated models to load at startup (text, image_text)")
+    args = parser.parse_args()
+
+    if args.stats:
+        print(json.dumps(RetrievalClient(args.socket).stats(), indent=2))
+        return
+
+    service = get_service()
+    kinds = [kind for kind in args.preload.split(",") if kind]
+    service.preload(kinds)
+    print("Cold start (s):", json.dumps(service.cold_start, indent=2))
+
+    if args.serve:
+        server = RetrievalServer(args.socket, service)
+        print(f"Retrieval service listening on {args.socket}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""Append-only, indexed store for browser agent runs.
+
+Replaces rewriting browser_agent_logs.json on every run. Runs live in a SQLite
+database in WAL mode, so each run is a single durable INSERT, concurrent CLI
+sessions can write at the same time, and readers can filter by timestamp, task
+or feedback without loading the whole history. The agent's compact trace
+(agent_trace) is stored gzip-compressed next to the final result.
+
+    python run_log.py migrate                      # one-time import of browser_agent_logs.json
+    python run_log.py query --feedback positive --task "create user" --limit 5
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+
+from agent_trace import decode_trace, encode_trace
+
+DEFAULT_LOG_PATH = "browser_agent_logs.db"
+LEGACY_JSON_PATH = "browser_agent_logs.json"
+COLUMNS = ("timestamp", "task", "steps", "result", "feedback", "comment", "evaluation", "evaluation_feedback")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    task TEXT NOT NULL,
+    steps TEXT,
+    result TEXT,
+    feedback TEXT,
+    comment TEXT,
+    evaluation TEXT,
+    evaluation_feedback TEXT,
+    extra TEXT,
+    trace BLOB
+);
+CREATE INDEX IF NOT EXISTS runs_timestamp ON runs (timestamp);
+CREATE INDEX IF NOT EXISTS runs_task ON runs (task);
+CREATE INDEX IF NOT EXISTS runs_feedback ON runs (feedback);
+CREATE TABLE IF NOT EXISTS migrations (source TEXT PRIMARY KEY, runs INTEGER, migrated_at TEXT DEFAULT CURRENT_TIMESTAMP);
+"""
+
+
+class RunLog:
+    """SQLite-backed run log; safe to share between threads and processes"""
+
+    def __init__(self, path=DEFAULT_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")
+        self._db.executescript(_SCHEMA)
+        # Logs created before compact traces lack the column
+        if "trace" not in {row["name"] for row in self._db.execute("PRAGMA table_info(runs)")}:
+            self._db.execute("ALTER TABLE runs ADD COLUMN trace BLOB")
+
+    def _row(self, entry):
+        extra = {key: value for key, value in entry.items() if key not in COLUMNS and key not in ("id", "trace")}
+        return [None if entry.get(col) is None else str(entry[col]) for col in COLUMNS] + \
+               [json.dumps(extra, default=str) if extra else None,
+                encode_trace(entry["trace"]) if entry.get("trace") is not None else None]
+
+    def append(self, entry):
+        """Durably append one run and return its id"""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                f"INSERT INTO runs ({', '.join(COLUMNS)}, extra, trace) VALUES ({', '.join('?' * (len(COLUMNS) + 2))})",
+                self._row(entry))
+            return cursor.lastrowid
+
+    def update(self, run_id, **fields):
+        """Set columns on an existing run, e.g. a later evaluation"""
+        fields = {key: value for key, value in fields.items() if key in COLUMNS}
+        if fields:
+            with self._lock, self._db:
+                self._db.execute(f"UPDATE runs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+                                 [str(value) for value in fields.values()] + [run_id])
+
+    def _where(self, task=None, task_contains=None, feedback=None, evaluation=None, since=None, until=None):
+        clauses, params = [], []
+        for column, op, value in (("task", "=", task), ("task", "LIKE", task_contains and f"%{task_contains}%"),
+                                  ("feedback", "=", feedback), ("evaluation", "=", evaluation),
+                                  ("timestamp", ">=", since), ("timestamp", "<", until)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query(self, limit=None, newest_first=False, **filters):
+        """Iterate over matching runs as dicts, streaming rows from the database"""
+        where, params = self._where(**filters)
+        sql = f"SELECT * FROM runs{where} ORDER BY timestamp {'DESC' if newest_first else 'ASC'}, id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            rows = self._db.execute(sql, params)
+        while True:
+            # Hold the lock per batch, not across yields, so callers can append while iterating
+            with self._lock:
+                batch = rows.fetchmany(100)
+            if not batch:
+                break
+            for row in batch:
+                entry = {key: row[key] for key in row.keys() if key not in ("extra", "trace") and row[key] is not None}
+                if row["extra"]:
+                    entry.update(json.loads(row["extra"]))
+                if row["trace"] is not None:
+                    entry["trace"] = decode_trace(row["trace"])
+                yield entry
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._db.execute(f"SELECT COUNT(*) FROM runs{where}", params).fetchone()[0]
+
+    def migrate_json(self, json_path=LEGACY_JSON_PATH):
+        """Import a legacy JSON log in one transaction; a no-op if it was already imported"""
+        source = os.path.abspath(json_path)
+        if not os.path.exists(json_path) or os.path.getsize(json_path) == 0:
+            return 0
+        with open(json_path) as f:
+            try:
+                logs = json.load(f)
+            except json.JSONDecodeError:
+                print(f"Warning: {json_path} is not valid JSON, skipping migration")
+                return 0
+        if not isinstance(logs, list):
+            return 0
+        with self._lock, self._db:
+            if self._db.execute("SELECT 1 FROM migrations WHERE source = ?", (source,)).fetchone():
+                return 0
+            self._db.executemany(
+                f"INSERT INTO runs ({', '.join(COLUMNS)}, extra, trace) VALUES ({', '.join('?' * (len(COLUMNS) + 2))})",
+                [self._row(entry) for entry in logs if isinstance(entry, dict)])
+            self._db.execute("INSERT INTO migrations (source, runs) VALUES (?, ?)", (source, len(logs)))
+        return len(logs)
+
+    def close(self):
+        self._db.close()
+
+
+_run_log = None
+
+
+def get_run_log(path=None):
+    """Process-wide RunLog, importing the legacy JSON log on first use"""
+    global _run_log
+    if _run_log is None:
+        _run_log = RunLog(path or os.getenv("RUN_LOG_PATH", DEFAULT_LOG_PATH))
+        _run_log.migrate_json(LEGACY_JSON_PATH)
+    return _run_log
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Browser agent run log")
+    parser.add_argument("--db", default=os.getenv("RUN_LOG_PATH", DEFAULT_LOG_PATH))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Import a legacy JSON log")
+    migrate.add_argument("json_path", nargs="?", default=LEGACY_JSON_PATH)
+    query = subparsers.add_parser("query", help="Print matching runs as JSON lines")
+    query.add_argument("--task", dest="task_contains", help="Substring of the task")
+    query.add_argument("--feedback", choices=["positive", "negative"])
+    query.add_argument("--evaluation", choices=["PASS", "NEEDS_IMPROVEMENT", "FAIL"])
+    query.add_argument("--since", help="ISO timestamp lower bound")
+    query.add_argument("--until", help="ISO timestamp upper bound")
+    query.add_argument("--limit", type=int)
+    query.add_argument("--count", action="store_true", help="Only print the number of matching runs")
+    args = parser.parse_args()
+
+    run_log = RunLog(args.db)
+    if args.command == "migrate":
+        print(f"Migrated {run_log.migrate_json(args.json_path)} runs from {args.json_path}")
+        return
+    filters = {"task_contains": args.task_contains, "feedback": args.feedback, "evaluation": args.evaluation,
+               "since": args.since, "until": args.until}
+    if args.count:
+        print(run_log.count(**filters))
+        return
+    for entry in run_log.query(limit=args.limit, **filters):
+        print(json.dumps(entry))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""SigLIP model loading and batched inference shared by ingestion and queries.
+
+Device and precision are chosen once, when the model is loaded, from arguments
+or the environment:
+
+    SIGLIP_DEVICE       auto (default: cuda if available, else cpu), cpu or cuda
+    SIGLIP_PRECISION    auto (default: fp16 on cuda, fp32 on cpu), fp32, fp16 (cuda only),
+                        bf16 (autocast), or int8 (dynamic int8 Linear layers in the text
+                        tower; the image tower stays fp32)
+    SIGLIP_THREADS      intra-op CPU threads (default: torch's choice)
+    SIGLIP_COMPILE=1    torch.compile the encode functions; torch compiles on the first call,
+                        so a call the compiled function fails is rerun eagerly and, if that
+                        succeeds, the model stays eager from then on
+
+Check that a mode keeps embeddings within tolerance before using it for a set
+that was ingested with another: python bench_siglip.py
+"""
+import contextlib
+import os
+import warnings
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from open_clip import create_model_from_pretrained, get_tokenizer
+
+SIGLIP_MODEL_ID = 'hf-hub:timm/ViT-L-16-SigLIP-384'
+# Bump when preprocessing or tokenization changes so cached embeddings are not reused
+SIGLIP_PREPROCESS_VERSION = "1"
+EMBEDDING_DIMENSIONS = 1024
+PRECISIONS = ("fp32", "fp16", "bf16", "int8")
+
+
+def select_device(device=None):
+    device = device or os.getenv("SIGLIP_DEVICE", "auto")
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    if device not in ("cpu", "cuda"):
+        raise ValueError(f"Unknown SigLIP device: {device}")
+    return device
+
+
+def select_precision(device, precision=None):
+    precision = precision or os.getenv("SIGLIP_PRECISION", "auto")
+    if precision == "auto":
+        return "fp16" if device == "cuda" else "fp32"
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown SigLIP precision: {precision} (expected one of {', '.join(PRECISIONS)})")
+    if precision == "fp16" and device == "cpu":
+        raise ValueError("fp16 autocast needs a GPU; use bf16 on CPU")
+    if precision == "int8" and device == "cuda":
+        raise ValueError("Dynamic int8 quantization runs on CPU only")
+    return precision
+
+
+def initialize_siglip_model(device=None, precision=None, threads=None, compile=None):
+    """Load SigLIP as (model, preprocess, tokenizer) for the selected device and precision"""
+    device = select_device(device)
+    precision = select_precision(device, precision)
+    threads = threads or int(os.getenv("SIGLIP_THREADS", "0"))
+    if threads:
+        torch.set_num_threads(threads)
+
+    model, preprocess = create_model_from_pretrained(SIGLIP_MODEL_ID)
+    tokenizer = get_tokenizer(SIGLIP_MODEL_ID)
+    model = model.to(device).eval()
+    if precision == "int8":
+        model.text = torch.ao.quantization.quantize_dynamic(model.text, {torch.nn.Linear}, dtype=torch.qint8)
+    if compile if compile is not None else os.getenv("SIGLIP_COMPILE", "0") == "1":
+        try:
+            model.encode_image = _compiled_or_eager(model.encode_image)
+            model.encode_text = _compiled_or_eager(model.encode_text)
+        except Exception as e:
+            warnings.warn(f"torch.compile unavailable, running eager: {e}")
+    model.siglip_device = device
+    model.siglip_precision = precision
+    return model, preprocess, tokenizer
+
+
+def _compiled_or_eager(function):
+    """torch.compile(function), switching to eager for good the first time compiling fails.
+
+    Compilation happens lazily inside a call (and again for new input shapes), so errors
+    only surface there. A failed compiled call is rerun eagerly; if the eager call raises
+    too, the error is the input's and is raised as is.
+    """
+    compiled = torch.compile(function)
+    current = [compiled]
+
+    def call(*args, **kwargs):
+        if current[0] is function:
+            return function(*args, **kwargs)
+        try:
+            return compiled(*args, **kwargs)
+        except Exception as e:
+            result = function(*args, **kwargs)
+            warnings.warn(f"torch.compile failed, running eager: {type(e).__name__}: {e}")
+            current[0] = function
+            return result
+
+    return call
+
+
+def inference_mode(model):
+    """no_grad plus autocast matching the precision the model was loaded with"""
+    device = getattr(model, "siglip_device", "cpu")
+    precision = getattr(model, "siglip_precision", "fp32")
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.no_grad())
+    # int8 only changes the text tower; quantized Linear layers take fp32 activations
+    if precision in ("fp16", "bf16"):
+        dtype = torch.float16 if precision == "fp16" else torch.bfloat16
+        stack.enter_context(torch.autocast(device_type=device, dtype=dtype))
+    return stack
+
+
+def cache_version(model, tower="text"):
+    """Embedding cache version for a tower, including the precision it runs at.
+
+    fp16, bf16 and int8 embeddings drift from fp32 ones, so each precision has its own
+    namespace; int8 only quantizes the text tower, so its image embeddings are fp32.
+    torch.compile is not part of it: compiled kernels match eager within fp32 rounding.
+    """
+    precision = getattr(model, "siglip_precision", "fp32")
+    if precision == "int8" and tower != "text":
+        precision = "fp32"
+    return f"{SIGLIP_PREPROCESS_VERSION}-{precision}"
+
+
+def encode_image_batches(images, model, preprocess, batch_size):
+    device = getattr(model, "siglip_device", "cpu")
+    features = []
+    for start in range(0, len(images), batch_size):
+        image_input = torch.stack([preprocess(image) for image in images[start:start + batch_size]]).to(device)
+
+        with inference_mode(model):
+            image_features = model.encode_image(image_input)
+            image_features = F.normalize(image_features, dim=-1)
+
+        features.append(image_features.float().cpu().numpy())
+    return np.concatenate(features)
+
+
+def encode_text_batches(texts, model, tokenizer, batch_size):
+    device = getattr(model, "siglip_device", "cpu")
+    features = []
+    for start in range(0, len(texts), batch_size):
+        text_input = tokenizer(texts[start:start + batch_size], context_length=model.context_length).to(device)
+
+        with inference_mode(model):
+            text_features = model.encode_text(text_input)
+            text_features = F.normalize(text_features, dim=-1)
+
+        features.append(text_features.float().cpu().numpy())
+    return np.concatenate(features)
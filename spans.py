@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""Lightweight per-stage latency spans, written to local rotating JSON-lines files.
+
+Independent of weave, so timings are recorded whether or not the hosted tracing
+service is reachable. Spans opened while another span is active record it as
+their parent. Each request opens one root span, and every stage span under it
+shares its trace id, across threads (`activate`) and the retrieval daemon too:
+
+    with span("request", mode="interactive"):
+        with span("gemini_generate", model=model):
+            ...
+
+Every process writes its own file next to SPANS_PATH (spans.<pid>.jsonl), so
+concurrent CLI runs, batch workers and the retrieval daemon never rotate a file
+another process is writing. Configuration comes from the environment:
+
+    SPANS_PATH          span log name (default spans.jsonl)
+    SPANS_MAX_BYTES     per-file rotation size (default 10 MB); the oldest files are
+                        deleted once all of them exceed SPANS_BACKUPS + 1 times that (default 5)
+    SPANS=0             disable recording
+
+    python spans.py report                       # per-stage p50/p95, counts and error rates
+    python spans.py report --since 2025-03-01 --json
+"""
+import argparse
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+DEFAULT_SPANS_PATH = "spans.jsonl"
+
+_current = contextvars.ContextVar("metis_span", default=None)
+_logger = None
+
+
+def span_files(path=None):
+    """Every span file for a log name (per-process files, rotated backups, a legacy shared file), oldest first"""
+    path = path or os.getenv("SPANS_PATH", DEFAULT_SPANS_PATH)
+    directory = os.path.dirname(os.path.abspath(path))
+    stem, ext = os.path.splitext(os.path.basename(path))
+    pattern = re.compile(rf"{re.escape(stem)}(\.\d+)?{re.escape(ext)}(\.\d+)?")
+    files = []
+    for entry in os.listdir(directory) if os.path.isdir(directory) else ():
+        if pattern.fullmatch(entry):
+            try:
+                files.append((os.path.getmtime(os.path.join(directory, entry)), os.path.join(directory, entry)))
+            except OSError:
+                continue  # deleted by another process's cleanup meanwhile
+    return [file_path for _, file_path in sorted(files)]
+
+
+def _prune(path, keep_bytes, own_file):
+    """Delete the oldest span files once all of them together exceed keep_bytes"""
+    files = span_files(path)
+    sizes = {}
+    for file_path in files:
+        try:
+            sizes[file_path] = os.path.getsize(file_path)
+        except OSError:
+            pass
+    total = sum(sizes.values())
+    for file_path in files:
+        if total <= keep_bytes:
+            break
+        if file_path == own_file or file_path not in sizes:
+            continue
+        try:
+            os.remove(file_path)
+        except OSError:
+            continue
+        total -= sizes[file_path]
+
+
+def _get_logger():
+    global _logger
+    if _logger is None:
+        path = os.getenv("SPANS_PATH", DEFAULT_SPANS_PATH)
+        stem, ext = os.path.splitext(path)
+        # Only this process writes (and rotates) its file
+        own_file = f"{stem}.{os.getpid()}{ext}"
+        max_bytes = int(os.getenv("SPANS_MAX_BYTES", str(10 * 1024 * 1024)))
+        backups = int(os.getenv("SPANS_BACKUPS", "5"))
+        try:
+            _prune(path, max_bytes * (backups + 1), os.path.abspath(own_file))
+        except OSError:
+            pass
+        _logger = logging.getLogger("metis.spans")
+        _logger.propagate = False
+        _logger.setLevel(logging.INFO)
+        handler = logging.handlers.RotatingFileHandler(own_file, maxBytes=max_bytes, backupCount=backups,
+                                                       delay=True)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _logger.addHandler(handler)
+    return _logger
+
+
+def enabled():
+    return os.getenv("SPANS", "1") != "0"
+
+
+def current():
+    """{"trace", "span"} of the active span, to carry a request's trace to another process; None outside one"""
+    record = _current.get()
+    return {"trace": record["trace"], "span": record["span"]} if record else None
+
+
+@contextmanager
+def activate(parent):
+    """Open spans under `parent` (a span record or current() from elsewhere), e.g. in another thread"""
+    token = _current.set(parent) if parent else None
+    try:
+        yield
+    finally:
+        if token is not None:
+            _current.reset(token)
+
+
+def start_span(name, **attrs):
+    """Begin a span that outlives one block (a batch task crossing queues); pass it to end_span"""
+    if not enabled():
+        return None
+    parent = _current.get()
+    return {
+        "trace": parent["trace"] if parent else uuid.uuid4().hex[:16],
+        "span": uuid.uuid4().hex[:16],
+        "parent": parent["span"] if parent else None,
+        "name": name,
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "attrs": attrs,
+        "_start": time.perf_counter(),
+    }
+
+
+def end_span(record, error=None):
+    """Record a span from start_span; error is the exception (or its type name) if the stage failed"""
+    if record is None:
+        return
+    record = dict(record)
+    record["duration_ms"] = round((time.perf_counter() - record.pop("_start")) * 1000, 3)
+    record["ok"] = error is None
+    if error is not None:
+        record["error"] = error if isinstance(error, str) else type(error).__name__
+    if not record["attrs"]:
+        del record["attrs"]
+    try:
+        _get_logger().info(json.dumps(record, default=str))
+    except Exception:
+        pass
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage; failures are recorded with the exception type and re-raised"""
+    record = start_span(name, **attrs)
+    if record is None:
+        yield attrs
+        return
+    error = None
+    try:
+        with activate(record):
+            # Callers may add attributes discovered while the stage runs
+            yield record["attrs"]
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        end_span(record, error)
+
+
+def read_spans(path=None):
+    """Yield span records from every span file of the log, oldest file first"""
+    for file_path in span_files(path):
+        try:
+            f = open(file_path)
+        except OSError:
+            continue
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def _percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(records, since=None, name=None):
+    """Per-stage count, error rate and latency percentiles in milliseconds"""
+    stages = {}
+    for record in records:
+        if since and record.get("ts", "") < since:
+            continue
+        if name and not record.get("name", "").startswith(name):
+            continue
+        stage = stages.setdefault(record["name"], {"durations": [], "errors": 0})
+        stage["durations"].append(record.get("duration_ms", 0.0))
+        stage["errors"] += 0 if record.get("ok", True) else 1
+    summary = {}
+    for stage_name, stage in stages.items():
+        durations = sorted(stage["durations"])
+        summary[stage_name] = {
+            "count": len(durations),
+            "errors": stage["errors"],
+            "error_rate": stage["errors"] / len(durations),
+            "p50_ms": _percentile(durations, 0.5),
+            "p95_ms": _percentile(durations, 0.95),
+            "max_ms": durations[-1],
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency report from the span log")
+    parser.add_argument("--path", default=os.getenv("SPANS_PATH", DEFAULT_SPANS_PATH))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser("report", help="Print per-stage latency percentiles")
+    report.add_argument("--since", help="ISO timestamp lower bound")
+    report.add_argument("--name", help="Only stages whose name starts with this prefix")
+    report.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    args = parser.parse_args()
+
+    summary = summarize(read_spans(args.path), since=args.since, name=args.name)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    if not summary:
+        print(f"No spans in {args.path}", file=sys.stderr)
+        return
+    print(f"{'stage':<28}{'count':>8}{'errors':>8}{'err %':>8}{'p50 ms':>11}{'p95 ms':>11}{'max ms':>11}")
+    for stage_name, stats in sorted(summary.items(), key=lambda item: -item[1]["p50_ms"] * item[1]["count"]):
+        print(f"{stage_name:<28}{stats['count']:>8}{stats['errors']:>8}{stats['error_rate'] * 100:>7.1f}%"
+              f"{stats['p50_ms']:>11.1f}{stats['p95_ms']:>11.1f}{stats['max_ms']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Streaming plan execution: the browser starts on step 1 while Gemini is still writing step 5.
+
+The plan is requested as a plain numbered list and streamed. StepParser turns
+the text chunks into complete steps (a step is complete once the next number
+starts, or the stream ends), which are put on an asyncio queue. In parallel, a
+pooled browser context is borrowed and pointed at the start URL. The executor
+then runs the steps already available as one browser-use agent run on that
+context, and repeats with whatever arrived in the meantime. Every run is told
+which steps are done, so the agent continues from the current page.
+
+    STREAM_START_URL    page opened while the plan is generated (default: the Stytch dashboard)
+
+    python cli_browser_agent.py --stream "Create a new user named Bob"
+"""
+import asyncio
+import os
+import re
+import time
+
+from spans import span
+
+DEFAULT_START_URL = "https://stytch.com/dashboard"
+# "1. ...", "1) ...", "**1.** ...", "Step 1: ..." at the start of a line
+_STEP_START = re.compile(r"^(?:\*\*)?(?:step\s+)?(\d+)\s*[.):](?:\*\*)?\s+", re.IGNORECASE)
+
+
+class StepParser:
+    """Incremental parser for a numbered step list that arrives in arbitrary text chunks"""
+
+    def __init__(self):
+        self._pending = ""
+        self._current = None
+        self._number = 0
+        self._preamble = []
+        self.steps = []
+
+    def feed(self, text):
+        """Add streamed text; returns the steps completed by it"""
+        self._pending += text
+        *lines, self._pending = self._pending.split("\n")
+        completed = []
+        for line in lines:
+            completed.extend(self._line(line))
+        # The current step is complete as soon as the next number starts, before that line ends
+        match = _STEP_START.match(self._pending.strip())
+        if self._current is not None and match and int(match.group(1)) == self._number + 1:
+            completed.append(self._finish())
+        return completed
+
+    def close(self):
+        """End of stream; returns the last step (or the whole text if it had no numbering)"""
+        completed = self._line(self._pending) if self._pending else []
+        self._pending = ""
+        if self._current is not None:
+            completed.append(self._finish())
+        elif not self.steps and any(line.strip() for line in self._preamble):
+            # No numbered list at all: run the response as a single step
+            self.steps.append(" ".join(line.strip() for line in self._preamble if line.strip()))
+            completed.append(self.steps[-1])
+        return completed
+
+    def _line(self, line):
+        match = _STEP_START.match(line.strip())
+        # Only the next number in sequence starts a step, so nested or quoted lists stay inside it
+        if match and int(match.group(1)) == self._number + 1:
+            completed = [self._finish()] if self._current is not None else []
+            self._number += 1
+            self._current = [line.strip()[match.end():]]
+            return completed
+        if self._current is None:
+            self._preamble.append(line)
+        elif line.strip():
+            self._current.append(line.strip())
+        return []
+
+    def _finish(self):
+        step = " ".join(part for part in self._current if part)
+        self._current = None
+        self.steps.append(step)
+        return step
+
+
+async def produce_steps(chunks, queue):
+    """Parse a blocking iterator of text chunks in a thread, putting steps on the queue as they complete.
+
+    None is put on the queue when the stream ends, also when it fails; the error is re-raised here.
+    """
+    loop = asyncio.get_running_loop()
+    parser = StepParser()
+
+    def consume():
+        try:
+            for text in chunks:
+                for step in parser.feed(text):
+                    loop.call_soon_threadsafe(queue.put_nowait, step)
+            for step in parser.close():
+                loop.call_soon_threadsafe(queue.put_nowait, step)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, None)
+
+    await asyncio.to_thread(consume)
+    return parser.steps
+
+
+def _agent_task(task, done, steps):
+    lines = [f"Overall goal: {task}"]
+    if done:
+        lines.append("These steps are already completed, continue from the current page:")
+        lines.extend(f"{i}. {step}" for i, step in enumerate(done, 1))
+    lines.append("Now do the following steps:")
+    lines.extend(f"{i}. {step}" for i, step in enumerate(steps, len(done) + 1))
+    return "\n".join(lines)
+
+
+async def execute_streamed(task, queue, start_url=None, started=None):
+    """Run steps from the queue as they arrive on one pooled browser context.
+
+    Returns {"steps", "histories", "time_to_first_step", "time_to_first_action", "total_seconds"},
+    all times in seconds since `started` (default: now).
+    """
+    from browser_use import Agent
+    from langchain_openai import ChatOpenAI
+    from browser_pool import get_browser_pool
+
+    started = started or time.perf_counter()
+    start_url = start_url if start_url is not None else os.getenv("STREAM_START_URL", DEFAULT_START_URL)
+    result = {"steps": [], "histories": [], "time_to_first_step": None, "time_to_first_action": None}
+    async with get_browser_pool().session() as context:
+        # Launch and navigation overlap with generation: the producer is already streaming
+        if start_url:
+            with span("browser_navigate", url=start_url):
+                page = await context.get_current_page()
+                await page.goto(start_url)
+        finished = False
+        while not finished:
+            step = await queue.get()
+            if step is None:
+                break
+            if result["time_to_first_step"] is None:
+                result["time_to_first_step"] = time.perf_counter() - started
+            # Take every step that is already parsed, so later runs cover several steps each
+            batch = [step]
+            while not queue.empty():
+                step = queue.get_nowait()
+                if step is None:
+                    finished = True
+                    break
+                batch.append(step)
+            agent = Agent(task=_agent_task(task, result["steps"], batch), llm=ChatOpenAI(model="gpt-4o"),
+                          browser=context.browser, browser_context=context)
+            if result["time_to_first_action"] is None:
+                result["time_to_first_action"] = time.perf_counter() - started
+            with span("agent_run", streamed=True, first_step=len(result["steps"]) + 1, steps=len(batch)) as attrs:
+                history = await agent.run()
+                attrs["actions"] = len(getattr(history, "history", ()))
+            result["histories"].append(history)
+            result["steps"].extend(batch)
+    result["total_seconds"] = time.perf_counter() - started
+    return result
+
+
+async def run_streamed(task, chunks, start_url=None, started=None):
+    """Generate (from `chunks`) and execute a plan concurrently; see execute_streamed for the result"""
+    started = started or time.perf_counter()
+    queue = asyncio.Queue()
+    producer = asyncio.ensure_future(produce_steps(chunks, queue))
+    try:
+        result = await execute_streamed(task, queue, start_url, started)
+    except BaseException:
+        # Let the producer thread finish its current chunk rather than leave it writing to a dead queue
+        await asyncio.gather(producer, return_exceptions=True)
+        raise
+    result["generated_steps"] = await producer
+    return result
+
+
+def numbered(steps):
+    """Steps as the numbered list the plan cache and run log store"""
+    return "\n".join(f"{i}. {step}" for i, step in enumerate(steps, 1))
@@ -0,0 +1,67 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from browser_pool import BrowserPool  # noqa: E402
+
+
+class FakeContext:
+    async def close(self):
+        pass
+
+
+def make_pool(size):
+    """A pool whose browser is already up, so browser_use is never imported"""
+    pool = BrowserPool(size=size, chrome_path="", headless=True)
+    pool.browser = object()
+    pool._idle = asyncio.Queue()
+    for _ in range(size):
+        context = FakeContext()
+        pool._contexts.append(context)
+        pool._idle.put_nowait(context)
+    return pool
+
+
+def test_pool_keeps_its_size_when_replacing_a_context_fails():
+    pool = make_pool(2)
+    created = []
+    fail = True
+
+    async def new_context():
+        if fail:
+            raise RuntimeError("browser crashed")
+        context = FakeContext()
+        created.append(context)
+        pool._contexts.append(context)
+        return context
+
+    pool._new_context = new_context
+
+    async def scenario():
+        nonlocal fail
+        with pytest.raises(ValueError):
+            async with pool.session():
+                raise ValueError("task failed")
+        assert pool._idle.qsize() == 2
+
+        # The empty slot fails again while the browser is still down, and is kept
+        async with pool.session():
+            pass
+        with pytest.raises(RuntimeError):
+            async with pool.session():
+                pass
+        assert pool._idle.qsize() == 2
+
+        # Once contexts can be created again both slots are usable
+        fail = False
+        async with pool.session() as first:
+            async with pool.session() as second:
+                assert first is not None and second is not None
+        assert pool._idle.qsize() == 2
+        assert len(created) == 1
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=5))
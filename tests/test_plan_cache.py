@@ -0,0 +1,45 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plan_cache import PlanCache, extract_entities, fill_template, make_template  # noqa: E402
+
+TASK = "create user named Test User"
+STEPS = '1. Click "Create new user"\n2. Type "Test User" in the Name field\n3. Click Save'
+
+
+def embed(texts):
+    """Bag-of-words stand-in for MiniLM"""
+    vectors = []
+    for text in texts:
+        vector = np.zeros(64, dtype=np.float32)
+        for word in text.split():
+            vector[sum(map(ord, word)) % 64] += 1
+        vectors.append(vector / np.linalg.norm(vector))
+    return vectors
+
+
+def test_name_parts_in_button_labels_stay_text():
+    entities, _ = extract_entities(TASK)
+    template = make_template(STEPS, entities, TASK)
+    assert 'Click "Create new user"' in template
+    assert 'Type "{{name_0}}" in the Name field' in template
+
+
+def test_cache_hit_fills_only_typed_values(tmp_path):
+    cache = PlanCache(str(tmp_path / "plans.db"), embed=embed)
+    cache.add(TASK, STEPS, {"feedback": "positive"})
+    _, steps, _ = cache.lookup("create user named Alice Jones")
+    assert steps == '1. Click "Create new user"\n2. Type "Alice Jones" in the Name field\n3. Click Save'
+
+
+def test_value_mentioned_outside_typed_input_is_pinned():
+    task = "add a member named Bob Smith"
+    entities, _ = extract_entities(task)
+    template = make_template("1. Enter Bob Smith in the name field\n2. Open Bob's profile", entities, task)
+    assert fill_template(template, extract_entities("add a member named Alice Jones")[0]) is None
+    assert fill_template(template, extract_entities("add a member named Bob Jones")[0]) == \
+        "1. Enter Bob Jones in the name field\n2. Open Bob's profile"
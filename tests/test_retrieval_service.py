@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval_service import RetrievalService  # noqa: E402
+from vector_index import LocalConnector  # noqa: E402
+
+HEADINGS = [("create_new_user", "Create New User"), ("invite_team_member", "Invite Team Member"),
+            ("create_organization", "Create Organization")]
+
+
+class WordModel:
+    """Bag-of-words stand-in for MiniLM"""
+
+    def encode(self, texts):
+        vectors = np.zeros((len(texts), 32), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i, sum(map(ord, word)) % 32] += 1
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def test_resources_load_concurrently():
+    service = RetrievalService()
+    started = threading.Barrier(2, timeout=5)
+
+    def loader():
+        # Both loaders must be running at once to get past the barrier
+        started.wait()
+        time.sleep(0.05)
+        return object()
+
+    threads = [threading.Thread(target=service._get, args=(name, loader)) for name in ("text_model", "siglip")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert set(service.cold_start) == {"text_model", "siglip"}
+
+
+def test_search_many_has_one_shape_for_any_number_of_sets(tmp_path, monkeypatch):
+    monkeypatch.setenv("EMBEDDING_CACHE", "0")
+    monkeypatch.setenv("SPANS", "0")
+    monkeypatch.setenv("LEXICAL_INDEX_DIR", str(tmp_path / "lexical"))
+    model = WordModel()
+    db = LocalConnector(str(tmp_path / "index"))
+    vectors = model.encode([text for _, text in HEADINGS])
+    db.query([{"AddDescriptorSet": {"name": "headings", "dimensions": 32, "engine": "Flat", "metric": "IP"}}])
+    db.query([{"AddDescriptor": {"set": "headings", "properties": {"pdf_name": pdf_name, "text": text}}}
+              for pdf_name, text in HEADINGS], [vector.tobytes() for vector in vectors])
+
+    service = RetrievalService(resources={"db": db, "text_model": model})
+    (documents,) = service.search_many(["invite a team member"], sets={"text": "headings"})
+    assert documents[0]["pdf_name"] == "invite_team_member"
+    assert all(set(document) == {"pdf_name", "score", "ranks"} for document in documents)
+    assert documents[0]["ranks"] == {"text": 1}
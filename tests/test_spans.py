@@ -0,0 +1,55 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import spans  # noqa: E402
+
+WRITER = """
+import sys, threading
+sys.path.insert(0, {root!r})
+from spans import activate, current, span
+with span("request", n=int(sys.argv[1])):
+    with span("stage"):
+        pass
+    parent = current()
+    def work():
+        with activate(parent):
+            with span("threaded"):
+                pass
+    thread = threading.Thread(target=work)
+    thread.start()
+    thread.join()
+"""
+
+
+def test_each_process_writes_its_own_file_and_requests_share_a_trace(tmp_path):
+    env = {**os.environ, "SPANS_PATH": str(tmp_path / "spans.jsonl"), "SPANS": "1"}
+    script = WRITER.format(root=ROOT)
+    processes = [subprocess.Popen([sys.executable, "-c", script, str(n)], env=env) for n in range(4)]
+    assert all(process.wait() == 0 for process in processes)
+
+    assert len(spans.span_files(str(tmp_path / "spans.jsonl"))) == 4
+    records = list(spans.read_spans(str(tmp_path / "spans.jsonl")))
+    assert len(records) == 12
+    traces = {}
+    for record in records:
+        traces.setdefault(record["trace"], []).append(record)
+    assert len(traces) == 4
+    for trace in traces.values():
+        (root,) = [record for record in trace if record["name"] == "request"]
+        assert root["parent"] is None
+        assert all(record["parent"] == root["span"] for record in trace if record is not root)
+
+
+def test_old_files_are_pruned_to_the_budget(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    for pid in range(5):
+        (tmp_path / f"spans.{pid}.jsonl").write_text(json.dumps({"name": "x"}) + "\n" * 99)
+        os.utime(tmp_path / f"spans.{pid}.jsonl", (pid, pid))
+    spans._prune(str(path), 250, str(tmp_path / "spans.4.jsonl"))
+    assert [os.path.basename(p) for p in spans.span_files(str(path))] == ["spans.3.jsonl", "spans.4.jsonl"]
@@ -0,0 +1,83 @@
+"""Lazy weave tracing.
+
+Importing weave and calling weave.init takes seconds, so it is deferred until
+init_tracing() runs, optionally on a background thread while the user is still
+typing. Functions decorated with @op are wrapped with weave.op on their first
+call after tracing was started; until then, or with WEAVE_DISABLED=1, they run
+untraced, exactly as weave.op behaves without weave.init.
+"""
+import contextlib
+import functools
+import os
+import threading
+
+WEAVE_PROJECT = os.getenv("WEAVE_PROJECT", "metis")
+
+_lock = threading.Lock()
+_init_thread = None
+_weave = None
+
+
+def enabled():
+    return os.getenv("WEAVE_DISABLED", "0") != "1"
+
+
+def _init():
+    global _weave
+    try:
+        import weave
+        weave.init(WEAVE_PROJECT)
+        _weave = weave
+    except Exception as e:
+        print(f"Warning: weave tracing disabled: {e}")
+
+
+def init_tracing(background=False):
+    """Start weave.init once; with background=True it runs on a daemon thread"""
+    global _init_thread
+    if not enabled():
+        return
+    with _lock:
+        if _init_thread is None:
+            _init_thread = threading.Thread(target=_init, name="weave-init", daemon=True)
+            if background:
+                _init_thread.start()
+            else:
+                _init_thread.run()
+
+
+def _ready():
+    """The initialized weave module, waiting for a background init; None if tracing is off"""
+    if _init_thread is None:
+        return None
+    if _init_thread.is_alive():
+        _init_thread.join()
+    return _weave
+
+
+def op(fn):
+    """Like weave.op, but weave is only imported once tracing has been started"""
+    traced = None
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        nonlocal traced
+        weave = _ready()
+        if weave is None:
+            return fn(*args, **kwargs)
+        if traced is None:
+            traced = weave.op()(fn)
+        return traced(*args, **kwargs)
+    return wrapper
+
+
+def attributes(values):
+    """weave.attributes when tracing, otherwise a no-op context"""
+    weave = _ready()
+    return weave.attributes(values) if weave is not None else contextlib.nullcontext()
+
+
+def current_call():
+    """The weave call being executed, or None when not tracing"""
+    weave = _ready()
+    return weave.require_current_call() if weave is not None else None
@@ -0,0 +1,102 @@
+"""Cache of Gemini file uploads, keyed by file content hash and persisted across CLI runs.
+
+Uploaded files expire on the provider side (48 hours for the Gemini Files API),
+so every entry keeps the expiry time returned by the upload and is re-uploaded
+once it is within EXPIRY_MARGIN of expiring, or when a request rejects its URI.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "metis", "gemini_uploads.json")
+# Used when the provider does not report an expiry time
+DEFAULT_TTL = timedelta(hours=47)
+EXPIRY_MARGIN = timedelta(minutes=10)
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+
+
+class UploadCache:
+    """Maps PDF content hashes to uploaded file URIs"""
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("GEMINI_UPLOAD_CACHE", DEFAULT_CACHE_PATH)
+        self._lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.uploads = 0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (json.JSONDecodeError, OSError):
+                self.entries = {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _valid(self, entry):
+        expires = _parse_time(entry.get("expiration_time"))
+        return expires is not None and datetime.now(timezone.utc) < expires - EXPIRY_MARGIN
+
+    def get_or_upload(self, client, file_path):
+        """Return an object with .uri and .mime_type, uploading only on a miss or expiry"""
+        key = _file_hash(file_path)
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and self._valid(entry):
+                self.hits += 1
+                return SimpleNamespace(**entry)
+
+            upload_file = client.files.upload(file=file_path)
+            self.uploads += 1
+            now = datetime.now(timezone.utc)
+            expires = _parse_time(getattr(upload_file, "expiration_time", None)) or now + DEFAULT_TTL
+            entry = {
+                "name": upload_file.name,
+                "uri": upload_file.uri,
+                "mime_type": upload_file.mime_type,
+                "expiration_time": expires.isoformat(),
+                "uploaded_at": now.isoformat(),
+                "path": os.path.abspath(file_path),
+            }
+            self.entries[key] = entry
+            self._save()
+            return SimpleNamespace(**entry)
+
+    def invalidate(self, file_path):
+        """Forget a file, e.g. after the provider rejected its URI"""
+        with self._lock:
+            if self.entries.pop(_file_hash(file_path), None) is not None:
+                self._save()
+
+
+_upload_cache = None
+
+
+def get_upload_cache():
+    global _upload_cache
+    if _upload_cache is None:
+        _upload_cache = UploadCache()
+    return _upload_cache
@@ -0,0 +1,391 @@
+"""Pluggable descriptor backends for ingestion and search.
+
+Both backends speak the ApertureDB query protocol (`db.query(q, blobs)`), so the
+AddDescriptorSet / AddDescriptor / FindDescriptor commands used by
+process_image_text, query_pdf and query_image_text_pdf work unchanged against
+either one. Pick the backend with the VECTOR_BACKEND environment variable:
+
+    VECTOR_BACKEND=aperturedb   hosted ApertureDB instance (default)
+    VECTOR_BACKEND=local        embedded index under VECTOR_INDEX_DIR
+    VECTOR_BACKEND=remote       db_client's fake server at VECTOR_REMOTE
+
+The local engine keeps vectors in a memory-mapped .npy file per descriptor set
+with properties in a JSONL sidecar and deletions in a tombstone sidecar, and
+supports exact "Flat" search and an approximate "IVF" (inverted file) mode.
+Sets can also keep compressed float16, int8 or product-quantized codes that
+searches scan before re-ranking with the float32 vectors (see quantization.py);
+pass "storage" to AddDescriptorSet or set VECTOR_STORAGE for new sets.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from quantization import CODECS, STORAGE_MODES, PQCodec
+
+DEFAULT_INDEX_DIR = "vector_index"
+INITIAL_CAPACITY = 256
+# Candidates re-ranked with float32 vectors per requested neighbor; 0 returns approximate scores
+RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "4"))
+PQ_MIN_TRAINING = 256
+
+
+def connect_to_db(backend=None):
+    """Open the configured descriptor backend; remote backends share one pooled client (db_client)"""
+    backend = backend or os.getenv("VECTOR_BACKEND", "aperturedb")
+    if backend == "local":
+        return LocalConnector(os.getenv("VECTOR_INDEX_DIR", DEFAULT_INDEX_DIR))
+    if backend in ("aperturedb", "remote"):
+        from db_client import get_client
+        return get_client(backend)
+    raise ValueError(f"Unknown VECTOR_BACKEND: {backend}")
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    """Plain Lloyd's k-means on normalized vectors (IVF lists, document centroids)"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(n_clusters):
+            members = vectors[assignments == c]
+            if len(members):
+                centroids[c] = members.mean(axis=0)
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class DescriptorSet:
+    """One descriptor set on disk: meta.json, vectors.npy (memmap) and properties.jsonl"""
+
+    # Rewritten or appended by every add and delete, so together they tell when another
+    # connector (or process) has changed the set
+    CHANGE_FILES = ("meta.json", "properties.jsonl", "deleted.jsonl")
+
+    def __init__(self, path):
+        self.path = path
+        self.signature = self.stat(path)
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r+")
+        self.properties = []
+        properties_path = os.path.join(path, "properties.jsonl")
+        if os.path.exists(properties_path):
+            with open(properties_path) as f:
+                self.properties = [json.loads(line) for line in f if line.strip()]
+        # Vectors are written before their property line, so the sidecar is the source of truth
+        # if a write was interrupted before meta.json was updated
+        self.meta["count"] = min(len(self.properties), len(self.vectors))
+        del self.properties[self.meta["count"]:]
+        self.live = np.ones(self.meta["count"], dtype=bool)
+        deleted_path = os.path.join(path, "deleted.jsonl")
+        if os.path.exists(deleted_path):
+            with open(deleted_path) as f:
+                for line in f:
+                    if line.strip():
+                        self.live[json.loads(line)] = False
+        self._ivf = None
+        self.codec, self.codes = None, {}
+        storage = self.meta.get("storage", "float32")
+        if storage != "float32":
+            self.codec = CODECS[storage](self.meta["dimensions"])
+            codebooks_path = os.path.join(path, "codebooks.npy")
+            if isinstance(self.codec, PQCodec) and os.path.exists(codebooks_path):
+                self.codec.codebooks = np.load(codebooks_path)
+            for name in self.codec.arrays:
+                self.codes[name] = np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r+")
+
+    @classmethod
+    def create(cls, path, dimensions, engine, metric, storage="float32"):
+        os.makedirs(path, exist_ok=True)
+        np.lib.format.open_memmap(os.path.join(path, "vectors.npy"), mode="w+",
+                                  dtype=np.float32, shape=(INITIAL_CAPACITY, dimensions))
+        if storage != "float32":
+            for name, (dtype, row_shape) in CODECS[storage](dimensions).arrays.items():
+                np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode="w+",
+                                          dtype=dtype, shape=(INITIAL_CAPACITY,) + row_shape)
+        meta = {"dimensions": dimensions, "engine": engine, "metric": metric, "storage": storage, "count": 0}
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+        return cls(path)
+
+    @staticmethod
+    def stat(path):
+        """(mtime, size) of the change files, None for a missing file"""
+        signature = []
+        for name in DescriptorSet.CHANGE_FILES:
+            try:
+                st = os.stat(os.path.join(path, name))
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    @property
+    def count(self):
+        return self.meta["count"]
+
+    def _grow_array(self, name, array, capacity):
+        array_path = os.path.join(self.path, f"{name}.npy")
+        tmp_path = array_path + ".tmp"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=array.dtype,
+                                          shape=(capacity,) + array.shape[1:])
+        grown[:self.count] = array[:self.count]
+        grown.flush()
+        del grown, array
+        os.replace(tmp_path, array_path)
+        return np.load(array_path, mmap_mode="r+")
+
+    def _grow(self, needed):
+        capacity = len(self.vectors)
+        while capacity < needed:
+            capacity *= 2
+        vectors, self.vectors = self.vectors, None
+        self.vectors = self._grow_array("vectors", vectors, capacity)
+        for name in list(self.codes):
+            codes, self.codes[name] = self.codes[name], None
+            self.codes[name] = self._grow_array(name, codes, capacity)
+
+    def _write_codes(self, start, stop):
+        """Encode rows [start, stop) into the compressed arrays, training PQ codebooks when due"""
+        if isinstance(self.codec, PQCodec):
+            trained_count = self.meta.get("pq_trained_count", 0)
+            if stop >= PQ_MIN_TRAINING and (not self.codec.trained or stop >= 4 * trained_count):
+                # (Re)fit the codebooks on the current vectors and re-encode every row
+                self.codec.train(np.asarray(self.vectors[:stop]))
+                np.save(os.path.join(self.path, "codebooks.npy"), self.codec.codebooks)
+                self.meta["pq_trained_count"] = stop
+                start = 0
+            if not self.codec.trained:
+                return
+        for name, codes in self.codec.encode(np.asarray(self.vectors[start:stop])).items():
+            self.codes[name][start:stop] = codes
+            self.codes[name].flush()
+
+    def add(self, vectors, properties):
+        start = self.count
+        if start + len(vectors) > len(self.vectors):
+            self._grow(start + len(vectors))
+        self.vectors[start:start + len(vectors)] = vectors
+        self.vectors.flush()
+        if self.codec is not None:
+            self._write_codes(start, start + len(vectors))
+        with open(os.path.join(self.path, "properties.jsonl"), "a") as f:
+            for props in properties:
+                f.write(json.dumps(props) + "\n")
+        self.properties.extend(properties)
+        self.live = np.concatenate([self.live, np.ones(len(properties), dtype=bool)])
+        self.meta["count"] = start + len(vectors)
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+        self.signature = self.stat(self.path)
+
+    def _scores(self, query, rows):
+        """Similarity for IP, negated squared distance for L2 (higher is better)"""
+        vectors = self.vectors[rows] if rows is not None else self.vectors[:self.count]
+        if self.meta["metric"] == "L2":
+            return -np.sum((vectors - query) ** 2, axis=1)
+        return vectors @ query
+
+    def _approximate_scores(self, query, rows):
+        """Asymmetric scores of the exact query against the compressed codes"""
+        data = {name: (codes[rows] if rows is not None else codes[:self.count])
+                for name, codes in self.codes.items()}
+        return self.codec.scores(query, data, self.meta["metric"])
+
+    def _candidate_rows(self, query, n_probe):
+        """Rows in the n_probe IVF lists closest to the query"""
+        n = self.count
+        n_lists = max(1, int(np.sqrt(n)))
+        if self._ivf is None or self._ivf["trained_count"] < n // 2:
+            if n < 4 * n_lists:
+                return None
+            centroids, assignments = kmeans(np.asarray(self.vectors[:n]), n_lists)
+            self._ivf = {"centroids": centroids, "assignments": assignments, "trained_count": n}
+        elif len(self._ivf["assignments"]) < n:
+            # Assign rows added since training to their nearest existing list
+            assigned = len(self._ivf["assignments"])
+            extra = np.argmax(np.asarray(self.vectors[assigned:n]) @ self._ivf["centroids"].T, axis=1)
+            self._ivf["assignments"] = np.concatenate([self._ivf["assignments"], extra])
+        probes = np.argsort(-(self._ivf["centroids"] @ query))[:n_probe]
+        return np.nonzero(np.isin(self._ivf["assignments"], probes))[0]
+
+    def delete(self, rows):
+        """Tombstone rows; their slots are skipped by every later search"""
+        rows = [row for row in rows if self.live[row]]
+        if rows:
+            with open(os.path.join(self.path, "deleted.jsonl"), "a") as f:
+                f.write(json.dumps(rows) + "\n")
+            self.live[rows] = False
+            self.signature = self.stat(self.path)
+        return len(rows)
+
+    def matching_rows(self, constraints):
+        """Live rows whose properties satisfy ApertureDB-style constraints"""
+        return np.array([row for row in np.nonzero(self.live)[0]
+                         if matches_constraints(self.properties[row], constraints)], dtype=np.int64)
+
+    def search(self, query, k, constraints=None, n_probe=4):
+        if self.count == 0:
+            return []
+        rows = None
+        if self.meta["engine"] == "IVF":
+            rows = self._candidate_rows(query, n_probe)
+        if constraints:
+            allowed = self.matching_rows(constraints)
+            rows = allowed if rows is None else np.intersect1d(rows, allowed)
+        elif not self.live.all():
+            rows = np.nonzero(self.live)[0] if rows is None else rows[self.live[rows]]
+        if rows is not None and len(rows) == 0:
+            return []
+        if self.codec is not None and getattr(self.codec, "trained", True):
+            scores = self._approximate_scores(query, rows)
+            if RERANK_FACTOR:
+                # Keep the best candidates by approximate score and re-rank them exactly
+                n_candidates = min(len(scores), k * RERANK_FACTOR)
+                candidates = np.argpartition(-scores, n_candidates - 1)[:n_candidates]
+                rows = candidates if rows is None else rows[candidates]
+                scores = self._scores(query, rows)
+        else:
+            scores = self._scores(query, rows)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        row_ids = top if rows is None else rows[top]
+        distances = scores[top] if self.meta["metric"] != "L2" else -scores[top]
+        return list(zip(row_ids.tolist(), distances.tolist()))
+
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    ">": lambda a, b: a is not None and a > b,
+    ">=": lambda a, b: a is not None and a >= b,
+    "<": lambda a, b: a is not None and a < b,
+    "<=": lambda a, b: a is not None and a <= b,
+    "in": lambda a, b: a in b,
+    "not in": lambda a, b: a not in b,
+}
+
+
+def matches_constraints(properties, constraints):
+    """Evaluate {"prop": [op, value, op, value, ...]} constraints, all of which must hold"""
+    for key, condition in constraints.items():
+        value = properties.get(key)
+        for op, operand in zip(condition[::2], condition[1::2]):
+            if not _OPERATORS[op](value, operand):
+                return False
+    return True
+
+
+class LocalConnector:
+    """Embedded stand-in for aperturedb.Connector backed by DescriptorSet files"""
+
+    ENGINES = ("Flat", "IVF")
+    METRICS = ("IP", "L2")
+
+    def __init__(self, root):
+        self.root = root
+        self._sets = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _set(self, name):
+        """The named set, reloaded if its files changed since this connector last read or wrote them"""
+        path = os.path.join(self.root, name)
+        if not os.path.exists(os.path.join(path, "meta.json")):
+            self._sets.pop(name, None)
+            raise ValueError(f"Descriptor set not found: {name}")
+        descriptor_set = self._sets.get(name)
+        if descriptor_set is None or descriptor_set.signature != DescriptorSet.stat(path):
+            descriptor_set = self._sets[name] = DescriptorSet(path)
+        return descriptor_set
+
+    def query(self, q, blobs=None):
+        """Execute a list of commands, consuming one blob per AddDescriptor/FindDescriptor"""
+        blobs = list(blobs or [])
+        responses, out_blobs = [], []
+        with self._lock:
+            pending = {}
+            for command in q:
+                (name, body), = command.items()
+                if name == "AddDescriptorSet":
+                    responses.append({name: self._add_descriptor_set(body)})
+                elif name == "AddDescriptor":
+                    vector = np.frombuffer(blobs.pop(0), dtype=np.float32)
+                    pending.setdefault(body["set"], []).append((vector, body.get("properties", {})))
+                    responses.append({name: {"status": 0}})
+                elif name == "FindDescriptorSet":
+                    responses.append({name: self._find_descriptor_set(body)})
+                elif name == "GetStatus":
+                    responses.append({name: {"status": 0, "info": "OK"}})
+                elif name == "DeleteDescriptor":
+                    self._flush(pending)
+                    responses.append({name: self._delete_descriptor(body)})
+                elif name == "FindDescriptor":
+                    self._flush(pending)
+                    # Like ApertureDB, only a k-NN search consumes a query blob; without
+                    # k_neighbors the command lists the descriptors matching its constraints
+                    query = np.frombuffer(blobs.pop(0), dtype=np.float32) if "k_neighbors" in body else None
+                    response, vectors = self._find_descriptor(body, query)
+                    responses.append({name: response})
+                    out_blobs.extend(vectors)
+                else:
+                    raise ValueError(f"Unsupported command for local backend: {name}")
+            self._flush(pending)
+        return responses, out_blobs
+
+    def _flush(self, pending):
+        """Write queued AddDescriptor commands as one append per set"""
+        for set_name, items in pending.items():
+            self._set(set_name).add(np.stack([vector for vector, _ in items]),
+                                    [props for _, props in items])
+        pending.clear()
+
+    def _add_descriptor_set(self, body):
+        storage = body.get("storage", os.getenv("VECTOR_STORAGE", "float32"))
+        if body.get("engine", "Flat") not in self.ENGINES or body.get("metric", "IP") not in self.METRICS:
+            return {"status": -1, "info": f"Unsupported engine/metric: {body.get('engine')}/{body.get('metric')}"}
+        if storage not in STORAGE_MODES:
+            return {"status": -1, "info": f"Unsupported storage: {storage}"}
+        path = os.path.join(self.root, body["name"])
+        if os.path.exists(os.path.join(path, "meta.json")):
+            return {"status": 2, "info": "Descriptor set already exists"}
+        self._sets[body["name"]] = DescriptorSet.create(path, body["dimensions"], body.get("engine", "Flat"),
+                                                        body.get("metric", "IP"), storage)
+        return {"status": 0}
+
+    def _find_descriptor_set(self, body):
+        names = sorted(entry for entry in os.listdir(self.root)
+                       if os.path.exists(os.path.join(self.root, entry, "meta.json")))
+        if "with_name" in body:
+            names = [name for name in names if name == body["with_name"]]
+        return {"status": 0, "returned": len(names), "entities": [{"_name": name} for name in names]}
+
+    def _delete_descriptor(self, body):
+        descriptor_set = self._set(body["set"])
+        rows = descriptor_set.matching_rows(body.get("constraints", {}))
+        return {"status": 0, "count": descriptor_set.delete(rows.tolist())}
+
+    def _find_descriptor(self, body, query):
+        descriptor_set = self._set(body["set"])
+        results = body.get("results", {})
+        entities, vectors = [], []
+        if query is None:
+            rows = descriptor_set.matching_rows(body.get("constraints", {}))
+            hits = [(row, None) for row in rows.tolist()]
+        else:
+            hits = descriptor_set.search(query, body["k_neighbors"], body.get("constraints"))
+        for row, distance in hits:
+            props = descriptor_set.properties[row]
+            if results.get("all_properties"):
+                entity = dict(props)
+            else:
+                entity = {key: props[key] for key in results.get("list", []) if key in props}
+            if body.get("distances") and distance is not None:
+                entity["_distance"] = distance
+            entities.append(entity)
+            if results.get("blobs"):
+                vectors.append(np.asarray(descriptor_set.vectors[row]).tobytes())
+        return {"status": 0, "returned": len(entities), "entities": entities}, vectors